@@ -1,35 +1,324 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, g, request, jsonify, has_request_context, send_file, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from flask_jwt_extended import JWTManager, create_access_token, decode_token, jwt_required, get_jwt_identity
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from sqlalchemy import bindparam, case, event, func, insert, inspect, text, tuple_, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import gzip
+import functools
+import hashlib
+import heapq
+import hmac
 import os
+import queue
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
-import google.generativeai as genai
-from google.auth.transport import requests
-from google.oauth2 import id_token
+import json
+import socketio as python_socketio
+from flask.json.provider import DefaultJSONProvider
+
+# Optional faster encoders
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Load environment variables
 load_dotenv()
 
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson for API bodies; indented (debug) output falls back to the standard encoder
+    def dumps(self, obj, **kwargs):
+        if 'indent' in kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if self.sort_keys else 0)
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///one_in_one.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=30)
 
+# Behind a reverse proxy every request arrives from the proxy's address; trust this many
+# X-Forwarded-For hops so request.remote_addr (and the login limiter) sees the real client
+PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', '0'))
+if PROXY_FIX_X_FOR:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_FIX_X_FOR)
+
+# Database engine configuration
+def engine_options(url):
+    # SQLite is tuned per connection below; server databases get a sized, recycled pool
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE_SECONDS', '1800')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT_SECONDS', '30')),
+        'pool_pre_ping': True
+    }
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+if os.getenv('DATABASE_READ_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': {'url': os.getenv('DATABASE_READ_URL'), **engine_options(os.getenv('DATABASE_READ_URL'))}
+    }
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the writer; busy_timeout waits for locks instead of failing
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}")
+        cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000'))}")
+        cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+        cursor.close()
+
+class RoutingSession(FlaskSQLAlchemySession):
+    # Reads made while serving a GET route go to the read replica when one is configured
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and 'replica' in self._db.engines and uses_read_replica(clause):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def uses_read_replica(clause):
+    # Socket.IO events also arrive as GET requests but may write, so they stay on the primary
+    return (
+        has_request_context()
+        and request.method == 'GET'
+        and getattr(request, 'sid', None) is None
+        and not isinstance(clause, UpdateBase)
+    )
+
+# Metrics
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_MS', '0')) / 1000
+
+class Metrics:
+    # In-process counters and cumulative histograms rendered in Prometheus text format
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            index = bisect_left(buckets, value)
+            if index < len(buckets):
+                histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def render(self):
+        def labels_text(labels, extra=()):
+            pairs = [f'{key}="{value}"' for key, value in (*labels, *extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+        
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (buckets, list(counts), total, count)) for key, (buckets, counts, total, count) in self.histograms.items())
+        
+        lines = []
+        described = set()
+        def header(name):
+            if name in self.help and name not in described:
+                kind, text = self.help[name]
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                described.add(name)
+        
+        for (name, labels), value in counters:
+            header(name)
+            lines.append(f'{name}{labels_text(labels)} {value:g}')
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{name}_bucket{labels_text(labels, [("le", f"{bound:g}")])} {cumulative}')
+            lines.append(f'{name}_bucket{labels_text(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{labels_text(labels)} {total:.6f}')
+            lines.append(f'{name}_count{labels_text(labels)} {count}')
+        for name, read in sorted(self.gauges.items()):
+            header(name)
+            lines.append(f'{name} {read():g}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'HTTP request latency by route')
+metrics.describe('http_request_db_queries', 'histogram', 'Database queries issued per HTTP request')
+metrics.describe('db_query_duration_seconds', 'histogram', 'Database query latency by route or socket event')
+metrics.describe('db_slow_queries_total', 'counter', 'Queries slower than SLOW_QUERY_MS')
+metrics.describe('socketio_events_total', 'counter', 'Socket.IO events received by name')
+metrics.describe('socketio_event_duration_seconds', 'histogram', 'Socket.IO handler latency by event')
+metrics.describe('socketio_emits_total', 'counter', 'Socket.IO events emitted by name')
+metrics.describe('gemini_request_duration_seconds', 'histogram', 'Gemini call latency by mode and outcome')
+metrics.describe('gemini_time_to_first_token_seconds', 'histogram', 'Time from a streaming Gemini call to its first chunk')
+
+def metrics_scope():
+    # Queries are attributed to the route or socket event being served, else to background work
+    if not has_request_context():
+        return 'background'
+    if 'metrics_scope' in g:
+        return g.metrics_scope
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    scope = metrics_scope()
+    metrics.observe('db_query_duration_seconds', elapsed, scope=scope)
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        metrics.inc('db_slow_queries_total', scope=scope)
+        print(f"Slow query ({elapsed * 1000:.1f} ms, {scope}): {' '.join(statement.split())[:500]}")
+
+@event.listens_for(Engine, 'handle_error')
+def discard_query_timer(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    if 'request_started' in g and request.url_rule is not None and request.url_rule.rule != '/metrics':
+        route = request.url_rule.rule
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_started,
+                        method=request.method, route=route, status=response.status_code)
+        metrics.observe('http_request_db_queries', g.get('query_count', 0), QUERY_COUNT_BUCKETS, route=route)
+    return response
+
 # Initialize extensions
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 jwt = JWTManager(app)
 CORS(app, origins=['http://localhost:3000', 'https://your-vercel-domain.vercel.app'])
-socketio = SocketIO(app, cors_allowed_origins=['http://localhost:3000', 'https://your-vercel-domain.vercel.app'])
 
-# Configure Gemini AI
-genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+# Cross-process Socket.IO fan-out
+class MemoryPubSubManager(python_socketio.PubSubManager):
+    # Shares room broadcasts between Socket.IO servers in one process (tests, local runs)
+    name = 'memory'
+    channels = {}
+    channels_lock = threading.Lock()
+
+    def __init__(self, url='memory://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.inbox = queue.Queue()
+        if not write_only:
+            with self.channels_lock:
+                self.channels.setdefault(channel, []).append(self.inbox)
+
+    def _publish(self, data):
+        # Serialize like a real broker would so subscribers never share mutable payloads
+        message = json.dumps(data)
+        with self.channels_lock:
+            subscribers = list(self.channels.get(self.channel, []))
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _listen(self):
+        while True:
+            yield self.inbox.get()
+
+# threading for the development server; wsgi.py switches to gevent or eventlet after monkey patching
+ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+GREEN_ASYNC_MODES = {'gevent', 'gevent_uwsgi', 'eventlet'}
+
+def socketio_options():
+    # SOCKETIO_MESSAGE_QUEUE selects the fan-out backend: memory://, redis://, kafka://, zmq+tcp:// or any kombu URL
+    options = {
+        'async_mode': ASYNC_MODE,
+        'cors_allowed_origins': ['http://localhost:3000', 'https://your-vercel-domain.vercel.app']
+    }
+    url = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    channel = os.getenv('SOCKETIO_CHANNEL', 'flask-socketio')
+    if url and url.startswith('memory://'):
+        options['client_manager'] = MemoryPubSubManager(url, channel=channel)
+    elif url:
+        options['message_queue'] = url
+        options['channel'] = channel
+    return options
+
+class InstrumentedSocketIO(SocketIO):
+    # Counts and times every registered handler, and counts outgoing events
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+        
+        def decorator(handler):
+            @functools.wraps(handler)
+            def timed_handler(*args):
+                g.metrics_scope = f'socket:{message}'
+                metrics.inc('socketio_events_total', event=message)
+                started = time.perf_counter()
+                try:
+                    return handler(*args)
+                finally:
+                    metrics.observe('socketio_event_duration_seconds', time.perf_counter() - started, event=message)
+            return register(timed_handler)
+        return decorator
+
+    def emit(self, event, *args, **kwargs):
+        metrics.inc('socketio_emits_total', event=event)
+        return super().emit(event, *args, **kwargs)
+
+socketio = InstrumentedSocketIO(app, **socketio_options())
 
 # Database Models
 class User(db.Model):
@@ -40,7 +329,7 @@ class User(db.Model):
     display_name = db.Column(db.String(100), nullable=False)
     profile_photo = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     is_online = db.Column(db.Boolean, default=False)
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -68,14 +357,20 @@ class Chat(db.Model):
     # Relationships
     participants = db.relationship('ChatParticipant', backref='chat', lazy=True, cascade='all, delete-orphan')
     messages = db.relationship('Message', backref='chat', lazy=True, cascade='all, delete-orphan', foreign_keys='Message.chat_id')
+    last_message = db.relationship('Message', foreign_keys=[last_message_id], post_update=True)
 
-    def to_dict(self):
+    def to_dict(self, compact=False):
+        # Compact mode refers to users by id; the caller ships them once in a side table
         return {
             'id': self.id,
             'name': self.name,
             'isGroup': self.is_group,
-            'participants': [p.user.to_dict() for p in self.participants],
-            'lastMessage': self.messages[-1].to_dict() if self.messages else None,
+            'participants': [p.user_id if compact else user_cache.get(p.user_id, lambda: p.user) for p in self.participants],
+            'lastMessage': self.last_message.to_dict(compact) if self.last_message else None,
+            'receipts': [
+                {'userId': p.user_id, 'delivered': p.last_delivered_message_id or 0, 'read': p.last_read_message_id or 0}
+                for p in self.participants
+            ],
             'createdAt': self.created_at.isoformat(),
             'updatedAt': self.updated_at.isoformat()
         }
@@ -86,10 +381,18 @@ class ChatParticipant(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_admin = db.Column(db.Boolean, default=False)
+    # Receipt high-water marks: the newest message id this member has received and has read
+    last_delivered_message_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    last_read_message_id = db.Column(db.Integer, default=0, server_default='0', nullable=False)
 
     # Relationships
     user = db.relationship('User', backref='chat_participations')
 
+    __table_args__ = (
+        db.Index('uq_chat_participant_chat_user', 'chat_id', 'user_id', unique=True),
+        db.Index('ix_chat_participant_user', 'user_id'),
+    )
+
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
@@ -98,26 +401,52 @@ class Message(db.Model):
     message_type = db.Column(db.String(20), default='text')  # text, image, video, audio, file
     message_metadata = db.Column(db.JSON)  # For file info, reactions, etc.
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.String(20), default='sent')  # sent, delivered, read
+    status = db.Column(db.String(20), default='sent')  # Stored value is never advanced; see attach_receipt_status()
     is_ai_generated = db.Column(db.Boolean, default=False)
 
     # Relationships
     sender = db.relationship('User', backref='messages')
     reactions = db.relationship('MessageReaction', backref='message', lazy=True, cascade='all, delete-orphan')
+    reaction_counts = db.relationship('MessageReactionCount', lazy=True, cascade='all, delete-orphan',
+                                      order_by=lambda: (MessageReactionCount.count.desc(), MessageReactionCount.emoji))
 
-    def to_dict(self):
-        return {
+    # Keyset pagination walks a chat's history in (timestamp, id) order; receipt marks use the highest id
+    __table_args__ = (
+        db.Index('ix_message_chat_timestamp_id', 'chat_id', 'timestamp', 'id'),
+        db.Index('ix_message_chat_id', 'chat_id', 'id'),
+    )
+
+    def to_dict(self, compact=False):
+        data = {
             'id': self.id,
             'chatId': self.chat_id,
-            'sender': self.sender.to_dict(),
             'content': self.content,
             'type': self.message_type,
-            'metadata': self.message_metadata or {},
+            'metadata': sign_media_metadata(self.message_metadata),
             'timestamp': self.timestamp.isoformat(),
-            'status': self.status,
+            'status': getattr(self, 'receipt_status', self.status),
             'isAiGenerated': self.is_ai_generated,
-            'reactions': [r.to_dict() for r in self.reactions]
+            'reactions': self.reaction_summary(compact)
         }
+        if compact:
+            data['senderId'] = self.sender_id
+        else:
+            data['sender'] = user_cache.get(self.sender_id, lambda: self.sender)
+        return data
+
+    def reaction_summary(self, compact=False):
+        # Per-emoji totals; the caller's own reactions and sample users come from attach_reaction_details()
+        details = getattr(self, 'reaction_details', {})
+        summary = []
+        for counter in self.reaction_counts:
+            reacted, users = details.get(counter.emoji, (False, []))
+            summary.append({
+                'emoji': counter.emoji,
+                'count': counter.count,
+                'reacted': reacted,
+                'users': [user_id if compact else user_cache.get(user_id) for user_id in users]
+            })
+        return summary
 
 class MessageReaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -129,13 +458,58 @@ class MessageReaction(db.Model):
     # Relationships
     user = db.relationship('User', backref='message_reactions')
 
-    def to_dict(self):
-        return {
+    __table_args__ = (
+        db.Index('ix_message_reaction_message', 'message_id'),
+        db.Index('uq_message_reaction_message_emoji_user', 'message_id', 'emoji', 'user_id', unique=True),
+    )
+
+    def to_dict(self, compact=False):
+        data = {
             'id': self.id,
             'emoji': self.emoji,
-            'user': self.user.to_dict(),
             'createdAt': self.created_at.isoformat()
         }
+        if compact:
+            data['userId'] = self.user_id
+        else:
+            data['user'] = user_cache.get(self.user_id, lambda: self.user)
+        return data
+
+class MessageReactionCount(db.Model):
+    # Reaction totals per (message, emoji), kept in step with MessageReaction rows
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), primary_key=True)
+    emoji = db.Column(db.String(10), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ChatInbox(db.Model):
+    # Denormalized per-user chat list, maintained on every message write
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    last_message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)
+    last_message_preview = db.Column(db.String(200))
+    last_activity_at = db.Column(db.DateTime, default=datetime.utcnow)
+    unread_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    chat = db.relationship('Chat', backref=db.backref('inbox_entries', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'chat_id', name='uq_chat_inbox_user_chat'),
+        db.Index('ix_chat_inbox_user_activity', 'user_id', 'last_activity_at'),
+        db.Index('ix_chat_inbox_user_updated', 'user_id', 'updated_at'),
+        db.Index('ix_chat_inbox_chat', 'chat_id'),
+    )
+
+    def to_dict(self, compact=False):
+        data = self.chat.to_dict(compact)
+        data.update({
+            'unreadCount': self.unread_count,
+            'lastMessagePreview': self.last_message_preview,
+            'lastActivityAt': self.last_activity_at.isoformat() if self.last_activity_at else None
+        })
+        return data
 
 class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -150,6 +524,10 @@ class Note(db.Model):
     # Relationships
     user = db.relationship('User', backref='notes')
 
+    __table_args__ = (
+        db.Index('ix_note_user_updated', 'user_id', 'updated_at'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -161,6 +539,1534 @@ class Note(db.Model):
             'updatedAt': self.updated_at.isoformat()
         }
 
+class SyncTombstone(db.Model):
+    # Records hard deletes so delta sync clients can drop their local copies
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    entity = db.Column(db.String(20), nullable=False)  # note, chat
+    entity_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_sync_tombstone_user_deleted', 'user_id', 'deleted_at'),
+    )
+
+class MediaAsset(db.Model):
+    # One row and one file per distinct upload, keyed by the SHA-256 of its bytes
+    id = db.Column(db.String(64), primary_key=True)
+    uploader_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    mimetype = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    has_thumbnail = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def kind(self):
+        kind = self.mimetype.split('/')[0]
+        return kind if kind in MEDIA_KINDS and self.mimetype not in MEDIA_UNSAFE_TYPES else 'file'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'mimetype': self.mimetype,
+            'size': self.size,
+            'width': self.width,
+            'height': self.height,
+            'url': signed_media_url(self.id),
+            'thumbnailUrl': signed_media_url(self.id, 'thumbnail') if self.kind == 'image' else None
+        }
+
+class PresenceSession(db.Model):
+    # One row per (worker process, user) with open sockets; rows a dead worker stops refreshing expire
+    worker_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_presence_session_user_expires', 'user_id', 'expires_at'),
+        db.Index('ix_presence_session_expires', 'expires_at'),
+    )
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Serialized users shared by the REST routes and every serializer that embeds a user
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL_SECONDS', '30'))
+
+class UserCache:
+    # Bounded LRU of User.to_dict() by id. Writers call put() or invalidate(); the TTL bounds
+    # staleness for changes made by other worker processes.
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # user id -> (expiry, serialized user)
+        self.lock = threading.Lock()
+
+    def lookup(self, user_id, now):
+        entry = self.entries.get(user_id)
+        if entry and entry[0] > now:
+            self.entries.move_to_end(user_id)
+            return entry[1]
+        return None
+
+    def get(self, user_id, loader=None):
+        # loader supplies the row on a miss (e.g. an already loaded relationship) instead of a primary-key query
+        user_id = int(user_id)
+        with self.lock:
+            data = self.lookup(user_id, time.monotonic())
+        metrics.inc('user_cache_requests_total', result='hit' if data is not None else 'miss')
+        if data is not None:
+            return data
+        user = loader() if loader else db.session.get(User, user_id)
+        return self.put(user) if user else None
+
+    def get_many(self, user_ids):
+        # Hits come from memory; all misses load in one query
+        now = time.monotonic()
+        found, missing = {}, []
+        with self.lock:
+            for user_id in {int(user_id) for user_id in user_ids}:
+                data = self.lookup(user_id, now)
+                if data is not None:
+                    found[user_id] = data
+                else:
+                    missing.append(user_id)
+        metrics.inc('user_cache_requests_total', len(found), result='hit')
+        metrics.inc('user_cache_requests_total', len(missing), result='miss')
+        if missing:
+            for user in User.query.filter(User.id.in_(missing)):
+                found[user.id] = self.put(user)
+        return found
+
+    def put(self, user):
+        data = user.to_dict()
+        with self.lock:
+            self.entries[user.id] = (time.monotonic() + self.ttl, data)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return data
+
+    def invalidate(self, *user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.entries.pop(int(user_id), None)
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+metrics.describe('user_cache_requests_total', 'counter', 'User cache lookups by result')
+metrics.describe('user_cache_entries', 'gauge', 'Users held in the serialized user cache')
+metrics.gauge('user_cache_entries', lambda: len(user_cache.entries))
+
+# Eager-loading options so to_dict() serializes a whole result set in a fixed number of queries.
+# Users are not joined in: referenced_users() fetches them through the user cache.
+def message_load_options():
+    return [
+        selectinload(Message.reaction_counts)
+    ]
+
+def chat_load_options():
+    last_message = selectinload(Chat.last_message)
+    return [
+        selectinload(Chat.participants),
+        last_message.selectinload(Message.reaction_counts)
+    ]
+
+# Bulk import and export
+IMPORT_BATCH_SIZE = int(os.getenv('MESSAGE_IMPORT_BATCH_SIZE', '500'))
+EXPORT_PAGE_SIZE = int(os.getenv('MESSAGE_EXPORT_PAGE_SIZE', '500'))
+
+def parse_import_line(line, chat_id, user_id, is_admin=False):
+    data = json.loads(line)
+    content = data.get('content')
+    message_type = data.get('type', 'text')
+    if not content or message_type not in MESSAGE_TYPES:
+        raise ValueError('content is required and type must be one of ' + ', '.join(sorted(MESSAGE_TYPES)))
+    
+    # Only chat admins may import messages on behalf of other members
+    sender_id = int(data.get('senderId', user_id))
+    if sender_id != int(user_id):
+        if not is_admin:
+            raise ValueError('only chat admins may set senderId to another member')
+        if not is_chat_member(chat_id, sender_id):
+            raise ValueError('senderId must be a chat participant')
+    
+    timestamp = data.get('timestamp')
+    return {
+        'chat_id': chat_id,
+        'sender_id': sender_id,
+        'content': content,
+        'message_type': message_type,
+        'message_metadata': data.get('metadata') or {},
+        'timestamp': datetime.fromisoformat(timestamp.replace('Z', '+00:00')).replace(tzinfo=None) if timestamp else datetime.utcnow(),
+        'status': data.get('status', 'sent'),
+        'is_ai_generated': bool(data.get('isAiGenerated', False))
+    }
+
+def refresh_chat_summary(chat_id):
+    # Point the chat and its inbox entries at the newest message, without touching unread counts
+    last_message = Message.query.filter_by(chat_id=chat_id).order_by(
+        Message.timestamp.desc(), Message.id.desc()
+    ).first()
+    if not last_message:
+        return
+    Chat.query.filter_by(id=chat_id).update({
+        Chat.last_message_id: last_message.id,
+        Chat.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    ChatInbox.query.filter_by(chat_id=chat_id).update({
+        ChatInbox.last_message_id: last_message.id,
+        ChatInbox.last_message_preview: last_message.content[:INBOX_PREVIEW_LENGTH],
+        ChatInbox.last_activity_at: last_message.timestamp
+    }, synchronize_session=False)
+
+# Reaction aggregates
+REACTION_SAMPLE_SIZE = int(os.getenv('REACTION_SAMPLE_SIZE', '3'))
+
+def attach_reaction_details(messages, viewer_id):
+    # One windowed query fetches the newest reactors per emoji plus the viewer's own reactions
+    messages = [message for message in messages if message is not None and message.reaction_counts]
+    if not messages:
+        return
+    viewer_id = int(viewer_id)
+    ranked = db.select(
+        MessageReaction.id,
+        func.row_number().over(
+            partition_by=(MessageReaction.message_id, MessageReaction.emoji),
+            order_by=MessageReaction.id.desc()
+        ).label('rank')
+    ).where(MessageReaction.message_id.in_([message.id for message in messages])).subquery()
+    reactions = MessageReaction.query.join(ranked, ranked.c.id == MessageReaction.id).filter(
+        db.or_(ranked.c.rank <= REACTION_SAMPLE_SIZE, MessageReaction.user_id == viewer_id)
+    ).order_by(ranked.c.rank)
+    
+    details = {message.id: {} for message in messages}
+    for reaction in reactions:
+        reacted, sample = details[reaction.message_id].setdefault(reaction.emoji, (False, []))
+        if len(sample) < REACTION_SAMPLE_SIZE:
+            sample.append(reaction.user_id)
+        if reaction.user_id == viewer_id:
+            details[reaction.message_id][reaction.emoji] = (True, sample)
+    for message in messages:
+        message.reaction_details = details[message.id]
+
+def upsert_reaction_count(message_id, emoji, delta):
+    # Concurrent first reactions for an emoji must land on one row, so the insert and the increment
+    # happen in one statement instead of UPDATE, then INSERT if no row matched
+    counts = MessageReactionCount.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite if dialect == 'sqlite' else postgresql).insert(counts).values(
+            message_id=message_id, emoji=emoji, count=delta
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[counts.c.message_id, counts.c.emoji], set_={'count': counts.c.count + delta}
+        )
+    elif dialect in ('mysql', 'mariadb'):
+        statement = mysql.insert(counts).values(message_id=message_id, emoji=emoji, count=delta)
+        statement = statement.on_duplicate_key_update(count=counts.c.count + delta)
+    else:
+        updated = db.session.execute(
+            counts.update().where(counts.c.message_id == message_id, counts.c.emoji == emoji).values(count=counts.c.count + delta)
+        ).rowcount
+        if updated:
+            return
+        statement = insert(counts).values(message_id=message_id, emoji=emoji, count=delta)
+    db.session.execute(statement)
+
+def adjust_reaction_count(message_id, emoji, delta):
+    # Update the counter in place; the first reaction for an emoji creates its row
+    if delta > 0:
+        upsert_reaction_count(message_id, emoji, delta)
+    else:
+        MessageReactionCount.query.filter_by(message_id=message_id, emoji=emoji).update(
+            {MessageReactionCount.count: MessageReactionCount.count + delta}, synchronize_session=False
+        )
+        MessageReactionCount.query.filter(
+            MessageReactionCount.message_id == message_id,
+            MessageReactionCount.emoji == emoji,
+            MessageReactionCount.count <= 0
+        ).delete(synchronize_session=False)
+    db.session.flush()
+    return db.session.query(MessageReactionCount.count).filter_by(message_id=message_id, emoji=emoji).scalar() or 0
+
+def backfill_reaction_counts():
+    # Collapse duplicate reactions, enforce one per user and emoji, then rebuild the counters
+    MessageReactionCount.__table__.create(db.engine, checkfirst=True)
+    db.session.execute(text(
+        "DELETE FROM message_reaction WHERE id NOT IN "
+        "(SELECT MIN(id) FROM message_reaction GROUP BY message_id, emoji, user_id)"
+    ))
+    db.session.commit()
+    for index in MessageReaction.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    MessageReactionCount.query.delete(synchronize_session=False)
+    db.session.execute(insert(MessageReactionCount).from_select(
+        ['message_id', 'emoji', 'count'],
+        db.select(MessageReaction.message_id, MessageReaction.emoji, func.count())
+        .group_by(MessageReaction.message_id, MessageReaction.emoji)
+    ))
+
+# Compact wire format
+def wants_compact():
+    return request.args.get('compact', '').lower() in ('1', 'true')
+
+def referenced_users(messages=(), chats=()):
+    # Every user a payload refers to, keyed by id: the compact side table, and a single
+    # batched fill of the user cache before to_dict() runs
+    user_ids = set()
+    messages = list(messages)
+    for chat in chats:
+        user_ids.update(participant.user_id for participant in chat.participants)
+        if chat.last_message:
+            messages.append(chat.last_message)
+    for message in messages:
+        user_ids.add(message.sender_id)
+        for _, sample in getattr(message, 'reaction_details', {}).values():
+            user_ids.update(sample)
+    return {str(user_id): data for user_id, data in user_cache.get_many(user_ids).items()}
+
+# Response encoding
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_MIMETYPES = {'application/json', 'application/x-ndjson'}
+
+@app.after_request
+def compress_response(response):
+    # Negotiate brotli (when installed) or gzip for buffered JSON bodies worth compressing
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code >= 300
+        or response.mimetype not in COMPRESS_MIMETYPES
+        or 'Content-Encoding' in response.headers
+        or response.content_length is None
+        or response.content_length < COMPRESS_MIN_SIZE
+    ):
+        return response
+    
+    # The body now depends on Accept-Encoding whichever encoding is picked, identity included
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(response.get_data(), quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Chat inbox maintenance
+INBOX_PREVIEW_LENGTH = 200
+
+def record_inbox_messages(chat_id, messages):
+    # Bump every participant's inbox entry in one UPDATE; only recipients gain unreads
+    last_message = messages[-1]
+    sent_by = Counter(int(message.sender_id) for message in messages)
+    ChatInbox.query.filter_by(chat_id=chat_id).update({
+        ChatInbox.last_message_id: last_message.id,
+        ChatInbox.last_message_preview: (last_message.content or '')[:INBOX_PREVIEW_LENGTH],
+        ChatInbox.last_activity_at: last_message.timestamp,
+        ChatInbox.unread_count: ChatInbox.unread_count + len(messages) - case(
+            sent_by, value=ChatInbox.user_id, else_=0
+        )
+    }, synchronize_session=False)
+
+def backfill_inbox():
+    # Create inbox entries for participations that predate the inbox table. Select plain columns:
+    # this step runs before later migrations add columns to the mapped tables
+    missing = db.session.query(
+        ChatParticipant.chat_id, ChatParticipant.user_id, Chat.last_message_id, Chat.updated_at, Message.content
+    ).join(Chat, Chat.id == ChatParticipant.chat_id).outerjoin(
+        Message, Message.id == Chat.last_message_id
+    ).outerjoin(
+        ChatInbox,
+        (ChatInbox.chat_id == ChatParticipant.chat_id) & (ChatInbox.user_id == ChatParticipant.user_id)
+    ).filter(ChatInbox.id.is_(None)).all()
+    
+    if missing:
+        db.session.execute(insert(ChatInbox), [
+            {
+                'user_id': row.user_id,
+                'chat_id': row.chat_id,
+                'last_message_id': row.last_message_id,
+                'last_message_preview': row.content[:INBOX_PREVIEW_LENGTH] if row.content is not None else None,
+                'last_activity_at': row.updated_at
+            }
+            for row in missing
+        ])
+    db.session.commit()
+
+# Full-text search
+SEARCH_PAGE_DEFAULT = 20
+SEARCH_PAGE_MAX = 100
+
+# SQLite FTS5 indexes backed by the message and note tables, kept in sync by triggers
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "content, content='message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON message BEGIN "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF content ON message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO message_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5("
+    "title, content, tags, content='note', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note BEGIN "
+    "INSERT INTO note_fts(rowid, title, content, tags) VALUES (new.id, new.title, new.content, new.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, title, content, tags) "
+    "VALUES ('delete', old.id, old.title, old.content, old.tags); END",
+    "CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE ON note BEGIN "
+    "INSERT INTO note_fts(note_fts, rowid, title, content, tags) "
+    "VALUES ('delete', old.id, old.title, old.content, old.tags); "
+    "INSERT INTO note_fts(rowid, title, content, tags) VALUES (new.id, new.title, new.content, new.tags); END"
+]
+
+def fts_enabled():
+    return db.engine.dialect.name == 'sqlite'
+
+def init_search_index():
+    if not fts_enabled():
+        return
+    existing = db.session.execute(text(
+        "SELECT name FROM sqlite_master WHERE name IN ('message_fts', 'note_fts')"
+    )).scalars().all()
+    for statement in FTS_SCHEMA:
+        db.session.execute(text(statement))
+    # Index rows that predate the FTS tables
+    if 'message_fts' not in existing:
+        db.session.execute(text("INSERT INTO message_fts(message_fts) VALUES ('rebuild')"))
+    if 'note_fts' not in existing:
+        db.session.execute(text("INSERT INTO note_fts(note_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+# PostgreSQL uses GIN expression indexes instead; queries must repeat these expressions exactly to use them
+MESSAGE_TSVECTOR = "to_tsvector('simple', message.content)"
+NOTE_TSVECTOR = (
+    "setweight(to_tsvector('simple', note.title), 'A') || "
+    "setweight(coalesce(to_tsvector('simple', note.tags), ''::tsvector), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(note.content, '')), 'C')"
+)
+TS_HEADLINE_OPTIONS = 'StartSel="", StopSel="", MaxWords=12, MinWords=4, ShortWord=0'
+
+def tsvector_enabled():
+    return db.engine.dialect.name == 'postgresql'
+
+def init_tsvector_index():
+    if not tsvector_enabled():
+        return
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_message_fts ON message USING gin (({MESSAGE_TSVECTOR}))"))
+    db.session.execute(text(f"CREATE INDEX IF NOT EXISTS ix_note_fts ON note USING gin (({NOTE_TSVECTOR}))"))
+
+def search_terms(query):
+    return re.findall(r'\w+', query.casefold())[:10]
+
+def fts_match(terms):
+    # Quote every term so user input can't inject FTS syntax; the last term matches as a prefix
+    return ' '.join(f'"{term}"' for term in terms) + '*'
+
+def tsquery(terms):
+    # Terms are \w+ only, so they cannot carry tsquery operators; the last term matches as a prefix
+    return ' & '.join(terms) + ':*'
+
+def search_messages(user_id, terms, limit, offset):
+    # Returns [(message id, snippet)] ranked best first, limited to the user's chats
+    if fts_enabled():
+        return db.session.execute(text(
+            "SELECT message.id, snippet(message_fts, 0, '', '', '…', 12) "
+            "FROM message_fts "
+            "JOIN message ON message.id = message_fts.rowid "
+            "JOIN chat_participant ON chat_participant.chat_id = message.chat_id "
+            "WHERE message_fts MATCH :match AND chat_participant.user_id = :user_id "
+            "ORDER BY bm25(message_fts) LIMIT :limit OFFSET :offset"
+        ), {'match': fts_match(terms), 'user_id': user_id, 'limit': limit, 'offset': offset}).all()
+    
+    if tsvector_enabled():
+        # Rank inside the subquery so ts_headline only runs on the returned page
+        return db.session.execute(text(
+            "SELECT hit.id, ts_headline('simple', hit.content, to_tsquery('simple', :query), :headline) FROM ("
+            f"SELECT message.id, message.content, ts_rank({MESSAGE_TSVECTOR}, to_tsquery('simple', :query)) AS rank "
+            "FROM message "
+            "JOIN chat_participant ON chat_participant.chat_id = message.chat_id "
+            f"WHERE {MESSAGE_TSVECTOR} @@ to_tsquery('simple', :query) AND chat_participant.user_id = :user_id "
+            "ORDER BY rank DESC LIMIT :limit OFFSET :offset"
+            ") AS hit ORDER BY hit.rank DESC"
+        ), {'query': tsquery(terms), 'headline': TS_HEADLINE_OPTIONS, 'user_id': user_id, 'limit': limit, 'offset': offset}).all()
+    
+    # Other databases fall back to a substring scan over every message in the user's chats, newest first
+    query = db.session.query(Message.id, Message.content).join(
+        ChatParticipant, ChatParticipant.chat_id == Message.chat_id
+    ).filter(ChatParticipant.user_id == user_id)
+    for term in terms:
+        query = query.filter(Message.content.ilike(f'%{term}%'))
+    return query.order_by(Message.timestamp.desc()).limit(limit).offset(offset).all()
+
+def search_notes(user_id, terms, limit, offset):
+    if fts_enabled():
+        return db.session.execute(text(
+            "SELECT note.id, snippet(note_fts, -1, '', '', '…', 12) "
+            "FROM note_fts "
+            "JOIN note ON note.id = note_fts.rowid "
+            "WHERE note_fts MATCH :match AND note.user_id = :user_id "
+            "ORDER BY bm25(note_fts, 5.0, 1.0, 2.0) LIMIT :limit OFFSET :offset"
+        ), {'match': fts_match(terms), 'user_id': user_id, 'limit': limit, 'offset': offset}).all()
+    
+    if tsvector_enabled():
+        return db.session.execute(text(
+            "SELECT hit.id, ts_headline('simple', coalesce(hit.content, hit.title), to_tsquery('simple', :query), :headline) FROM ("
+            f"SELECT note.id, note.title, note.content, ts_rank({NOTE_TSVECTOR}, to_tsquery('simple', :query)) AS rank "
+            "FROM note "
+            f"WHERE {NOTE_TSVECTOR} @@ to_tsquery('simple', :query) AND note.user_id = :user_id "
+            "ORDER BY rank DESC LIMIT :limit OFFSET :offset"
+            ") AS hit ORDER BY hit.rank DESC"
+        ), {'query': tsquery(terms), 'headline': TS_HEADLINE_OPTIONS, 'user_id': user_id, 'limit': limit, 'offset': offset}).all()
+    
+    query = db.session.query(Note.id, Note.content).filter(Note.user_id == user_id)
+    for term in terms:
+        query = query.filter(Note.title.ilike(f'%{term}%') | Note.content.ilike(f'%{term}%'))
+    return query.order_by(Note.updated_at.desc()).limit(limit).offset(offset).all()
+
+# User search index
+USER_INDEX_SYNC_INTERVAL = float(os.getenv('USER_INDEX_SYNC_SECONDS', '5'))
+
+class UserSearchIndex:
+    # In-memory 2/3-gram index over usernames and display names
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.names = {}  # user id -> (username, display name), casefolded
+        self.grams = {}  # gram -> set of user ids
+        self.loaded = False
+        self.synced_at = None  # newest User.updated_at indexed so far
+        self.checked_at = 0.0
+
+    @staticmethod
+    def grams_of(value):
+        return {value[i:i + n] for n in (2, 3) for i in range(len(value) - n + 1)}
+
+    def add(self, user_id, username, display_name):
+        with self.lock:
+            self.remove(user_id)
+            names = (username.casefold(), (display_name or '').casefold())
+            self.names[user_id] = names
+            for gram in self.grams_of(names[0]) | self.grams_of(names[1]):
+                self.grams.setdefault(gram, set()).add(user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            names = self.names.pop(user_id, None)
+            if not names:
+                return
+            for gram in self.grams_of(names[0]) | self.grams_of(names[1]):
+                postings = self.grams.get(gram)
+                if postings is not None:
+                    postings.discard(user_id)
+                    if not postings:
+                        del self.grams[gram]
+
+    def sync(self):
+        # Full load on first use, then pick up users changed by other workers via the updated_at index
+        if self.loaded and time.monotonic() - self.checked_at < USER_INDEX_SYNC_INTERVAL:
+            return
+        with self.lock:
+            query = db.session.query(User.id, User.username, User.display_name, User.updated_at)
+            if self.synced_at:
+                query = query.filter(User.updated_at >= self.synced_at)
+            for row in query:
+                self.add(row.id, row.username, row.display_name)
+                if self.loaded:
+                    # Changed elsewhere; drop the cached copy so results don't show the old name
+                    user_cache.invalidate(row.id)
+                if row.updated_at and (self.synced_at is None or row.updated_at > self.synced_at):
+                    self.synced_at = row.updated_at
+            self.loaded = True
+            self.checked_at = time.monotonic()
+
+    def search(self, query, exclude_id=None, limit=10):
+        # Returns up to limit user ids: exact username, username prefix, name-word prefix, then substring
+        self.sync()
+        needle = query.casefold()
+        grams = [needle] if len(needle) <= 3 else [needle[i:i + 3] for i in range(len(needle) - 2)]
+        with self.lock:
+            postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            ranked = []
+            for user_id in candidates:
+                if user_id == exclude_id:
+                    continue
+                username, display_name = self.names[user_id]
+                if needle not in username and needle not in display_name:
+                    continue
+                if username == needle:
+                    rank = 0
+                elif username.startswith(needle):
+                    rank = 1
+                elif display_name.startswith(needle) or f' {needle}' in display_name:
+                    rank = 2
+                else:
+                    rank = 3
+                ranked.append((rank, len(username), user_id))
+        return [user_id for _, _, user_id in heapq.nsmallest(limit, ranked)]
+
+user_search_index = UserSearchIndex()
+
+# Background tasks
+background_tasks = set()
+background_tasks_lock = threading.Lock()
+
+def ensure_background_task(target):
+    # Start each long-running task once per process, on first use
+    if target not in background_tasks:
+        with background_tasks_lock:
+            if target not in background_tasks:
+                socketio.start_background_task(target)
+                background_tasks.add(target)
+
+# Message write path
+MESSAGE_TYPES = {'text', 'image', 'video', 'audio', 'file'}
+MESSAGE_BATCH_WINDOW = float(os.getenv('MESSAGE_BATCH_WINDOW_MS', '25')) / 1000
+MESSAGE_BATCH_SIZE = int(os.getenv('MESSAGE_BATCH_SIZE', '100'))
+
+def persist_messages(entries):
+    # Shared by REST and Socket.IO: insert messages, then update chats and inboxes per chat.
+    # Returns the serialized messages; the caller commits and broadcasts them.
+    messages = [
+        Message(
+            chat_id=int(entry['chatId']),
+            sender_id=int(entry['userId']),
+            content=entry['content'],
+            message_type=entry.get('type', 'text'),
+            message_metadata=media_reference(entry.get('metadata')),
+            timestamp=entry.get('timestamp') or datetime.utcnow(),
+            reactions=[],
+            reaction_counts=[]  # New messages have no reactions; spares to_dict a lazy load each
+        )
+        for entry in entries
+    ]
+    db.session.add_all(messages)
+    db.session.flush()  # Get message IDs
+    
+    by_chat = {}
+    for message in messages:
+        by_chat.setdefault(message.chat_id, []).append(message)
+    
+    for chat_id, chat_messages in by_chat.items():
+        Chat.query.filter_by(id=chat_id).update({
+            Chat.last_message_id: chat_messages[-1].id,
+            Chat.updated_at: datetime.utcnow()
+        }, synchronize_session=False)
+        record_inbox_messages(chat_id, chat_messages)
+    
+    return [message.to_dict() for message in messages]
+
+def is_valid_message(data):
+    # Text needs content; media may be sent without a caption when its mediaId is a stored upload
+    message_type = data.get('type', 'text')
+    if message_type not in MESSAGE_TYPES:
+        return False
+    if data.get('content'):
+        return True
+    media_id = (data.get('metadata') or {}).get('mediaId')
+    return message_type != 'text' and bool(media_id) and db.session.get(MediaAsset, str(media_id)) is not None
+
+def reject_message(data, error):
+    # Socket sends are optimistic on the client, so every rejection is reported back to the sender
+    data = data if isinstance(data, dict) else {}
+    emit('message_error', {'chatId': data.get('chatId'), 'clientId': data.get('clientId'), 'error': error})
+    return False
+
+def broadcast_messages(payloads, client_ids=None):
+    for index, payload in enumerate(payloads):
+        if client_ids and client_ids[index]:
+            payload = dict(payload, clientId=client_ids[index])
+        socketio.emit('message', payload, room=f"chat_{payload['chatId']}")
+
+message_queue = queue.Queue()
+metrics.describe('message_ingest_queue_depth', 'gauge', 'Socket messages waiting for the next group commit')
+metrics.gauge('message_ingest_queue_depth', message_queue.qsize)
+
+def enqueue_message(entry):
+    ensure_background_task(run_message_ingest)
+    message_queue.put(entry)
+
+def run_message_ingest():
+    # Group-commit socket messages: wait for one, then collect more until the window or size closes
+    while True:
+        batch = [message_queue.get()]
+        deadline = time.monotonic() + MESSAGE_BATCH_WINDOW
+        while len(batch) < MESSAGE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(message_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # A failed broadcast or error report must not end the thread; ensure_background_task never restarts it
+        with app.app_context():
+            try:
+                flush_message_batch(batch)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Message ingest error: {e}")
+
+def flush_message_batch(batch):
+    try:
+        payloads = persist_messages(batch)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Message batch error: {e}")
+        for entry in batch:
+            socketio.emit('message_error', {
+                'chatId': entry['chatId'],
+                'clientId': entry.get('clientId'),
+                'error': 'Message could not be saved'
+            }, to=entry['sid'])
+        return
+    
+    # Only committed messages are broadcast
+    broadcast_messages(payloads, [entry.get('clientId') for entry in batch])
+
+# Typing and presence aggregation
+TYPING_DIGEST_INTERVAL = float(os.getenv('TYPING_DIGEST_INTERVAL_MS', '500')) / 1000
+TYPING_TIMEOUT = float(os.getenv('TYPING_TIMEOUT_MS', '5000')) / 1000
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL_MS', '5000')) / 1000
+PRESENCE_TTL = PRESENCE_FLUSH_INTERVAL * 3  # A worker that misses this many flushes is treated as gone
+PRESENCE_WORKER_ID = uuid.uuid4().hex
+
+presence_lock = threading.Lock()
+typing_state = {}  # chat id -> {user id: typing expiry}, for sockets on this process
+typing_changes = {}  # chat id -> {user id: is typing}, pending the next digest
+user_connections = Counter()  # user id -> open sockets in this process
+presence_sessions = set()  # users this process holds a PresenceSession row for
+presence_changes = set()  # users whose connections on this process changed since the last flush
+
+def set_typing(chat_id, user_id, is_typing):
+    ensure_background_task(run_presence_aggregator)
+    user_id = int(user_id)
+    with presence_lock:
+        typers = typing_state.setdefault(chat_id, {})
+        if is_typing:
+            # Repeated keystrokes only push the expiry out
+            if user_id not in typers:
+                typing_changes.setdefault(chat_id, {})[user_id] = True
+            typers[user_id] = time.monotonic() + TYPING_TIMEOUT
+        elif typers.pop(user_id, None) is not None:
+            typing_changes.setdefault(chat_id, {})[user_id] = False
+
+def clear_typing(user_id):
+    user_id = int(user_id)
+    with presence_lock:
+        for chat_id, typers in typing_state.items():
+            if typers.pop(user_id, None) is not None:
+                typing_changes.setdefault(chat_id, {})[user_id] = False
+
+def record_presence(user_id, is_online):
+    ensure_background_task(run_presence_aggregator)
+    user_id = int(user_id)
+    with presence_lock:
+        connections = user_connections[user_id] + (1 if is_online else -1)
+        if connections > 0:
+            user_connections[user_id] = connections
+        else:
+            user_connections.pop(user_id, None)
+        presence_changes.add(user_id)
+
+def flush_typing_digests():
+    now = time.monotonic()
+    with presence_lock:
+        for chat_id, typers in list(typing_state.items()):
+            for user_id in [user_id for user_id, expiry in typers.items() if expiry <= now]:
+                del typers[user_id]
+                typing_changes.setdefault(chat_id, {})[user_id] = False
+            if not typers:
+                del typing_state[chat_id]
+        changes = dict(typing_changes)
+        typing_changes.clear()
+    if not changes:
+        return
+    
+    # Frames only carry this process's changes, so digests from several workers merge on the client
+    users = user_cache.get_many({user_id for typers in changes.values() for user_id, is_typing in typers.items() if is_typing})
+    for chat_id, typers in changes.items():
+        socketio.emit('typing', {
+            'chatId': chat_id,
+            'started': [
+                {'id': user_id, 'displayName': users[user_id]['displayName']}
+                for user_id, is_typing in typers.items() if is_typing and user_id in users
+            ],
+            'stopped': [user_id for user_id, is_typing in typers.items() if not is_typing]
+        }, room=f'chat_{chat_id}')
+
+def flush_presence():
+    now = datetime.utcnow()
+    with presence_lock:
+        connected = set(user_connections)
+        changed = set(presence_changes)
+        presence_changes.clear()
+    
+    # Refresh this process's session rows, add rows for newly connected users and drop rows for
+    # users with no sockets left here
+    sessions = PresenceSession.__table__
+    expires_at = now + timedelta(seconds=PRESENCE_TTL)
+    if presence_sessions:
+        db.session.execute(
+            sessions.update().where(sessions.c.worker_id == PRESENCE_WORKER_ID).values(expires_at=expires_at)
+        )
+    opened = connected - presence_sessions
+    closed = presence_sessions - connected
+    if opened:
+        db.session.execute(insert(sessions), [
+            {'worker_id': PRESENCE_WORKER_ID, 'user_id': user_id, 'expires_at': expires_at} for user_id in opened
+        ])
+    if closed:
+        db.session.execute(sessions.delete().where(
+            sessions.c.worker_id == PRESENCE_WORKER_ID, sessions.c.user_id.in_(closed)
+        ))
+    
+    # Rows left behind by workers that died without disconnecting their sockets
+    expired = set(db.session.execute(
+        db.select(sessions.c.user_id).where(sessions.c.expires_at < now)
+    ).scalars())
+    if expired:
+        db.session.execute(sessions.delete().where(sessions.c.expires_at < now))
+    
+    # A user is online while any worker holds a live session for them
+    candidates = changed | expired
+    if candidates:
+        online = set(db.session.execute(
+            db.select(sessions.c.user_id).where(sessions.c.user_id.in_(candidates), sessions.c.expires_at >= now)
+        ).scalars())
+        
+        # Bulk UPDATE by primary key, one statement for the whole interval
+        db.session.execute(update(User), [
+            {'id': user_id, 'is_online': user_id in online, 'last_seen': now} for user_id in candidates
+        ])
+    db.session.commit()
+    presence_sessions.clear()
+    presence_sessions.update(connected)
+    if not candidates:
+        return
+    user_cache.invalidate(*candidates)
+    
+    # Changes only go to users who share a chat with the changed user, through their per-user rooms
+    participants = ChatParticipant.__table__
+    contacts = participants.alias()
+    watched = {}  # watcher id -> changed users they share a chat with
+    for changed_id, watcher_id in db.session.execute(
+        db.select(participants.c.user_id, contacts.c.user_id).distinct()
+        .join(contacts, contacts.c.chat_id == participants.c.chat_id)
+        .where(participants.c.user_id.in_(candidates), contacts.c.user_id != participants.c.user_id)
+    ):
+        watched.setdefault(watcher_id, set()).add(changed_id)
+    
+    # Watchers who see the same changes share one frame
+    digests = {}
+    for watcher_id, changed_ids in watched.items():
+        digests.setdefault(frozenset(changed_ids), []).append(f'user_{watcher_id}')
+    for changed_ids, rooms in digests.items():
+        socketio.emit('presence', {
+            'online': sorted(changed_ids & online),
+            'offline': sorted(changed_ids - online)
+        }, to=rooms)
+
+# Delivery and read receipts
+RECEIPT_FLUSH_INTERVAL = float(os.getenv('RECEIPT_FLUSH_INTERVAL_MS', '1000')) / 1000
+RECEIPT_BATCH_LIMIT = 100
+
+receipt_lock = threading.Lock()
+pending_receipts = {}  # (chat id, user id) -> [delivered message id, read message id], pending the next flush
+
+def record_receipt(chat_id, user_id, delivered, read):
+    ensure_background_task(run_presence_aggregator)
+    with receipt_lock:
+        marks = pending_receipts.setdefault((int(chat_id), int(user_id)), [0, 0])
+        # Reading a message implies it was delivered
+        marks[0] = max(marks[0], delivered, read)
+        marks[1] = max(marks[1], read)
+
+def highest_message_ids(chat_ids):
+    # Marks compare message ids, and imported history can hold ids above the chat's newest message by
+    # timestamp, so "everything so far" is the highest id rather than Chat.last_message_id
+    return dict(
+        db.session.query(Message.chat_id, func.max(Message.id))
+        .filter(Message.chat_id.in_(set(chat_ids)))
+        .group_by(Message.chat_id)
+    )
+
+def advance_mark(column, value):
+    # Marks only move forward, so late or replayed acks never undo newer ones
+    return case((column < bindparam(value), bindparam(value)), else_=column)
+
+def flush_receipts():
+    with receipt_lock:
+        changes = dict(pending_receipts)
+        pending_receipts.clear()
+    if not changes:
+        return
+    
+    try:
+        # Clamp to each chat's highest message id so clients cannot mark messages that do not exist yet
+        newest = highest_message_ids(chat_id for chat_id, _ in changes)
+        marks = [
+            {'chat': chat_id, 'member': user_id, 'delivered': min(delivered, newest.get(chat_id) or 0), 'read': min(read, newest.get(chat_id) or 0)}
+            for (chat_id, user_id), (delivered, read) in changes.items()
+        ]
+        
+        # Drop acks that move nothing, such as late or replayed ones and acks from former members
+        stored = {
+            (chat_id, user_id): (delivered or 0, read or 0)
+            for chat_id, user_id, delivered, read in db.session.query(
+                ChatParticipant.chat_id, ChatParticipant.user_id,
+                ChatParticipant.last_delivered_message_id, ChatParticipant.last_read_message_id
+            ).filter(ChatParticipant.chat_id.in_(set(newest)))
+        }
+        marks = [
+            mark for mark in marks if (mark['chat'], mark['member']) in stored
+            and (mark['delivered'] > stored[mark['chat'], mark['member']][0] or mark['read'] > stored[mark['chat'], mark['member']][1])
+        ]
+        if not marks:
+            return
+        
+        # One executemany per table for every ack received during the interval
+        participants = ChatParticipant.__table__
+        db.session.execute(
+            update(participants)
+            .where(participants.c.chat_id == bindparam('chat'), participants.c.user_id == bindparam('member'))
+            .values(
+                last_delivered_message_id=advance_mark(participants.c.last_delivered_message_id, 'delivered'),
+                last_read_message_id=advance_mark(participants.c.last_read_message_id, 'read')
+            ),
+            marks
+        )
+        inbox = ChatInbox.__table__
+        reads = [mark for mark in marks if mark['read']]
+        if reads:
+            db.session.execute(
+                update(inbox)
+                .where(
+                    inbox.c.chat_id == bindparam('chat'),
+                    inbox.c.user_id == bindparam('member'),
+                    inbox.c.last_message_id <= bindparam('read'),
+                    inbox.c.unread_count > 0
+                )
+                .values(unread_count=0),
+                reads
+            )
+        # Every member's chat payload carries the receipts, so the chat must show up in all their next syncs
+        db.session.execute(
+            update(inbox).where(inbox.c.chat_id.in_({mark['chat'] for mark in marks})).values(updated_at=datetime.utcnow())
+        )
+        db.session.commit()
+    except Exception:
+        # Keep the acks for the next flush, merged with any newer ones recorded meanwhile
+        for (chat_id, user_id), (delivered, read) in changes.items():
+            record_receipt(chat_id, user_id, delivered, read)
+        raise
+    
+    # One frame per chat with every member's stored marks: a late, lower ack never moves a frame
+    # backwards, and clients take the lowest mark over the whole chat
+    by_chat = {}
+    for chat_id, user_id, delivered, read in db.session.query(
+        ChatParticipant.chat_id, ChatParticipant.user_id,
+        ChatParticipant.last_delivered_message_id, ChatParticipant.last_read_message_id
+    ).filter(ChatParticipant.chat_id.in_({mark['chat'] for mark in marks})).order_by(ChatParticipant.user_id):
+        by_chat.setdefault(chat_id, []).append({'userId': user_id, 'delivered': delivered or 0, 'read': read or 0})
+    for chat_id, receipts in by_chat.items():
+        socketio.emit('receipts', {'chatId': chat_id, 'receipts': receipts}, room=f'chat_{chat_id}')
+
+def receipt_participants(chat_ids):
+    participants = {}
+    for participant in ChatParticipant.query.filter(ChatParticipant.chat_id.in_(set(chat_ids))):
+        participants.setdefault(participant.chat_id, []).append(participant)
+    return participants
+
+def attach_receipt_status(messages, participants):
+    # A message is delivered or read once every other member's mark has reached it
+    marks = [
+        (p.user_id, p.last_delivered_message_id or 0, p.last_read_message_id or 0) for p in participants
+    ]
+    floors = {}
+    for message in messages:
+        if message is None:
+            continue
+        if message.sender_id not in floors:
+            others = [(delivered, read) for user_id, delivered, read in marks if user_id != message.sender_id]
+            floors[message.sender_id] = (
+                min((delivered for delivered, _ in others), default=0),
+                min((read for _, read in others), default=0)
+            )
+        delivered, read = floors[message.sender_id]
+        message.receipt_status = 'read' if read >= message.id else 'delivered' if delivered >= message.id else 'sent'
+
+def run_presence_aggregator():
+    last_presence_flush = time.monotonic()
+    last_receipt_flush = time.monotonic()
+    while True:
+        socketio.sleep(TYPING_DIGEST_INTERVAL)
+        with app.app_context():
+            try:
+                flush_typing_digests()
+                if time.monotonic() - last_receipt_flush >= RECEIPT_FLUSH_INTERVAL:
+                    last_receipt_flush = time.monotonic()
+                    flush_receipts()
+                if time.monotonic() - last_presence_flush >= PRESENCE_FLUSH_INTERVAL:
+                    last_presence_flush = time.monotonic()
+                    flush_presence()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Presence aggregator error: {e}")
+
+# Gemini worker pool
+AI_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-pro')
+AI_WORKERS = int(os.getenv('AI_WORKERS', '4'))
+AI_QUEUE_LIMIT = int(os.getenv('AI_QUEUE_LIMIT', '16'))
+AI_TIMEOUT = float(os.getenv('AI_TIMEOUT_SECONDS', '60'))
+
+ai_executor = ThreadPoolExecutor(max_workers=AI_WORKERS, thread_name_prefix='gemini')
+ai_slots = threading.BoundedSemaphore(AI_WORKERS + AI_QUEUE_LIMIT)
+ai_model = None
+ai_model_lock = threading.Lock()
+
+AI_PERSONAS = {
+    'main': "You are a helpful AI assistant.",
+    'lawyer': "You are a legal assistant. Provide legal advice and information.",
+    'writer': "You are a writing assistant. Help with content creation and editing.",
+    'teacher': "You are an educational tutor. Help with learning and teaching.",
+    'doctor': "You are a health advisor. Provide general health information (not medical advice).",
+    'developer': "You are a code assistant. Help with programming and technical questions."
+}
+
+def build_ai_prompt(persona, display_name, message):
+    preamble = AI_PERSONAS.get(persona, AI_PERSONAS['main'])
+    return f"{preamble} User: {display_name} is asking: {message}"
+
+def get_ai_model():
+    # The SDK is imported and configured on first use, then one model instance serves every request
+    global ai_model
+    if ai_model is None:
+        with ai_model_lock:
+            if ai_model is None:
+                import google.generativeai as genai
+                
+                # gRPC blocks green threads, so cooperative servers talk to Gemini over REST on the patched sockets
+                genai.configure(
+                    api_key=os.getenv('GEMINI_API_KEY'),
+                    transport=os.getenv('GEMINI_TRANSPORT') or ('rest' if ASYNC_MODE in GREEN_ASYNC_MODES else None)
+                )
+                ai_model = genai.GenerativeModel(AI_MODEL_NAME)
+    return ai_model
+
+def submit_ai_job(fn, *args):
+    # Returns None when the pool and its queue are full so callers can shed load
+    if not ai_slots.acquire(blocking=False):
+        return None
+    future = ai_executor.submit(fn, *args)
+    future.add_done_callback(lambda _: ai_slots.release())
+    return future
+
+def generate_ai_response(prompt):
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        reply = get_ai_model().generate_content(prompt).text
+        outcome = 'ok'
+        return reply
+    finally:
+        metrics.observe('gemini_request_duration_seconds', time.perf_counter() - started, mode='generate', outcome=outcome)
+
+class AIStreamFeed:
+    # Events of one streaming upstream call, replayed from the start to every request coalesced onto it
+    def __init__(self):
+        self.events = []  # ('chunk', text), then ('done', None) or ('error', message)
+        self.changed = threading.Condition()
+
+    def put(self, kind, text=None):
+        with self.changed:
+            self.events.append((kind, text))
+            self.changed.notify_all()
+
+    def follow(self, timeout):
+        # Yields ('timeout', None) if no new event arrives within timeout
+        index = 0
+        while True:
+            with self.changed:
+                if not self.changed.wait_for(lambda: index < len(self.events), timeout):
+                    yield 'timeout', None
+                    return
+                kind, text = self.events[index]
+            index += 1
+            yield kind, text
+            if kind != 'chunk':
+                return
+
+def stream_ai_response(prompt, feed):
+    # Publishes chunks to the feed as they arrive and returns the whole answer, which the cache keeps
+    started = time.perf_counter()
+    outcome = 'error'
+    parts = []
+    try:
+        for chunk in get_ai_model().generate_content(prompt, stream=True):
+            if chunk.text:
+                if not parts:
+                    metrics.observe('gemini_time_to_first_token_seconds', time.perf_counter() - started)
+                parts.append(chunk.text)
+                feed.put('chunk', chunk.text)
+        outcome = 'ok'
+    except Exception as e:
+        feed.put('error', str(e))
+        raise
+    finally:
+        metrics.observe('gemini_request_duration_seconds', time.perf_counter() - started, mode='stream', outcome=outcome)
+    feed.put('done')
+    return ''.join(parts)
+
+# Gemini response cache
+AI_CACHE_SIZE = int(os.getenv('AI_CACHE_SIZE', '1024'))
+AI_CACHE_TTL = float(os.getenv('AI_CACHE_TTL_SECONDS', '3600'))
+
+class AIResponseCache:
+    # Bounded LRU/TTL cache of answers with single-flight coalescing of identical in-flight prompts
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires at, response text)
+        self.inflight = {}  # key -> Future of the upstream call
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(persona, display_name, message):
+        # The prompt names the asker, so answers are only shared between users with the same display name
+        persona = persona if persona in AI_PERSONAS else 'main'
+        return persona, display_name, ' '.join(message.casefold().split()).rstrip('?!. ')
+
+    def get(self, key, record_miss=False):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                if record_miss:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, response):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_submit(self, key, submit):
+        # Returns a Future for the answer, or None if submit() had no capacity
+        cached = self.get(key)
+        if cached is not None:
+            future = Future()
+            future.set_result(cached)
+            return future
+        
+        with self.lock:
+            future = self.inflight.get(key)
+            if future:
+                self.coalesced += 1
+                return future
+            future = submit()
+            if future is None:
+                return None
+            self.misses += 1
+            self.inflight[key] = future
+        future.add_done_callback(lambda done: self._complete(key, done))
+        return future
+
+    def _complete(self, key, future):
+        with self.lock:
+            self.inflight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxSize': self.maxsize,
+                'inflight': len(self.inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+ai_cache = AIResponseCache(AI_CACHE_SIZE, AI_CACHE_TTL)
+
+# Password hashing and login protection
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', '32'))
+HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT_SECONDS', '10'))
+LOGIN_ATTEMPTS_PER_MINUTE = int(os.getenv('LOGIN_ATTEMPTS_PER_MINUTE', '10'))
+LOGIN_FAILURE_CACHE_SECONDS = float(os.getenv('LOGIN_FAILURE_CACHE_SECONDS', '300'))
+LOGIN_TRACKING_LIMIT = 10000
+
+hash_executor = None
+hash_executor_lock = threading.Lock()
+hash_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+login_lock = threading.Lock()
+login_attempts = OrderedDict()  # client IP -> deque of attempt times in the last minute
+login_failures = OrderedDict()  # digest of (user, stored hash, password) -> expiry
+
+def get_hash_executor():
+    global hash_executor
+    if hash_executor is None:
+        with hash_executor_lock:
+            if hash_executor is None:
+                hash_executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return hash_executor
+
+def run_hash_job(fn, *args):
+    # Hash off the request thread; returns None when the pool and its queue are full
+    if not hash_slots.acquire(blocking=False):
+        return None
+    future = get_hash_executor().submit(fn, *args)
+    future.add_done_callback(lambda _: hash_slots.release())
+    return future.result(timeout=HASH_TIMEOUT)
+
+def allow_login_attempt(ip):
+    now = time.monotonic()
+    with login_lock:
+        attempts = login_attempts.pop(ip, None) or deque()
+        while attempts and attempts[0] <= now - 60:
+            attempts.popleft()
+        if len(attempts) >= LOGIN_ATTEMPTS_PER_MINUTE:
+            login_attempts[ip] = attempts
+            return False
+        attempts.append(now)
+        login_attempts[ip] = attempts
+        if len(login_attempts) > LOGIN_TRACKING_LIMIT:
+            login_attempts.popitem(last=False)
+        return True
+
+def login_failure_key(user, password):
+    # Includes the stored hash so a password change invalidates old entries
+    return hashlib.sha256(f'{user.id}:{user.password_hash}:{password}'.encode()).hexdigest()
+
+def is_known_login_failure(key):
+    with login_lock:
+        expiry = login_failures.get(key)
+        if expiry is None:
+            return False
+        if expiry <= time.monotonic():
+            del login_failures[key]
+            return False
+        return True
+
+def remember_login_failure(key):
+    with login_lock:
+        login_failures[key] = time.monotonic() + LOGIN_FAILURE_CACHE_SECONDS
+        login_failures.move_to_end(key)
+        if len(login_failures) > LOGIN_TRACKING_LIMIT:
+            login_failures.popitem(last=False)
+
+# Google ID token verification
+GOOGLE_TOKEN_CACHE_SECONDS = float(os.getenv('GOOGLE_TOKEN_CACHE_SECONDS', '300'))
+GOOGLE_TOKEN_CACHE_SIZE = 10000
+
+class CachingGoogleRequest:
+    # Keeps one HTTP session and reuses GET responses (the signing certificates) for their Cache-Control max-age.
+    # google-auth's transport is only imported on the first Google sign-in.
+    def __init__(self):
+        self.transport = None
+        self.responses = {}  # url -> (expiry, response)
+        self.responses_lock = threading.Lock()
+
+    def get_transport(self):
+        if self.transport is None:
+            with self.responses_lock:
+                if self.transport is None:
+                    from google.auth.transport.requests import Request
+                    self.transport = Request()
+        return self.transport
+
+    @staticmethod
+    def max_age(headers):
+        cache_control = headers.get('cache-control', '').lower()
+        if 'no-store' in cache_control or 'no-cache' in cache_control:
+            return 0
+        match = re.search(r'max-age=(\d+)', cache_control)
+        return int(match.group(1)) if match else 0
+
+    def __call__(self, url, method='GET', body=None, headers=None, **kwargs):
+        # timeout is only forwarded when the caller sets one, so google-auth's own default still bounds the fetch
+        if method != 'GET' or body is not None:
+            return self.get_transport()(url, method=method, body=body, headers=headers, **kwargs)
+        
+        cached = self.responses.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        response = self.get_transport()(url, method=method, headers=headers, **kwargs)
+        max_age = self.max_age(response.headers)
+        if response.status == 200 and max_age:
+            with self.responses_lock:
+                self.responses[url] = (time.monotonic() + max_age, response)
+        return response
+
+google_request = CachingGoogleRequest()
+verified_google_tokens = OrderedDict()  # sha256 of token -> (expiry, idinfo)
+verified_google_tokens_lock = threading.Lock()
+
+def verify_google_token(token):
+    # Raises ValueError for invalid tokens, like id_token.verify_oauth2_token
+    key = hashlib.sha256(token.encode()).hexdigest()
+    with verified_google_tokens_lock:
+        cached = verified_google_tokens.get(key)
+        if cached and cached[0] > time.time():
+            return cached[1]
+    
+    from google.oauth2 import id_token
+    
+    idinfo = id_token.verify_oauth2_token(token, google_request, os.getenv('GOOGLE_CLIENT_ID'))
+    
+    # Never trust a cached result past the token's own expiry
+    expiry = min(time.time() + GOOGLE_TOKEN_CACHE_SECONDS, idinfo.get('exp', 0))
+    with verified_google_tokens_lock:
+        verified_google_tokens[key] = (expiry, idinfo)
+        verified_google_tokens.move_to_end(key)
+        if len(verified_google_tokens) > GOOGLE_TOKEN_CACHE_SIZE:
+            verified_google_tokens.popitem(last=False)
+    return idinfo
+
+def unique_username(base):
+    # One query for every existing name sharing the prefix, then pick the first free suffix in memory
+    taken = {
+        row.username for row in
+        db.session.query(User.username).filter(User.username.startswith(base, autoescape=True))
+    }
+    username = base
+    counter = 1
+    while username in taken:
+        username = f"{base}{counter}"
+        counter += 1
+    return username
+
+# Media storage
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media'))
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_MB', '25')) * 1024 * 1024
+MEDIA_CHUNK_SIZE = 1024 * 1024
+MEDIA_URL_TTL = int(os.getenv('MEDIA_URL_TTL_SECONDS', '3600'))
+MEDIA_KINDS = {'image', 'video', 'audio'}
+MEDIA_UNSAFE_TYPES = {'image/svg+xml'}  # Scriptable, so only ever served as a download
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '320'))
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
+MEDIA_QUEUE_LIMIT = int(os.getenv('MEDIA_QUEUE_LIMIT', '32'))
+
+media_executor = None
+media_executor_lock = threading.Lock()
+media_slots = threading.BoundedSemaphore(MEDIA_WORKERS + MEDIA_QUEUE_LIMIT)
+app.config['USE_X_SENDFILE'] = os.getenv('MEDIA_X_SENDFILE', 'false').lower() == 'true'
+
+# Refuse oversized bodies from Content-Length before anything is spooled; the slack covers multipart framing
+app.config['MAX_CONTENT_LENGTH'] = MEDIA_MAX_BYTES + 64 * 1024
+
+class AppRequest(Request):
+    @property
+    def max_content_length(self):
+        # NDJSON imports stream their body line by line, so history of any size can be imported
+        if self.endpoint == 'import_messages':
+            return None
+        return super().max_content_length
+
+app.request_class = AppRequest
+
+def media_path(digest, variant='original'):
+    # Fan out by digest prefix so no directory grows too large
+    return os.path.join(MEDIA_ROOT, variant, digest[:2], digest[2:4], digest)
+
+def get_media_executor():
+    global media_executor
+    if media_executor is None:
+        with media_executor_lock:
+            if media_executor is None:
+                media_executor = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return media_executor
+
+def store_upload(stream):
+    # Hash while spooling to disk so uploads never sit in memory; identical bytes share one file
+    spool = os.path.join(MEDIA_ROOT, 'tmp')
+    os.makedirs(spool, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=spool)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            while True:
+                chunk = stream.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    raise ValueError(f'Uploads are limited to {MEDIA_MAX_BYTES // (1024 * 1024)} MB')
+                digest.update(chunk)
+                temp.write(chunk)
+        if not size:
+            raise ValueError('Upload is empty')
+        
+        digest = digest.hexdigest()
+        path = media_path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        return digest, size
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def render_thumbnail(source, target, size):
+    # Runs in a worker process; returns the original dimensions
+    from PIL import Image, ImageOps
+    
+    with Image.open(source) as image:
+        width, height = image.size
+        preview = ImageOps.exif_transpose(image)
+        preview.thumbnail((size, size))
+        if preview.mode not in ('RGB', 'L'):
+            preview = preview.convert('RGB')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        preview.save(target + '.part', 'JPEG', quality=80, optimize=True)
+        os.replace(target + '.part', target)
+    return width, height
+
+def record_thumbnail(digest, future):
+    media_slots.release()
+    try:
+        width, height = future.result()
+    except Exception as e:
+        print(f"Thumbnail error for {digest}: {e}")
+        return
+    with app.app_context():
+        MediaAsset.query.filter_by(id=digest).update({
+            MediaAsset.width: width,
+            MediaAsset.height: height,
+            MediaAsset.has_thumbnail: True
+        }, synchronize_session=False)
+        db.session.commit()
+
+def schedule_thumbnail(asset):
+    # Best effort: when the pool is saturated the thumbnail route keeps serving the original
+    if asset.kind != 'image' or not media_slots.acquire(blocking=False):
+        return
+    future = get_media_executor().submit(
+        render_thumbnail, media_path(asset.id), media_path(asset.id, 'thumbnail'), THUMBNAIL_SIZE
+    )
+    future.add_done_callback(functools.partial(record_thumbnail, asset.id))
+
+def media_reference(metadata):
+    # Messages point at uploads by mediaId; the stored type, size and URLs come from the asset
+    metadata = metadata or {}
+    asset = db.session.get(MediaAsset, str(metadata['mediaId'])) if metadata.get('mediaId') else None
+    return dict(metadata, media=asset.to_dict()) if asset else metadata
+
+def media_signature(digest, expires):
+    key = app.config['SECRET_KEY'].encode()
+    return hmac.new(key, f'{digest}:{expires}'.encode(), hashlib.sha256).hexdigest()
+
+def signed_media_url(digest, variant=None):
+    # Expiry is rounded up to a TTL boundary so a URL stays the same, and browser-cacheable, for a whole window
+    expires = (int(time.time()) // MEDIA_URL_TTL + 2) * MEDIA_URL_TTL
+    path = f'/api/media/{digest}/{variant}' if variant else f'/api/media/{digest}'
+    return f'{path}?expires={expires}&sig={media_signature(digest, expires)}'
+
+def media_url_expiry(digest):
+    # Seconds the request's signed URL remains valid, or None when it is missing, forged or expired
+    expires = request.args.get('expires', type=int)
+    signature = request.args.get('sig', '')
+    if expires is None or not hmac.compare_digest(signature, media_signature(digest, expires)):
+        return None
+    remaining = expires - int(time.time())
+    return remaining if remaining > 0 else None
+
+def sign_media_metadata(metadata):
+    # Stored messages keep whatever URLs they were sent with; fresh signed ones are issued on every read
+    media = (metadata or {}).get('media')
+    if not media or not media.get('id'):
+        return metadata or {}
+    return dict(metadata, media=dict(
+        media,
+        url=signed_media_url(media['id']),
+        thumbnailUrl=signed_media_url(media['id'], 'thumbnail') if media.get('thumbnailUrl') else None
+    ))
+
+def serve_media(path, asset, max_age, mimetype=None, immutable=True):
+    # send_file answers conditional and Range requests and hands the file to the server's sendfile path
+    response = send_file(
+        path,
+        mimetype=mimetype or (asset.mimetype if asset.kind != 'file' else 'application/octet-stream'),
+        as_attachment=asset.kind == 'file',
+        download_name=request.args.get('name') or asset.id,
+        conditional=True,
+        etag=asset.id if immutable else False,
+        max_age=max_age if immutable else 0
+    )
+    # Media from private chats must never land in shared caches, and not outlive its signed URL
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
+# Socket identity and chat membership caches
+socket_users = {}  # Socket.IO sid -> user id, bound once in handle_connect
+CHAT_MEMBER_CACHE_SIZE = int(os.getenv('CHAT_MEMBER_CACHE_SIZE', '10000'))
+chat_members = {}  # chat id -> frozenset of participant user ids
+chat_members_lock = threading.Lock()
+
+def current_socket_user():
+    return socket_users.get(request.sid)
+
+def is_chat_member(chat_id, user_id):
+    chat_id = int(chat_id)
+    members = chat_members.get(chat_id)
+    if members is None:
+        members = frozenset(
+            row.user_id for row in db.session.query(ChatParticipant.user_id).filter_by(chat_id=chat_id)
+        )
+        if not members:
+            # Never cache a miss: the chat may be created by another worker
+            return False
+        with chat_members_lock:
+            # Evict the oldest entry once the cache is full
+            if len(chat_members) >= CHAT_MEMBER_CACHE_SIZE:
+                chat_members.pop(next(iter(chat_members)), None)
+            chat_members[chat_id] = members
+    return int(user_id) in members
+
+def invalidate_chat_members(chat_id):
+    with chat_members_lock:
+        chat_members.pop(int(chat_id), None)
+
 # Authentication Routes
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -179,16 +2085,21 @@ def register():
         if User.query.filter_by(email=data['email']).first():
             return jsonify({'error': 'Email already exists'}), 400
         
+        password_hash = run_hash_job(generate_password_hash, data['password'])
+        if password_hash is None:
+            return jsonify({'error': 'Server is busy, try again shortly'}), 503, {'Retry-After': '1'}
+        
         # Create new user
         user = User(
             username=data['username'],
             email=data['email'],
-            password_hash=generate_password_hash(data['password']),
+            password_hash=password_hash,
             display_name=data['displayName']
         )
         
         db.session.add(user)
         db.session.commit()
+        user_search_index.add(user.id, user.username, user.display_name)
         
         # Create access token
         access_token = create_access_token(identity=str(user.id))
@@ -196,7 +2107,7 @@ def register():
         return jsonify({
             'message': 'User created successfully',
             'token': access_token,
-            'user': user.to_dict()
+            'user': user_cache.put(user)
         }), 201
         
     except Exception as e:
@@ -207,10 +2118,25 @@ def login():
     try:
         data = request.get_json()
         
+        # Cheap checks first so brute-force traffic never reaches the hashing pool
+        if not allow_login_attempt(request.remote_addr):
+            return jsonify({'error': 'Too many login attempts, try again later'}), 429, {'Retry-After': '60'}
+        
         # Find user by email
         user = User.query.filter_by(email=data['email']).first()
         
-        if not user or not check_password_hash(user.password_hash, data['password']):
+        if not user or not user.password_hash:
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        failure_key = login_failure_key(user, data['password'])
+        if is_known_login_failure(failure_key):
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        valid = run_hash_job(check_password_hash, user.password_hash, data['password'])
+        if valid is None:
+            return jsonify({'error': 'Server is busy, try again shortly'}), 503, {'Retry-After': '1'}
+        if not valid:
+            remember_login_failure(failure_key)
             return jsonify({'error': 'Invalid credentials'}), 401
         
         # Update last seen
@@ -224,7 +2150,7 @@ def login():
         return jsonify({
             'message': 'Login successful',
             'token': access_token,
-            'user': user.to_dict()
+            'user': user_cache.put(user)
         }), 200
         
     except Exception as e:
@@ -235,12 +2161,12 @@ def login():
 def get_current_user():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = user_cache.get(user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': user.to_dict()}), 200
+        return jsonify({'user': user}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -256,7 +2182,7 @@ def google_auth():
         
         # Verify the Google ID token
         try:
-            idinfo = id_token.verify_oauth2_token(token, requests.Request(), os.getenv('GOOGLE_CLIENT_ID'))
+            idinfo = verify_google_token(token)
             
             # Extract user information
             google_id = idinfo['sub']
@@ -279,14 +2205,8 @@ def google_auth():
             db.session.commit()
         else:
             # Create new user
-            # Generate username from email
-            username = email.split('@')[0]
-            # Ensure username is unique
-            original_username = username
-            counter = 1
-            while User.query.filter_by(username=username).first():
-                username = f"{original_username}{counter}"
-                counter += 1
+            # Generate a unique username from email
+            username = unique_username(email.split('@')[0])
             
             user = User(
                 username=username,
@@ -297,6 +2217,7 @@ def google_auth():
             )
             db.session.add(user)
             db.session.commit()
+            user_search_index.add(user.id, user.username, user.display_name)
         
         # Create access token
         access_token = create_access_token(identity=str(user.id))
@@ -304,7 +2225,7 @@ def google_auth():
         return jsonify({
             'message': 'Google authentication successful',
             'token': access_token,
-            'user': user.to_dict()
+            'user': user_cache.put(user)
         }), 200
         
     except Exception as e:
@@ -332,10 +2253,11 @@ def update_profile():
         
         user.updated_at = datetime.utcnow()
         db.session.commit()
+        user_search_index.add(user.id, user.username, user.display_name)
         
         return jsonify({
             'message': 'Profile updated successfully',
-            'user': user.to_dict()
+            'user': user_cache.put(user)
         }), 200
         
     except Exception as e:
@@ -352,18 +2274,71 @@ def search_users():
         if len(query) < 2:
             return jsonify({'users': []}), 200
         
-        users = User.query.filter(
-            (User.username.contains(query)) | 
-            (User.display_name.contains(query))
-        ).filter(User.id != current_user_id).limit(10).all()
+        # Rank matches from the in-memory index, then load just those rows
+        user_ids = user_search_index.search(query, exclude_id=int(current_user_id), limit=10)
+        users = user_cache.get_many(user_ids)
         
         return jsonify({
-            'users': [user.to_dict() for user in users]
+            'users': [users[user_id] for user_id in user_ids if user_id in users]
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Search Routes
+@app.route('/api/search', methods=['GET'])
+@jwt_required()
+def search():
+    try:
+        user_id = get_jwt_identity()
+        terms = search_terms(request.args.get('q', ''))
+        scope = request.args.get('scope', 'all')
+        
+        if scope not in ('all', 'messages', 'notes'):
+            return jsonify({'error': 'Invalid scope'}), 400
+        
+        try:
+            limit = int(request.args.get('limit', SEARCH_PAGE_DEFAULT))
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit or offset'}), 400
+        limit = max(1, min(limit, SEARCH_PAGE_MAX))
+        offset = max(0, offset)
+        
+        results = {'terms': terms, 'messages': [], 'notes': []}
+        if not terms:
+            return jsonify(results), 200
+        
+        if scope in ('all', 'messages'):
+            compact = wants_compact()
+            hits = search_messages(user_id, terms, limit, offset)
+            messages = {
+                message.id: message for message in
+                Message.query.filter(Message.id.in_([hit[0] for hit in hits])).options(*message_load_options())
+            }
+            attach_reaction_details(messages.values(), user_id)
+            participants = receipt_participants(message.chat_id for message in messages.values())
+            for message in messages.values():
+                attach_receipt_status([message], participants.get(message.chat_id, []))
+            users = referenced_users(messages=messages.values())
+            results['messages'] = [
+                dict(messages[message_id].to_dict(compact), snippet=snippet) for message_id, snippet in hits
+            ]
+            if compact:
+                results['users'] = users
+        
+        if scope in ('all', 'notes'):
+            hits = search_notes(user_id, terms, limit, offset)
+            notes = {note.id: note for note in Note.query.filter(Note.id.in_([hit[0] for hit in hits]))}
+            results['notes'] = [
+                dict(notes[note_id].to_dict(), snippet=snippet) for note_id, snippet in hits
+            ]
+        
+        return jsonify(results), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Chat Routes
 @app.route('/api/chats', methods=['GET'])
 @jwt_required()
@@ -371,14 +2346,21 @@ def get_chats():
     try:
         user_id = get_jwt_identity()
         
-        # Get chats where user is a participant
-        chats = db.session.query(Chat).join(ChatParticipant).filter(
-            ChatParticipant.user_id == user_id
-        ).order_by(Chat.updated_at.desc()).all()
+        # Range scan over the user's inbox, newest activity first
+        entries = ChatInbox.query.filter_by(user_id=user_id).options(
+            selectinload(ChatInbox.chat).options(*chat_load_options())
+        ).order_by(ChatInbox.last_activity_at.desc()).all()
         
-        return jsonify({
-            'chats': [chat.to_dict() for chat in chats]
-        }), 200
+        attach_reaction_details([entry.chat.last_message for entry in entries], user_id)
+        for entry in entries:
+            attach_receipt_status([entry.chat.last_message], entry.chat.participants)
+        users = referenced_users(chats=[entry.chat for entry in entries])
+        compact = wants_compact()
+        payload = {'chats': [entry.to_dict(compact) for entry in entries]}
+        if compact:
+            payload['users'] = users
+        
+        return jsonify(payload), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -405,7 +2387,6 @@ def create_chat():
         db.session.flush()  # Get chat ID
         
         # Add current user as participant
-        current_user = User.query.get(user_id)
         chat_participant = ChatParticipant(
             chat_id=chat.id,
             user_id=user_id,
@@ -415,14 +2396,20 @@ def create_chat():
         
         # Add other participants
         for participant in participants:
-            if participant.id != user_id:
+            if participant.id != int(user_id):
                 chat_participant = ChatParticipant(
                     chat_id=chat.id,
                     user_id=participant.id
                 )
                 db.session.add(chat_participant)
         
+        # Give every participant an inbox entry
+        member_ids = {int(user_id)} | {participant.id for participant in participants}
+        for member_id in member_ids:
+            db.session.add(ChatInbox(chat_id=chat.id, user_id=member_id))
+        
         db.session.commit()
+        invalidate_chat_members(chat.id)
         
         return jsonify({
             'message': 'Chat created successfully',
@@ -432,6 +2419,24 @@ def create_chat():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Message history pagination
+MESSAGE_PAGE_DEFAULT = 50
+MESSAGE_PAGE_MAX = 200
+
+def parse_message_cursor(chat_id, value):
+    # A cursor is either a message id or an ISO timestamp.
+    # Returns a (timestamp, id) keyset bound, or None if it cannot be resolved.
+    if value.isdigit():
+        row = db.session.query(Message.timestamp, Message.id).filter_by(
+            id=int(value),
+            chat_id=chat_id
+        ).first()
+        return (row.timestamp, row.id) if row else None
+    try:
+        return (datetime.fromisoformat(value.replace('Z', '+00:00')).replace(tzinfo=None), None)
+    except ValueError:
+        return None
+
 @app.route('/api/chats/<int:chat_id>/messages', methods=['GET'])
 @jwt_required()
 def get_messages(chat_id):
@@ -447,12 +2452,59 @@ def get_messages(chat_id):
         if not participant:
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get messages
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp.asc()).all()
+        before = request.args.get('before')
+        after = request.args.get('after')
+        if before and after:
+            return jsonify({'error': 'Use either before or after, not both'}), 400
         
-        return jsonify({
-            'messages': [message.to_dict() for message in messages]
-        }), 200
+        try:
+            limit = int(request.args.get('limit', MESSAGE_PAGE_DEFAULT))
+        except ValueError:
+            return jsonify({'error': 'Invalid limit'}), 400
+        limit = max(1, min(limit, MESSAGE_PAGE_MAX))
+        
+        # Walk the (chat_id, timestamp, id) index from the cursor, one page at a time
+        query = Message.query.filter_by(chat_id=chat_id).options(*message_load_options())
+        position = (Message.timestamp, Message.id)
+        cursor = after or before
+        if cursor:
+            bound = parse_message_cursor(chat_id, cursor)
+            if not bound:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            timestamp, message_id = bound
+            if message_id is None:
+                query = query.filter(Message.timestamp > timestamp if after else Message.timestamp < timestamp)
+            elif after:
+                query = query.filter(tuple_(*position) > tuple_(timestamp, message_id))
+            else:
+                query = query.filter(tuple_(*position) < tuple_(timestamp, message_id))
+        
+        # Without a cursor the newest page is returned; fetch one extra row to detect more history
+        if after:
+            messages = query.order_by(Message.timestamp.asc(), Message.id.asc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+        else:
+            messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = list(reversed(messages[:limit]))
+        
+        attach_reaction_details(messages, user_id)
+        attach_receipt_status(messages, ChatParticipant.query.filter_by(chat_id=chat_id))
+        users = referenced_users(messages=messages)
+        compact = wants_compact()
+        payload = {
+            'messages': [message.to_dict(compact) for message in messages],
+            'hasMore': has_more,
+            'cursors': {
+                'before': messages[0].id if messages else None,
+                'after': messages[-1].id if messages else None
+            }
+        }
+        if compact:
+            payload['users'] = users
+        
+        return jsonify(payload), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -473,27 +2525,180 @@ def send_message():
         if not participant:
             return jsonify({'error': 'Access denied'}), 403
         
+        if not is_valid_message(data):
+            return jsonify({'error': 'Message content is required'}), 400
+        
         # Create message
-        message = Message(
-            chat_id=data['chatId'],
-            sender_id=user_id,
-            content=data['content'],
-            message_type=data.get('type', 'text'),
-            message_metadata=data.get('metadata', {})
+        message = persist_messages([{
+            'chatId': data['chatId'],
+            'userId': user_id,
+            'content': data.get('content') or '',
+            'type': data.get('type', 'text'),
+            'metadata': data.get('metadata', {})
+        }])[0]
+        
+        db.session.commit()
+        broadcast_messages([message], [data.get('clientId')])
+        
+        return jsonify({
+            'message': message
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/messages/<int:message_id>/reactions', methods=['POST', 'DELETE'])
+@jwt_required()
+def update_reaction(message_id):
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json(silent=True) or {}
+        emoji = data.get('emoji') or request.args.get('emoji')
+        
+        if not emoji or len(emoji) > 10:
+            return jsonify({'error': 'A single emoji is required'}), 400
+        
+        message = db.session.get(Message, message_id)
+        if not message or not is_chat_member(message.chat_id, user_id):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        existing = MessageReaction.query.filter_by(message_id=message_id, emoji=emoji, user_id=user_id).first()
+        if request.method == 'POST' and not existing:
+            db.session.add(MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji))
+            delta = 1
+        elif request.method == 'DELETE' and existing:
+            db.session.delete(existing)
+            delta = -1
+        else:
+            # Repeated add or remove is a no-op
+            delta = 0
+        
+        count = adjust_reaction_count(message_id, emoji, delta) if delta else (
+            db.session.query(MessageReactionCount.count).filter_by(message_id=message_id, emoji=emoji).scalar() or 0
         )
+        db.session.commit()
         
-        db.session.add(message)
+        reaction = {
+            'messageId': message_id,
+            'chatId': message.chat_id,
+            'emoji': emoji,
+            'count': count,
+            'userId': user_id,
+            'reacted': request.method == 'POST'
+        }
+        if delta:
+            # Members apply the delta to their copy instead of refetching the message
+            socketio.emit('reaction', reaction, room=f'chat_{message.chat_id}')
         
-        # Update chat's last message
-        chat = Chat.query.get(data['chatId'])
-        chat.last_message_id = message.id
-        chat.updated_at = datetime.utcnow()
+        return jsonify({'reaction': reaction}), 200
         
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<int:chat_id>/messages/import', methods=['POST'])
+@jwt_required()
+def import_messages(chat_id):
+    try:
+        user_id = get_jwt_identity()
+        
+        if not is_chat_member(chat_id, user_id):
+            return jsonify({'error': 'Access denied'}), 403
+        is_admin = bool(db.session.query(ChatParticipant.is_admin).filter_by(
+            chat_id=chat_id, user_id=int(user_id)
+        ).scalar())
+        
+        # Read NDJSON line by line and insert in batched transactions;
+        # batches before a bad line stay committed and are reported back
+        imported = 0
+        batch = []
+        line_number = 0
+        try:
+            for line_number, line in enumerate(request.stream, start=1):
+                if not line.strip():
+                    continue
+                batch.append(parse_import_line(line, chat_id, user_id, is_admin))
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    db.session.execute(insert(Message), batch)
+                    db.session.commit()
+                    imported += len(batch)
+                    batch = []
+        except (ValueError, TypeError, AttributeError) as e:
+            db.session.rollback()
+            refresh_chat_summary(chat_id)
+            db.session.commit()
+            return jsonify({'error': f'Line {line_number}: {e}', 'imported': imported}), 400
+        
+        if batch:
+            db.session.execute(insert(Message), batch)
+            imported += len(batch)
+        refresh_chat_summary(chat_id)
         db.session.commit()
         
-        return jsonify({
-            'message': message.to_dict()
-        }), 201
+        return jsonify({'imported': imported}), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<int:chat_id>/messages/export', methods=['GET'])
+@jwt_required()
+def export_messages(chat_id):
+    try:
+        user_id = get_jwt_identity()
+        
+        if not is_chat_member(chat_id, user_id):
+            return jsonify({'error': 'Access denied'}), 403
+        
+        participants = ChatParticipant.query.filter_by(chat_id=chat_id).all()
+        
+        # Walk the history in keyset pages so only one page is in memory at a time
+        def generate():
+            position = None
+            while True:
+                query = Message.query.filter_by(chat_id=chat_id).options(*message_load_options())
+                if position:
+                    query = query.filter(tuple_(Message.timestamp, Message.id) > tuple_(*position))
+                page = query.order_by(Message.timestamp.asc(), Message.id.asc()).limit(EXPORT_PAGE_SIZE).all()
+                attach_reaction_details(page, user_id)
+                attach_receipt_status(page, participants)
+                referenced_users(messages=page)
+                for message in page:
+                    yield app.json.dumps(message.to_dict()) + '\n'
+                if len(page) < EXPORT_PAGE_SIZE:
+                    return
+                position = (page[-1].timestamp, page[-1].id)
+                db.session.expunge_all()
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename=chat_{chat_id}_messages.ndjson'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chats/<int:chat_id>/read', methods=['POST'])
+@jwt_required()
+def mark_chat_read(chat_id):
+    try:
+        user_id = get_jwt_identity()
+        
+        updated = ChatInbox.query.filter_by(
+            chat_id=chat_id,
+            user_id=user_id
+        ).update({ChatInbox.unread_count: 0}, synchronize_session=False)
+        
+        if not updated:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        db.session.commit()
+        
+        # Advance the read mark over the whole chat with the next receipt flush
+        highest = highest_message_ids([chat_id]).get(chat_id)
+        if highest:
+            record_receipt(chat_id, user_id, highest, highest)
+        
+        return jsonify({'chatId': chat_id, 'unreadCount': 0}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -579,6 +2784,7 @@ def delete_note(note_id):
             return jsonify({'error': 'Note not found'}), 404
         
         db.session.delete(note)
+        db.session.add(SyncTombstone(user_id=note.user_id, entity='note', entity_id=note.id))
         db.session.commit()
         
         return jsonify({'message': 'Note deleted successfully'}), 200
@@ -586,6 +2792,85 @@ def delete_note(note_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Sync Routes
+# Rows are stamped before their transaction commits, so a row can become visible after a newer one.
+# Deltas reach back this far before `since` (clients upsert by id), and ETags are only issued once
+# the newest change is older than this, when no earlier-stamped row can still appear.
+SYNC_OVERLAP = timedelta(seconds=float(os.getenv('SYNC_OVERLAP_SECONDS', '30')))
+
+def sync_watermark(user_id):
+    # Newest change for the user across notes, inbox entries and tombstones, in one indexed query
+    latest = db.session.query(
+        db.session.query(func.max(Note.updated_at)).filter(Note.user_id == user_id).scalar_subquery(),
+        db.session.query(func.max(ChatInbox.updated_at)).filter(ChatInbox.user_id == user_id).scalar_subquery(),
+        db.session.query(func.max(SyncTombstone.deleted_at)).filter(SyncTombstone.user_id == user_id).scalar_subquery()
+    ).one()
+    return max((value for value in latest if value), default=None)
+
+@app.route('/api/sync', methods=['GET'])
+@jwt_required()
+def sync_changes():
+    try:
+        user_id = get_jwt_identity()
+        
+        since = request.args.get('since')
+        if since:
+            try:
+                since = datetime.fromisoformat(since.replace('Z', '+00:00')).replace(tzinfo=None)
+            except ValueError:
+                return jsonify({'error': 'Invalid since watermark'}), 400
+        
+        # Short-circuit unchanged polls before loading any rows, once the newest change has settled
+        watermark = sync_watermark(user_id)
+        compact = wants_compact()
+        settled = watermark is None or watermark <= datetime.utcnow() - SYNC_OVERLAP
+        etag = f'{user_id}-{watermark.isoformat() if watermark else "empty"}-{since.isoformat() if since else "full"}'
+        if compact:
+            etag += '-compact'
+        # Weak, because identity, gzip and brotli bodies of one payload share it
+        if settled and request.if_none_match.contains_weak(etag):
+            return Response(status=304, headers={'ETag': f'W/"{etag}"'})
+        
+        notes = Note.query.filter_by(user_id=user_id)
+        entries = ChatInbox.query.filter_by(user_id=user_id).options(
+            selectinload(ChatInbox.chat).options(*chat_load_options())
+        )
+        # A full sync has nothing to delete locally
+        tombstones = []
+        if since:
+            window = since - SYNC_OVERLAP
+            notes = notes.filter(Note.updated_at > window)
+            entries = entries.filter(ChatInbox.updated_at > window)
+            tombstones = db.session.query(SyncTombstone.entity, SyncTombstone.entity_id).filter(
+                SyncTombstone.user_id == user_id, SyncTombstone.deleted_at > window
+            )
+        
+        deleted = {'notes': [], 'chats': []}
+        for entity, entity_id in tombstones:
+            deleted.setdefault(f'{entity}s', []).append(entity_id)
+        
+        entries = entries.order_by(ChatInbox.updated_at.asc()).all()
+        attach_reaction_details([entry.chat.last_message for entry in entries], user_id)
+        for entry in entries:
+            attach_receipt_status([entry.chat.last_message], entry.chat.participants)
+        users = referenced_users(chats=[entry.chat for entry in entries])
+        payload = {
+            'notes': [note.to_dict() for note in notes.order_by(Note.updated_at.asc())],
+            'chats': [entry.to_dict(compact) for entry in entries],
+            'deleted': deleted,
+            'watermark': (watermark or since).isoformat() if (watermark or since) else None
+        }
+        if compact:
+            payload['users'] = users
+        
+        response = jsonify(payload)
+        if settled:
+            response.set_etag(etag, weak=True)
+        return response, 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # AI Routes
 @app.route('/api/ai/chat', methods=['POST'])
 @jwt_required()
@@ -595,41 +2880,183 @@ def ai_chat():
         user_id = get_jwt_identity()
         
         # Get user for context
-        user = User.query.get(user_id)
-        
-        # Initialize Gemini model
-        model = genai.GenerativeModel('gemini-pro')
+        user = user_cache.get(user_id)
         
         # Create prompt based on persona
         persona = data.get('persona', 'main')
         message = data.get('message', '')
+        prompt = build_ai_prompt(persona, user['displayName'], message)
         
-        if persona == 'main':
-            prompt = f"You are a helpful AI assistant. User: {user.display_name} is asking: {message}"
-        elif persona == 'lawyer':
-            prompt = f"You are a legal assistant. Provide legal advice and information. User: {user.display_name} is asking: {message}"
-        elif persona == 'writer':
-            prompt = f"You are a writing assistant. Help with content creation and editing. User: {user.display_name} is asking: {message}"
-        elif persona == 'teacher':
-            prompt = f"You are an educational tutor. Help with learning and teaching. User: {user.display_name} is asking: {message}"
-        elif persona == 'doctor':
-            prompt = f"You are a health advisor. Provide general health information (not medical advice). User: {user.display_name} is asking: {message}"
-        elif persona == 'developer':
-            prompt = f"You are a code assistant. Help with programming and technical questions. User: {user.display_name} is asking: {message}"
-        else:
-            prompt = f"You are a helpful AI assistant. User: {user.display_name} is asking: {message}"
-        
-        # Generate response
-        response = model.generate_content(prompt)
+        # Generate response on the shared worker pool; repeated questions share one upstream call
+        future = ai_cache.get_or_submit(
+            AIResponseCache.key(persona, user['displayName'], message),
+            lambda: submit_ai_job(generate_ai_response, prompt)
+        )
+        if not future:
+            return jsonify({'error': 'AI service is busy, try again shortly'}), 503
         
         return jsonify({
-            'response': response.text,
+            'response': future.result(timeout=AI_TIMEOUT),
             'persona': persona
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ai/chat/stream', methods=['POST'])
+@jwt_required()
+def ai_chat_stream():
+    try:
+        data = request.get_json()
+        user_id = get_jwt_identity()
+        
+        # Get user for context
+        user = user_cache.get(user_id)
+        
+        persona = data.get('persona', 'main')
+        message = data.get('message', '')
+        prompt = build_ai_prompt(persona, user['displayName'], message)
+        
+        def submit():
+            feed = AIStreamFeed()
+            future = submit_ai_job(stream_ai_response, prompt, feed)
+            if future:
+                future.feed = feed
+            return future
+        
+        # Repeated questions share one upstream call, like /api/ai/chat; the cache keeps finished answers
+        future = ai_cache.get_or_submit(AIResponseCache.key(persona, user['displayName'], message), submit)
+        if not future:
+            return jsonify({'error': 'AI service is busy, try again shortly'}), 503
+        
+        def events():
+            # Follow a streaming call from its first chunk; cached answers and non-streaming calls
+            # arrive whole
+            if hasattr(future, 'feed'):
+                yield from future.feed.follow(AI_TIMEOUT)
+                return
+            try:
+                yield 'chunk', future.result(timeout=AI_TIMEOUT)
+                yield 'done', None
+            except FutureTimeoutError:
+                yield 'timeout', None
+            except Exception as e:
+                yield 'error', str(e)
+        
+        # Relay chunks as NDJSON lines as soon as the model produces them
+        def generate():
+            started = time.monotonic()
+            first_token_ms = None
+            for kind, value in events():
+                if kind == 'chunk':
+                    if first_token_ms is None:
+                        first_token_ms = round((time.monotonic() - started) * 1000, 1)
+                    yield json.dumps({'type': 'chunk', 'text': value}) + '\n'
+                elif kind == 'timeout':
+                    yield json.dumps({'type': 'error', 'error': 'AI response timed out'}) + '\n'
+                elif kind == 'error':
+                    yield json.dumps({'type': 'error', 'error': value}) + '\n'
+                else:
+                    yield json.dumps({
+                        'type': 'done',
+                        'persona': persona,
+                        'timeToFirstTokenMs': first_token_ms
+                    }) + '\n'
+                    return
+        
+        return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/ai/cache/stats', methods=['GET'])
+@jwt_required()
+def ai_cache_stats():
+    return jsonify({'cache': ai_cache.stats()}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Scrapers authenticate with METRICS_TOKEN when one is configured
+    token = os.getenv('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({'error': 'Access denied'}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/media', methods=['POST'])
+@jwt_required()
+def upload_media():
+    try:
+        user_id = int(get_jwt_identity())
+        
+        # Multipart uploads use the 'file' field; a raw body with its Content-Type is also accepted
+        upload = request.files.get('file')
+        stream, mimetype = (upload.stream, upload.mimetype) if upload else (request.stream, request.mimetype)
+        if not mimetype or mimetype.startswith('multipart/'):
+            return jsonify({'error': 'A file is required'}), 400
+        
+        try:
+            digest, size = store_upload(stream)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        asset = db.session.get(MediaAsset, digest)
+        created = asset is None
+        if created:
+            asset = MediaAsset(id=digest, uploader_id=user_id, mimetype=mimetype, size=size)
+            db.session.add(asset)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another request stored the same bytes first
+                db.session.rollback()
+                asset = db.session.get(MediaAsset, digest)
+                created = False
+            else:
+                schedule_thumbnail(asset)
+        
+        return jsonify({
+            'media': asset.to_dict()
+        }), 201 if created else 200
+        
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/media/<digest>', methods=['GET'])
+def download_media(digest):
+    try:
+        # Chat members receive signed, expiring URLs with each message; nothing else grants access
+        max_age = media_url_expiry(digest)
+        if max_age is None:
+            return jsonify({'error': 'Access denied'}), 403
+        asset = db.session.get(MediaAsset, digest) if re.fullmatch('[0-9a-f]{64}', digest) else None
+        if not asset:
+            return jsonify({'error': 'Not found'}), 404
+        
+        return serve_media(media_path(digest), asset, max_age)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/media/<digest>/thumbnail', methods=['GET'])
+def download_thumbnail(digest):
+    try:
+        max_age = media_url_expiry(digest)
+        if max_age is None:
+            return jsonify({'error': 'Access denied'}), 403
+        asset = db.session.get(MediaAsset, digest) if re.fullmatch('[0-9a-f]{64}', digest) else None
+        if not asset or asset.kind != 'image':
+            return jsonify({'error': 'Not found'}), 404
+        
+        # Until the worker finishes, fall back to the original without long-lived caching
+        if asset.has_thumbnail:
+            return serve_media(media_path(digest, 'thumbnail'), asset, max_age, mimetype='image/jpeg')
+        return serve_media(media_path(digest), asset, max_age, immutable=False)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Socket.IO Events
 @socketio.on('connect')
 def handle_connect(auth=None):
@@ -644,17 +3071,16 @@ def handle_connect(auth=None):
         if not token:
             return False
         
-        # Verify JWT token
-        from flask_jwt_extended import decode_token
+        # Verify JWT token once and bind the user to this session
         decoded_token = decode_token(token)
         user_id = decoded_token['sub']
         
-        user = User.query.get(user_id)
+        user = user_cache.get(user_id)
         if user:
-            user.is_online = True
-            user.last_seen = datetime.utcnow()
-            db.session.commit()
-            emit('userOnline', {'userId': user_id})
+            # Online status and last_seen are written and broadcast in bulk by the presence aggregator
+            socket_users[request.sid] = user_id
+            join_room(f'user_{user_id}')  # Presence digests for this user's contacts
+            record_presence(user_id, True)
             return True
         return False
     except Exception as e:
@@ -664,44 +3090,24 @@ def handle_connect(auth=None):
 @socketio.on('disconnect')
 def handle_disconnect():
     try:
-        # Get token from request headers
-        token = request.headers.get('Authorization')
-        if token:
-            token = token.replace('Bearer ', '')
-            from flask_jwt_extended import decode_token
-            decoded_token = decode_token(token)
-            user_id = decoded_token['sub']
-            
-            user = User.query.get(user_id)
-            if user:
-                user.is_online = False
-                user.last_seen = datetime.utcnow()
-                db.session.commit()
-                emit('userOffline', {'userId': user_id})
+        user_id = socket_users.pop(request.sid, None)
+        if user_id:
+            clear_typing(user_id)
+            record_presence(user_id, False)
     except Exception as e:
         print(f"Socket disconnect error: {e}")
 
 @socketio.on('join_chat')
 def handle_join_chat(data):
     try:
-        # Get user ID from token
-        token = request.headers.get('Authorization')
-        if not token:
+        user_id = current_socket_user()
+        if not user_id:
             return False
-        token = token.replace('Bearer ', '')
-        from flask_jwt_extended import decode_token
-        decoded_token = decode_token(token)
-        user_id = decoded_token['sub']
         
         chat_id = data['chatId']
         
         # Check if user is participant
-        participant = ChatParticipant.query.filter_by(
-            chat_id=chat_id, 
-            user_id=user_id
-        ).first()
-        
-        if participant:
+        if is_chat_member(chat_id, user_id):
             join_room(f'chat_{chat_id}')
             emit('joined_chat', {'chatId': chat_id})
             return True
@@ -722,71 +3128,173 @@ def handle_leave_chat(data):
 @socketio.on('send_message')
 def handle_send_message(data):
     try:
-        # Get user ID from token
-        token = request.headers.get('Authorization')
-        if not token:
-            return False
-        token = token.replace('Bearer ', '')
-        from flask_jwt_extended import decode_token
-        decoded_token = decode_token(token)
-        user_id = decoded_token['sub']
+        user_id = current_socket_user()
+        if not user_id:
+            return reject_message(data, 'Not authenticated')
         
         chat_id = data['chatId']
         
         # Check if user is participant
-        participant = ChatParticipant.query.filter_by(
-            chat_id=chat_id, 
-            user_id=user_id
-        ).first()
+        if not is_chat_member(chat_id, user_id):
+            return reject_message(data, 'Access denied')
         
-        if participant:
-            # Broadcast message to all participants in the chat
-            emit('message', data, room=f'chat_{chat_id}')
-            return True
-        return False
+        if not is_valid_message(data):
+            return reject_message(data, 'Message content is required')
+        
+        # Persisted and broadcast to the room by the batched ingest pipeline
+        enqueue_message({
+            'sid': request.sid,
+            'chatId': chat_id,
+            'userId': user_id,
+            'content': data.get('content') or '',
+            'type': data.get('type', 'text'),
+            'metadata': data.get('metadata') or {},
+            'clientId': data.get('clientId'),
+            'timestamp': datetime.utcnow()
+        })
+        return True
     except Exception as e:
         print(f"Send message error: {e}")
-        return False
+        return reject_message(data, 'Message could not be sent')
 
 @socketio.on('typing')
 def handle_typing(data):
     try:
-        # Get user ID from token
-        token = request.headers.get('Authorization')
-        if not token:
+        user_id = current_socket_user()
+        if not user_id:
             return False
-        token = token.replace('Bearer ', '')
-        from flask_jwt_extended import decode_token
-        decoded_token = decode_token(token)
-        user_id = decoded_token['sub']
         
         chat_id = data['chatId']
         is_typing = data['isTyping']
         
-        # Broadcast typing status to other participants
-        emit('typing', {
-            'chatId': chat_id,
-            'userId': user_id,
-            'isTyping': is_typing
-        }, room=f'chat_{chat_id}', include_self=False)
+        if not is_chat_member(chat_id, user_id):
+            return False
+        
+        # Broadcast to the room in the next typing digest
+        set_typing(chat_id, user_id, bool(is_typing))
         return True
     except Exception as e:
         print(f"Typing error: {e}")
         return False
 
+@socketio.on('ack')
+def handle_ack(data):
+    try:
+        user_id = current_socket_user()
+        if not user_id:
+            return False
+        
+        # Clients batch acks as {'receipts': [{'chatId', 'delivered', 'read'}, ...]}; the
+        # aggregator writes and broadcasts them on its next receipt flush
+        for receipt in data.get('receipts', [])[:RECEIPT_BATCH_LIMIT]:
+            chat_id = int(receipt['chatId'])
+            if is_chat_member(chat_id, user_id):
+                record_receipt(chat_id, user_id, int(receipt.get('delivered') or 0), int(receipt.get('read') or 0))
+        return True
+    except Exception as e:
+        print(f"Ack error: {e}")
+        return False
+
 # Error Handlers
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({'error': 'Not found'}), 404
 
+@app.errorhandler(413)
+def request_too_large(error):
+    return jsonify({'error': f'Uploads are limited to {MEDIA_MAX_BYTES // (1024 * 1024)} MB'}), 413
+
 @app.errorhandler(500)
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
-# Initialize Database
-if __name__ == '__main__':
+# Schema migrations
+def create_missing_tables():
+    db.create_all()
+
+def create_hot_path_indexes():
+    # Drop duplicate participant rows left by older create_chat calls before enforcing uniqueness
+    db.session.execute(text(
+        "DELETE FROM chat_participant WHERE id NOT IN "
+        "(SELECT MIN(id) FROM chat_participant GROUP BY chat_id, user_id)"
+    ))
+    db.session.commit()
+    # MessageReaction indexes come with step 5, which first collapses the duplicates its unique index rejects
+    for table in (ChatParticipant, Message, Note, ChatInbox, User):
+        for index in table.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
+
+def add_receipt_marks():
+    # Tables created before the receipt columns existed need them added in place
+    columns = {column['name'] for column in inspect(db.engine).get_columns('chat_participant')}
+    for column in ('last_delivered_message_id', 'last_read_message_id'):
+        if column not in columns:
+            db.session.execute(text(f'ALTER TABLE chat_participant ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0'))
+
+def index_inbox_by_chat():
+    # Every message write updates the chat's inbox entries by chat id
+    for index in ChatInbox.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+def index_messages_by_chat_and_id():
+    # Receipt flushes clamp marks to each chat's highest message id
+    for index in Message.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+# Append new steps with the next version number; applied steps must never change
+MIGRATIONS = [
+    (1, 'Create missing tables', create_missing_tables),
+    (2, 'Index hot lookup paths and enforce unique chat participants', create_hot_path_indexes),
+    (3, 'Backfill chat inbox entries', backfill_inbox),
+    (4, 'Create full-text search indexes', init_search_index),
+    (5, 'Aggregate message reactions per emoji', backfill_reaction_counts),
+    (6, 'Create media asset storage', lambda: MediaAsset.__table__.create(db.engine, checkfirst=True)),
+    (7, 'Add delivery and read receipt marks', add_receipt_marks),
+    (8, 'Create presence sessions shared by all workers', lambda: PresenceSession.__table__.create(db.engine, checkfirst=True)),
+    (9, 'Index chat inbox entries by chat', index_inbox_by_chat),
+    (10, 'Create PostgreSQL full-text search indexes', init_tsvector_index),
+    (11, 'Index messages by chat and id', index_messages_by_chat_and_id),
+]
+
+def migrate_database():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = set(db.session.execute(db.select(SchemaMigration.version)).scalars())
+    for version, description, step in MIGRATIONS:
+        if version in applied:
+            continue
+        try:
+            step()
+            db.session.add(SchemaMigration(version=version, description=description))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        print(f"Applied migration {version}: {description}")
+
+@app.cli.command('migrate')
+def migrate_command():
+    migrate_database()
+
+# Application factory
+def create_app():
+    # Used by wsgi.py and the development server to warm per-process caches. Configuration is read
+    # from the environment when this module is imported, because the extensions bind to the app
+    # right then; set variables before starting the process rather than changing app.config later.
+    # Migrations are not run here, so that workers never race each other on the schema
     with app.app_context():
-        db.create_all()
-    
-    # Run the app
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
+        user_search_index.sync()
+    return app
+
+if __name__ == '__main__':
+    # Development server; production runs wsgi.py under gunicorn (see gunicorn.conf.py)
+    debug = os.getenv('FLASK_DEBUG', 'true').lower() in ('1', 'true')
+    if os.getenv('AUTO_MIGRATE', 'true').lower() == 'true':
+        with app.app_context():
+            migrate_database()
+    socketio.run(
+        create_app(),
+        debug=debug,
+        host=os.getenv('HOST', '0.0.0.0'),
+        port=int(os.getenv('PORT', '5000')),
+        allow_unsafe_werkzeug=debug
+    )
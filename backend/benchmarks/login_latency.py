@@ -0,0 +1,102 @@
+# Login latency under concurrent load.
+#
+# Starts one gunicorn server (wsgi.py, gevent) on a scratch SQLite database, registers users, then
+# fires logins from many client threads at once. A mix of correct and wrong passwords exercises
+# the hashing pool and the negative cache. Each client thread sends a distinct X-Forwarded-For,
+# as it would through a proxy, so the per-IP limiter does not cut the run short. /api/auth/me is
+# polled alongside to show how much the login burst slows everything else in the same worker.
+#
+#   python benchmarks/login_latency.py --threads 50 --logins 20
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from socket_fanout import BACKEND, percentile, register, start_workers, stop_workers
+
+def timed_login(url, email, password, client_ip):
+    started = time.perf_counter()
+    response = requests.post(url + '/api/auth/login', json={'email': email, 'password': password},
+                             headers={'X-Forwarded-For': client_ip})
+    return response.status_code, (time.perf_counter() - started) * 1000
+
+def poll_me(url, token, stop, latencies):
+    while not stop.is_set():
+        started = time.perf_counter()
+        requests.get(url + '/api/auth/me', headers={'Authorization': f'Bearer {token}'})
+        latencies.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.05)
+
+def summary(latencies):
+    return f'{percentile(latencies, 0.5):>8.1f} {percentile(latencies, 0.99):>8.1f} {max(latencies):>8.1f} {statistics.mean(latencies):>8.1f}'
+
+def main():
+    parser = argparse.ArgumentParser(description='Login latency under concurrent load')
+    parser.add_argument('--threads', type=int, default=50, help='concurrent login clients')
+    parser.add_argument('--logins', type=int, default=20, help='logins per client')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--wrong', type=float, default=0.5, help='share of logins with a wrong password')
+    parser.add_argument('--port', type=int, default=5100)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='login-latency-')
+    env = dict(
+        os.environ,
+        DATABASE_URL='sqlite:///' + os.path.join(data_dir, 'bench.db'),
+        MEDIA_ROOT=os.path.join(data_dir, 'media'),
+        SOCKETIO_ASYNC_MODE='gevent',
+        AUTO_MIGRATE='false',
+        FLASK_DEBUG='false',
+        PROXY_FIX_X_FOR='1',
+        LOGIN_ATTEMPTS_PER_MINUTE=str(args.logins + 1)
+    )
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=BACKEND, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{args.port}'
+    workers = start_workers(1, args.port, env)
+    try:
+        tokens = [register(url, f'user{index}') for index in range(args.users)]
+
+        def client(index):
+            results = []
+            for attempt in range(args.logins):
+                user = (index + attempt) % args.users
+                wrong = (attempt / args.logins) < args.wrong
+                # Wrong passwords repeat per user, so later ones are answered from the negative cache
+                password = f'wrong-{user}' if wrong else 'benchmark'
+                results.append(timed_login(url, f'user{user}@bench.local', password, f'198.51.{index // 250}.{index % 250 + 1}'))
+            return results
+
+        stop = threading.Event()
+        me_latencies = []
+        poller = threading.Thread(target=poll_me, args=(url, tokens[0], stop, me_latencies))
+        poller.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            results = [result for results in pool.map(client, range(args.threads)) for result in results]
+        elapsed = time.perf_counter() - started
+        stop.set()
+        poller.join()
+    finally:
+        stop_workers(workers, args.port)
+
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f'{len(results)} logins from {args.threads} clients in {elapsed:.1f}s ({len(results) / elapsed:.0f}/s), statuses {statuses}')
+    print(f"{'':>14} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'mean ms':>8}")
+    print(f"{'login ok':>14} {summary([ms for status, ms in results if status == 200])}")
+    print(f"{'login failed':>14} {summary([ms for status, ms in results if status != 200])}")
+    print(f"{'auth/me':>14} {summary(me_latencies)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+# Socket.IO fan-out latency as the number of workers grows.
+#
+# Starts N single-worker gunicorn servers (wsgi.py, gevent) on consecutive ports, all sharing one
+# SQLite database and one Socket.IO message queue. Receivers connect round-robin across the
+# workers and join one group chat, so most deliveries cross the queue. One sender on the first
+# worker sends messages at a fixed rate; the time from send to arrival is recorded for every receiver.
+#
+#   redis-server --port 6379 &
+#   python benchmarks/socket_fanout.py --workers 1 2 4 --message-queue redis://localhost:6379/0
+#
+# Needs the production requirements plus python-socketio's client (websocket-client) and a client
+# library for the queue (redis for redis://).
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGIN = 'http://localhost:3000'  # Must be an allowed CORS origin
+
+def start_workers(count, base_port, env):
+    # Each server gets its own process group so stopping it also stops its worker and pool processes
+    workers = []
+    try:
+        for index in range(count):
+            worker_env = dict(env, PORT=str(base_port + index), WEB_CONCURRENCY='1')
+            workers.append(subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                cwd=BACKEND, env=worker_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                start_new_session=True
+            ))
+        for index in range(count):
+            wait_until(lambda: responds(f'http://127.0.0.1:{base_port + index}'), f'port {base_port + index} to serve')
+    except Exception:
+        stop_workers(workers, base_port)
+        raise
+    return workers
+
+def stop_workers(workers, base_port):
+    for worker in workers:
+        os.killpg(worker.pid, signal.SIGTERM)
+    for index, worker in enumerate(workers):
+        try:
+            worker.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            os.killpg(worker.pid, signal.SIGKILL)
+            worker.wait()
+        wait_until(lambda: not port_open(base_port + index), f'port {base_port + index} to close')
+
+def responds(url):
+    try:
+        requests.get(url + '/metrics', timeout=1)
+        return True
+    except requests.RequestException:
+        return False
+
+def port_open(port):
+    with socket.socket() as probe:
+        return probe.connect_ex(('127.0.0.1', port)) == 0
+
+def wait_until(condition, description, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'Timed out waiting for {description}')
+
+def register(url, username):
+    response = requests.post(url + '/api/auth/register', json={
+        'username': username,
+        'email': f'{username}@bench.local',
+        'password': 'benchmark',
+        'displayName': username
+    })
+    response.raise_for_status()
+    return response.json()['token']
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def run(worker_count, args, env, tokens, chat_id):
+    workers = start_workers(worker_count, args.port, env)
+    clients = []
+    try:
+        urls = [f'http://127.0.0.1:{args.port + index}' for index in range(worker_count)]
+        sent_at = {}
+        latencies = []
+        lock = threading.Lock()
+        done = threading.Event()
+        expected = args.messages * args.clients
+
+        def on_message(message):
+            arrived = time.perf_counter()
+            with lock:
+                started = sent_at.get(message.get('clientId'))
+                if started is not None:
+                    latencies.append(arrived - started)
+                    if len(latencies) >= expected:
+                        done.set()
+
+        for index, token in enumerate(tokens['receivers']):
+            client = socketio.Client(websocket_extra_options={'origin': ORIGIN})
+            client.on('message', on_message)
+            client.connect(urls[index % worker_count], auth={'token': token}, transports=['websocket'])
+            assert client.call('join_chat', {'chatId': chat_id})
+            clients.append(client)
+
+        sender = socketio.Client(websocket_extra_options={'origin': ORIGIN})
+        sender.connect(urls[0], auth={'token': tokens['sender']}, transports=['websocket'])
+        clients.append(sender)
+        time.sleep(0.5)
+
+        interval = 1 / args.rate
+        for index in range(args.messages):
+            client_id = f'{worker_count}-{index}'
+            with lock:
+                sent_at[client_id] = time.perf_counter()
+            sender.emit('send_message', {'chatId': chat_id, 'content': f'benchmark {index}', 'clientId': client_id})
+            time.sleep(interval)
+        done.wait(args.timeout)
+
+        with lock:
+            delivered = list(latencies)
+        return {
+            'workers': worker_count,
+            'delivered': len(delivered),
+            'expected': expected,
+            'p50': percentile(delivered, 0.5) * 1000 if delivered else None,
+            'p99': percentile(delivered, 0.99) * 1000 if delivered else None,
+            'max': max(delivered) * 1000 if delivered else None,
+            'mean': statistics.mean(delivered) * 1000 if delivered else None
+        }
+    finally:
+        for client in clients:
+            client.disconnect()
+        stop_workers(workers, args.port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO fan-out latency by worker count')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=40, help='receiving sockets, spread across workers')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=50, help='messages sent per second')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--message-queue', default=os.getenv('SOCKETIO_MESSAGE_QUEUE', 'redis://localhost:6379/0'))
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='socket-fanout-')
+    env = dict(
+        os.environ,
+        DATABASE_URL='sqlite:///' + os.path.join(data_dir, 'bench.db'),
+        MEDIA_ROOT=os.path.join(data_dir, 'media'),
+        SOCKETIO_MESSAGE_QUEUE=args.message_queue,
+        SOCKETIO_ASYNC_MODE='gevent',
+        AUTO_MIGRATE='false',
+        FLASK_DEBUG='false'
+    )
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=BACKEND, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    # Users and the chat are created once and reused for every worker count
+    workers = start_workers(1, args.port, env)
+    try:
+        url = f'http://127.0.0.1:{args.port}'
+        names = [f'receiver{index}' for index in range(args.clients)]
+        tokens = {'sender': register(url, 'sender'), 'receivers': [register(url, name) for name in names]}
+        chat = requests.post(url + '/api/chats', json={'participants': names},
+                             headers={'Authorization': f"Bearer {tokens['sender']}"})
+        chat.raise_for_status()
+        chat_id = chat.json()['chat']['id']
+    finally:
+        stop_workers(workers, args.port)
+
+    print(f'{args.clients} receivers, {args.messages} messages at {args.rate:g}/s via {args.message_queue}')
+    print(f"{'workers':>7} {'delivered':>12} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'mean ms':>8}")
+    for worker_count in args.workers:
+        result = run(worker_count, args, env, tokens, chat_id)
+        if not result['delivered']:
+            print(f"{worker_count:>7} {0:>5}/{result['expected']:<6}")
+            continue
+        print(f"{worker_count:>7} {result['delivered']:>5}/{result['expected']:<6} {result['p50']:>8.1f} "
+              f"{result['p99']:>8.1f} {result['max']:>8.1f} {result['mean']:>8.1f}")
+
+if __name__ == '__main__':
+    main()
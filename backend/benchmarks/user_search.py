@@ -0,0 +1,114 @@
+# User search: the in-memory gram index against the SQL LIKE scan it replaced.
+#
+# Fills a scratch SQLite database with generated users, growing it to each requested size, then
+# times the same queries both ways. "like" is the original route's query: username or display name
+# contains the text, LIMIT 10. "index" is UserSearchIndex.search plus loading the matched rows by id.
+# Queries mix prefixes, infixes and misses; misses are the worst case for LIKE because it scans
+# the whole table.
+#
+#   python benchmarks/user_search.py --users 100000 1000000
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='user-search-')
+
+# app.py reads its configuration at import time
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DATA_DIR, 'bench.db')
+os.environ['MEDIA_ROOT'] = os.path.join(DATA_DIR, 'media')
+os.environ.pop('DATABASE_READ_URL', None)
+sys.path.insert(0, BACKEND)
+
+import app as app_module  # noqa: E402
+from app import User, db, insert  # noqa: E402
+
+SYLLABLES = ['ka', 'ri', 'to', 'mel', 'an', 'jo', 'sa', 'li', 'ven', 'dor', 'ne', 'ul', 'bri', 'os', 'ta', 'gu']
+
+def make_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+def add_users(start, stop, rng):
+    batch = []
+    for index in range(start, stop):
+        first, last = make_name(rng), make_name(rng)
+        batch.append({
+            'username': f'{first}{index}',
+            'email': f'user{index}@bench.local',
+            'display_name': f'{first.title()} {last.title()}'
+        })
+        if len(batch) == 10000:
+            db.session.execute(insert(User), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(User), batch)
+    db.session.commit()
+
+def make_queries(rng, count):
+    queries = []
+    for _ in range(count):
+        name = make_name(rng)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(name[:rng.randint(2, len(name))])  # prefix
+        elif kind < 0.8:
+            queries.append(name[1:rng.randint(3, len(name))])  # infix
+        else:
+            queries.append(name + 'zzq')  # miss
+    return [query for query in queries if len(query) >= 2]
+
+def search_like(query, exclude_id):
+    return User.query.filter(
+        (User.username.contains(query)) |
+        (User.display_name.contains(query))
+    ).filter(User.id != exclude_id).limit(10).all()
+
+def search_index(query, exclude_id):
+    user_ids = app_module.user_search_index.search(query, exclude_id=exclude_id, limit=10)
+    return User.query.filter(User.id.in_(user_ids)).all() if user_ids else []
+
+def timed(search, queries, exclude_id):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query, exclude_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    latencies.sort()
+    return statistics.median(latencies), latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+def main():
+    parser = argparse.ArgumentParser(description='User search index vs SQL LIKE')
+    parser.add_argument('--users', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    queries = make_queries(rng, args.queries)
+    print(f'{len(queries)} queries, SQLite at {DATA_DIR}')
+    print(f"{'users':>9} {'build s':>8} {'like p50':>9} {'like p99':>9} {'index p50':>10} {'index p99':>10}")
+
+    with app_module.app.app_context():
+        app_module.migrate_database()
+        populated = 0
+        for size in sorted(args.users):
+            add_users(populated, size, rng)
+            populated = size
+
+            # Full rebuild, as a fresh worker does on its first search
+            app_module.user_search_index.__init__()
+            started = time.perf_counter()
+            app_module.user_search_index.sync()
+            build = time.perf_counter() - started
+
+            like_p50, like_p99 = timed(search_like, queries, 1)
+            index_p50, index_p99 = timed(search_index, queries, 1)
+            print(f'{size:>9} {build:>8.1f} {like_p50:>9.2f} {like_p99:>9.2f} {index_p50:>10.2f} {index_p99:>10.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Concurrent websocket connections and message throughput for one production worker.
+#
+# Starts one gunicorn server (wsgi.py, gevent) on a scratch SQLite database and opens --connections
+# authenticated Socket.IO websockets to it. The clients are python-socketio clients on gevent
+# greenlets, so thousands fit in one process. It reports how long connecting took and whether
+# every socket survived an idle hold. Then all sockets join one group chat and a sender pushes
+# --messages messages as fast as the server accepts them. It reports messages saved per second
+# (the sender's own echo) and deliveries per second across every socket.
+#
+#   python benchmarks/websocket_capacity.py --connections 1000 --messages 500
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+import requests  # noqa: E402
+import socketio  # noqa: E402
+from gevent.pool import Pool  # noqa: E402
+
+from socket_fanout import BACKEND, ORIGIN, percentile, register, start_workers, stop_workers  # noqa: E402
+
+def worker_rss_mb(master_pid):
+    # Resident memory of the gunicorn worker processes under the master
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as stat:
+                parent = int(stat.read().rsplit(')', 1)[1].split()[1])
+            if parent != master_pid:
+                continue
+            with open(f'/proc/{pid}/status') as status:
+                total += next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            continue
+    return total / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent websocket connections and messages per second')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=10, help='accounts the connections are spread over')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--hold', type=float, default=10, help='seconds to hold the sockets idle')
+    parser.add_argument('--concurrency', type=int, default=50, help='connection attempts in flight')
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='websocket-capacity-')
+    env = dict(
+        os.environ,
+        DATABASE_URL='sqlite:///' + os.path.join(data_dir, 'bench.db'),
+        MEDIA_ROOT=os.path.join(data_dir, 'media'),
+        SOCKETIO_ASYNC_MODE='gevent',
+        WORKER_CONNECTIONS=str(args.connections + 100),
+        AUTO_MIGRATE='false',
+        FLASK_DEBUG='false'
+    )
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=BACKEND, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    url = f'http://127.0.0.1:{args.port}'
+    workers = start_workers(1, args.port, env)
+    clients = []
+    try:
+        names = [f'user{index}' for index in range(args.users)]
+        tokens = [register(url, name) for name in names]
+        chat = requests.post(url + '/api/chats', json={'participants': names[1:]},
+                             headers={'Authorization': f'Bearer {tokens[0]}'})
+        chat.raise_for_status()
+        chat_id = chat.json()['chat']['id']
+        idle_rss = worker_rss_mb(workers[0].pid)
+
+        received = [0]
+        own = [0]
+
+        def open_socket(index):
+            client = socketio.Client(websocket_extra_options={'origin': ORIGIN})
+
+            @client.on('message')
+            def on_message(message):
+                received[0] += 1
+                if index == 0:
+                    own[0] += 1
+
+            started = time.perf_counter()
+            try:
+                client.connect(url, auth={'token': tokens[index % args.users]}, transports=['websocket'])
+            except socketio.exceptions.ConnectionError:
+                return None
+            clients.append(client)
+            return (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        connect_times = [ms for ms in Pool(args.concurrency).map(open_socket, range(args.connections)) if ms is not None]
+        connect_elapsed = time.perf_counter() - started
+
+        gevent.sleep(args.hold)
+        alive = sum(client.connected for client in clients)
+        held_rss = worker_rss_mb(workers[0].pid)
+
+        # Every socket joins the chat; the first one also sends
+        Pool(args.concurrency).map(lambda client: client.call('join_chat', {'chatId': chat_id}, timeout=args.timeout), clients)
+        sender = clients[0]
+        expected = args.messages * len(clients)
+        started = time.perf_counter()
+        for index in range(args.messages):
+            sender.emit('send_message', {'chatId': chat_id, 'content': f'benchmark {index}', 'clientId': str(index)})
+        deadline = time.monotonic() + args.timeout
+        while own[0] < args.messages and time.monotonic() < deadline:
+            gevent.sleep(0.01)
+        saved_elapsed = time.perf_counter() - started
+        while received[0] < expected and time.monotonic() < deadline:
+            gevent.sleep(0.05)
+        delivered_elapsed = time.perf_counter() - started
+    finally:
+        for client in clients:
+            client.disconnect()
+        stop_workers(workers, args.port)
+
+    print(f'connections: {len(connect_times)}/{args.connections} opened in {connect_elapsed:.1f}s '
+          f'(p50 {percentile(connect_times, 0.5):.0f} ms, p99 {percentile(connect_times, 0.99):.0f} ms)')
+    print(f'idle hold:   {alive}/{len(clients)} still connected after {args.hold:g}s, '
+          f'worker RSS {idle_rss:.0f} MB -> {held_rss:.0f} MB')
+    print(f'messages:    {own[0]}/{args.messages} echoed back to the sender in {saved_elapsed:.1f}s ({own[0] / saved_elapsed:.0f}/s)')
+    print(f'deliveries:  {received[0]}/{expected} in {delivered_elapsed:.1f}s ({received[0] / delivered_elapsed:.0f}/s)')
+
+if __name__ == '__main__':
+    main()
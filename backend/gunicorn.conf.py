@@ -0,0 +1,31 @@
+# gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import subprocess
+import sys
+
+async_mode = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+worker_class = {
+    'gevent': 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker',
+    'eventlet': 'eventlet',
+}[async_mode]
+
+# Idle websockets are not a hung worker
+timeout = int(os.getenv('WORKER_TIMEOUT_SECONDS', '120'))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+if workers > 1 and not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+    raise RuntimeError('WEB_CONCURRENCY > 1 needs SOCKETIO_MESSAGE_QUEUE so broadcasts reach every worker')
+
+def on_starting(server):
+    # Apply pending migrations once, from the master and before any worker boots, in a separate
+    # process so the master never imports the app ahead of the workers' monkey patching. A failed
+    # migration stops gunicorn here instead of failing every worker's boot
+    if os.getenv('AUTO_MIGRATE', 'true').lower() == 'true':
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
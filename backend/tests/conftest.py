@@ -0,0 +1,135 @@
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pytest
+
+# app.py reads its configuration from the environment at import time, so point it at a scratch
+# database and media root before importing it
+TEST_ROOT = tempfile.mkdtemp(prefix='one-in-one-tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_ROOT, 'test.db')
+os.environ['MEDIA_ROOT'] = os.path.join(TEST_ROOT, 'media')
+os.environ['JWT_SECRET_KEY'] = 'test-jwt-secret-key-long-enough-for-hs256'
+os.environ['SOCKETIO_ASYNC_MODE'] = 'threading'
+os.environ.pop('SOCKETIO_MESSAGE_QUEUE', None)  # Flask-SocketIO's test client refuses pub/sub managers
+os.environ.pop('DATABASE_READ_URL', None)
+os.environ['AUTO_MIGRATE'] = 'false'
+os.environ['PROXY_FIX_X_FOR'] = '1'  # As deployed behind one reverse proxy
+os.environ['PRESENCE_FLUSH_INTERVAL_MS'] = '3600000'  # Tests flush presence themselves
+os.environ['RECEIPT_FLUSH_INTERVAL_MS'] = '3600000'  # Tests flush receipts themselves
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+app_module.app.config['TESTING'] = True
+
+def reset_state():
+    # Empty every table and every per-process cache so each test starts from a blank server
+    db = app_module.db
+    for table in db.metadata.tables.values():
+        if table.name != 'schema_migration':
+            db.session.execute(table.delete())
+    db.session.commit()
+    app_module.user_cache.entries.clear()
+    app_module.user_search_index.__init__()
+    app_module.chat_members.clear()
+    app_module.socket_users.clear()
+    app_module.login_attempts.clear()
+    app_module.login_failures.clear()
+    app_module.pending_receipts.clear()
+    app_module.typing_state.clear()
+    app_module.typing_changes.clear()
+    app_module.user_connections.clear()
+    app_module.presence_sessions.clear()
+    app_module.presence_changes.clear()
+
+@pytest.fixture(scope='session')
+def app():
+    with app_module.app.app_context():
+        app_module.migrate_database()
+    return app_module.app
+
+@pytest.fixture
+def client(app):
+    with app.app_context():
+        reset_state()
+    return app.test_client()
+
+@pytest.fixture
+def register(client):
+    # register('alice') -> (token, serialized user)
+    def register_user(username):
+        response = client.post('/api/auth/register', json={
+            'username': username,
+            'email': f'{username}@example.com',
+            'password': 'correct horse',
+            'displayName': username.title()
+        })
+        assert response.status_code == 201, response.json
+        return response.json['token'], response.json['user']
+    return register_user
+
+@pytest.fixture
+def auth():
+    return lambda token: {'Authorization': f'Bearer {token}'}
+
+@pytest.fixture
+def chat(client, register, auth):
+    # alice created the chat with bob, so she is its admin; carol is not in it
+    alice, alice_user = register('alice')
+    bob, bob_user = register('bob')
+    carol, _ = register('carol')
+    chat = client.post('/api/chats', json={'participants': ['bob']}, headers=auth(alice)).json['chat']
+    return {'id': chat['id'], 'alice': alice, 'bob': bob, 'carol': carol, 'aliceId': alice_user['id'], 'bobId': bob_user['id']}
+
+@pytest.fixture
+def connect(app):
+    # connect(token) -> a connected Socket.IO test client
+    def connect_socket(token):
+        socket = app_module.socketio.test_client(app, auth={'token': token})
+        assert socket.is_connected()
+        return socket
+    return connect_socket
+
+@pytest.fixture
+def wait_for():
+    # wait_for(socket, 'message') -> the payloads of every matching event, or [] after the timeout
+    def wait_for_event(socket, name, timeout=2):
+        # The ingest pipeline and the aggregators emit from background threads
+        deadline = time.monotonic() + timeout
+        received = []
+        while time.monotonic() < deadline:
+            received += socket.get_received()
+            # The test client unwraps the arguments of Socket.IO's reserved 'message' event
+            matches = [
+                event['args'] if name == 'message' else event['args'][0]
+                for event in received if event['name'] == name
+            ]
+            if matches:
+                return matches
+            time.sleep(0.01)
+        return []
+    return wait_for_event
+
+@pytest.fixture
+def count_queries(app):
+    # with count_queries() as statements: ... records every SQL statement the block executes
+    @contextmanager
+    def counter():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = app_module.db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    return counter
@@ -0,0 +1,78 @@
+-- Schema created by the first release (db.create_all() on the original models), used to test upgrades
+CREATE TABLE user (
+	id INTEGER NOT NULL, 
+	username VARCHAR(50) NOT NULL, 
+	email VARCHAR(120) NOT NULL, 
+	password_hash VARCHAR(128), 
+	display_name VARCHAR(100) NOT NULL, 
+	profile_photo VARCHAR(200), 
+	created_at DATETIME, 
+	updated_at DATETIME, 
+	is_online BOOLEAN, 
+	last_seen DATETIME, 
+	PRIMARY KEY (id), 
+	UNIQUE (username), 
+	UNIQUE (email)
+);
+
+CREATE TABLE chat (
+	id INTEGER NOT NULL, 
+	name VARCHAR(100), 
+	is_group BOOLEAN, 
+	created_at DATETIME, 
+	updated_at DATETIME, 
+	last_message_id INTEGER, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(last_message_id) REFERENCES message (id)
+);
+
+CREATE TABLE message (
+	id INTEGER NOT NULL, 
+	chat_id INTEGER NOT NULL, 
+	sender_id INTEGER NOT NULL, 
+	content TEXT NOT NULL, 
+	message_type VARCHAR(20), 
+	message_metadata JSON, 
+	timestamp DATETIME, 
+	status VARCHAR(20), 
+	is_ai_generated BOOLEAN, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(chat_id) REFERENCES chat (id), 
+	FOREIGN KEY(sender_id) REFERENCES user (id)
+);
+
+CREATE TABLE chat_participant (
+	id INTEGER NOT NULL, 
+	chat_id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	joined_at DATETIME, 
+	is_admin BOOLEAN, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(chat_id) REFERENCES chat (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE message_reaction (
+	id INTEGER NOT NULL, 
+	message_id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	emoji VARCHAR(10) NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(message_id) REFERENCES message (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
+CREATE TABLE note (
+	id INTEGER NOT NULL, 
+	user_id INTEGER NOT NULL, 
+	title VARCHAR(200) NOT NULL, 
+	content TEXT, 
+	tags JSON, 
+	created_at DATETIME, 
+	updated_at DATETIME, 
+	is_ai_generated BOOLEAN, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES user (id)
+);
+
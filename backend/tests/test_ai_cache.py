@@ -0,0 +1,36 @@
+import pytest
+
+import app as app_module
+
+@pytest.fixture
+def answers(monkeypatch):
+    # Echo the prompt instead of calling Gemini, and start every test with an empty cache
+    prompts = []
+
+    def generate(prompt):
+        prompts.append(prompt)
+        return f'answer to: {prompt}'
+
+    monkeypatch.setattr(app_module, 'generate_ai_response', generate)
+    app_module.ai_cache.entries.clear()
+    return prompts
+
+def ask(client, auth, token, message):
+    response = client.post('/api/ai/chat', json={'persona': 'main', 'message': message}, headers=auth(token))
+    assert response.status_code == 200, response.json
+    return response.json['response']
+
+def test_cached_answer_is_not_shared_across_display_names(client, register, auth, answers):
+    alice, _ = register('alice')
+    bob, _ = register('bob')
+
+    assert 'Alice' in ask(client, auth, alice, 'What is my name?')
+    assert 'Bob' in ask(client, auth, bob, 'what is my name')
+    assert len(answers) == 2
+
+def test_repeated_question_is_served_from_cache(client, register, auth, answers):
+    alice, _ = register('alice')
+
+    first = ask(client, auth, alice, 'What is my name?')
+    assert ask(client, auth, alice, 'what is my name') == first
+    assert len(answers) == 1
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+
+class FakeModel:
+    # Stands in for genai.GenerativeModel: streams the configured chunks, then optionally fails.
+    # With a gate, it stops after the first chunk until the gate opens
+    def __init__(self, chunks, error=None, gate=None):
+        self.chunks = chunks
+        self.error = error
+        self.gate = gate
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        for index, text in enumerate(self.chunks):
+            if index == 1 and self.gate:
+                self.gate.wait(timeout=5)
+            yield SimpleNamespace(text=text)
+        if self.error:
+            raise self.error
+
+@pytest.fixture
+def model(monkeypatch):
+    def install(chunks, error=None, gate=None):
+        fake = FakeModel(chunks, error, gate)
+        monkeypatch.setattr(app_module, 'ai_model', fake)
+        return fake
+    app_module.ai_cache.__init__(app_module.AI_CACHE_SIZE, app_module.AI_CACHE_TTL)
+    return install
+
+def stream(client, auth, token, message='Tell me a story'):
+    response = client.post('/api/ai/chat/stream', json={'persona': 'writer', 'message': message}, headers=auth(token))
+    frames = [json.loads(line) for line in response.data.decode().splitlines()] if response.status_code == 200 else None
+    return response, frames
+
+def test_chunks_stream_in_order_and_end_with_done(client, register, auth, model):
+    token, _ = register('alice')
+    fake = model(['Once', ' upon', ' a time'])
+
+    response, frames = stream(client, auth, token)
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert [frame['text'] for frame in frames[:-1]] == ['Once', ' upon', ' a time']
+    assert frames[-1]['type'] == 'done'
+    assert frames[-1]['persona'] == 'writer'
+    assert 'Alice' in fake.prompts[0]
+
+def first_token_observations():
+    histogram = app_module.metrics.histograms.get(('gemini_time_to_first_token_seconds', ()))
+    return histogram[3] if histogram else 0
+
+def test_time_to_first_token_is_measured_once_per_upstream_call(client, register, auth, model):
+    token, _ = register('alice')
+    model(['Once', ' upon', ' a time'])
+    observed = first_token_observations()
+
+    stream(client, auth, token)
+    stream(client, auth, token)  # From cache: no upstream call to measure
+
+    assert first_token_observations() == observed + 1
+    assert 'gemini_time_to_first_token_seconds_bucket{le="0.005"}' in app_module.metrics.render()
+
+def test_completed_stream_is_replayed_from_cache(client, register, auth, model):
+    token, _ = register('alice')
+    fake = model(['Once', ' upon', ' a time'])
+    stream(client, auth, token)
+
+    _, frames = stream(client, auth, token)
+
+    assert [frame['type'] for frame in frames] == ['chunk', 'done']
+    assert frames[0]['text'] == 'Once upon a time'
+    assert len(fake.prompts) == 1
+
+def test_model_failure_ends_with_error_frame(client, register, auth, model):
+    token, _ = register('alice')
+    model(['Once'], error=RuntimeError('quota exceeded'))
+
+    _, frames = stream(client, auth, token)
+
+    assert frames == [{'type': 'chunk', 'text': 'Once'}, {'type': 'error', 'error': 'quota exceeded'}]
+    # Failed answers are not cached
+    assert not app_module.ai_cache.entries
+
+def test_full_pool_sheds_load(client, register, auth, model, monkeypatch):
+    token, _ = register('alice')
+    model(['unused'])
+    monkeypatch.setattr(app_module, 'ai_slots', threading.BoundedSemaphore(1))
+    app_module.ai_slots.acquire()
+
+    response, _ = stream(client, auth, token)
+
+    assert response.status_code == 503
+    assert response.json['error'] == 'AI service is busy, try again shortly'
+
+def test_concurrent_identical_streams_share_one_call(app, client, register, auth, model):
+    token, _ = register('alice')
+    gate = threading.Event()
+    fake = model(['Once', ' upon', ' a time'], gate=gate)
+    results = {}
+
+    def first_request():
+        results['first'] = stream(app.test_client(), auth, token)[1]
+
+    leader = threading.Thread(target=first_request)
+    leader.start()
+    deadline = time.monotonic() + 2
+    while not fake.prompts and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    # Joins the call in flight and still sees it from the first chunk
+    response = client.post('/api/ai/chat/stream', json={'persona': 'writer', 'message': 'tell me a story!'}, headers=auth(token))
+    gate.set()
+    frames = [json.loads(line) for line in response.data.decode().splitlines()]
+    leader.join(timeout=5)
+
+    assert len(fake.prompts) == 1
+    for result in (frames, results['first']):
+        assert [frame.get('text') for frame in result] == ['Once', ' upon', ' a time', None]
+    assert app_module.ai_cache.stats()['coalesced'] == 1
@@ -0,0 +1,57 @@
+import pytest
+
+import app as app_module
+
+# GET /api/chats must not issue more queries as the chat list grows
+CHAT_LIST_QUERIES_COLD = 6
+CHAT_LIST_QUERIES_WARM = 5
+
+def create_chats(client, register, auth, count):
+    token, _ = register('owner')
+    partners = ['ana', 'ben', 'cy']
+    for name in partners:
+        register(name)
+    for index in range(count):
+        chat = client.post('/api/chats', json={'participants': [partners[index % len(partners)]]}, headers=auth(token)).json['chat']
+        response = client.post('/api/chats/messages', json={'chatId': chat['id'], 'content': f'hello {index}'}, headers=auth(token))
+        assert response.status_code == 201
+    return token
+
+@pytest.mark.parametrize('chat_count', [1, 3, 9])
+def test_chat_list_query_count_is_flat(client, register, auth, count_queries, chat_count):
+    token = create_chats(client, register, auth, chat_count)
+
+    # Cold: every referenced user comes from the database in one batched query
+    app_module.user_cache.entries.clear()
+    with count_queries() as statements:
+        response = client.get('/api/chats', headers=auth(token))
+    assert response.status_code == 200
+    assert len(response.json['chats']) == chat_count
+    assert len(statements) == CHAT_LIST_QUERIES_COLD, '\n'.join(statements)
+
+    # Warm: users come from the user cache
+    with count_queries() as statements:
+        response = client.get('/api/chats', headers=auth(token))
+    assert len(statements) == CHAT_LIST_QUERIES_WARM, '\n'.join(statements)
+
+def test_chat_list_serializes_last_message_and_participants(client, register, auth):
+    token = create_chats(client, register, auth, 2)
+
+    chats = client.get('/api/chats', headers=auth(token)).json['chats']
+    assert [chat['lastMessage']['content'] for chat in chats] == ['hello 1', 'hello 0']
+    assert {participant['username'] for participant in chats[0]['participants']} == {'owner', 'ben'}
+
+@pytest.mark.parametrize('batch_size', [1, 20])
+def test_group_commit_query_count_is_flat(app, client, register, auth, count_queries, batch_size):
+    token, user = register('owner')
+    register('ana')
+    chat = client.post('/api/chats', json={'participants': ['ana']}, headers=auth(token)).json['chat']
+    entries = [{'chatId': chat['id'], 'userId': user['id'], 'content': f'batch {index}'} for index in range(batch_size)]
+
+    with app.app_context():
+        with count_queries() as statements:
+            payloads = app_module.persist_messages(entries)
+            app_module.db.session.commit()
+    assert [payload['content'] for payload in payloads] == [entry['content'] for entry in entries]
+    # SQLite inserts the rows one by one to read back their ids; nothing else may scale with the batch
+    assert [statement.split()[0] for statement in statements if not statement.startswith('INSERT')] == ['UPDATE', 'UPDATE'], '\n'.join(statements)
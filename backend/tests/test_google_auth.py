@@ -0,0 +1,83 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from google.oauth2 import id_token
+
+import app as app_module
+
+class CertificateEndpoint(BaseHTTPRequestHandler):
+    # Serves a fixed certificate set with whatever Cache-Control the test asks for, counting fetches
+    cache_control = 'public, max-age=3600'
+    fetches = 0
+
+    def do_GET(self):
+        type(self).fetches += 1
+        body = json.dumps({'key-1': 'not a real certificate'}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', self.cache_control)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def certs(monkeypatch):
+    # Point google-auth at a local certificate endpoint and accept any token whose certificates were fetched
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CertificateEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    CertificateEndpoint.fetches = 0
+    monkeypatch.setattr(CertificateEndpoint, 'cache_control', CertificateEndpoint.cache_control)
+    monkeypatch.setattr(id_token, '_GOOGLE_OAUTH2_CERTS_URL', f'http://127.0.0.1:{server.server_port}/certs')
+
+    def decode(token, certs=None, audience=None, clock_skew_in_seconds=0):
+        assert certs == {'key-1': 'not a real certificate'}
+        return {'iss': 'accounts.google.com', 'sub': token, 'exp': 4102444800}
+
+    monkeypatch.setattr(id_token.jwt, 'decode', decode)
+    app_module.google_request.responses.clear()
+    app_module.verified_google_tokens.clear()
+    yield CertificateEndpoint
+    server.shutdown()
+    server.server_close()
+
+def test_certificates_are_reused_within_max_age(certs):
+    assert app_module.verify_google_token('token-a')['sub'] == 'token-a'
+    assert app_module.verify_google_token('token-b')['sub'] == 'token-b'
+
+    assert certs.fetches == 1
+
+def test_verified_token_is_served_from_cache(certs, monkeypatch):
+    app_module.verify_google_token('token-a')
+    monkeypatch.setattr(id_token, 'verify_oauth2_token', pytest.fail)
+
+    assert app_module.verify_google_token('token-a')['sub'] == 'token-a'
+    assert certs.fetches == 1
+
+def test_no_store_certificates_are_fetched_every_time(certs):
+    certs.cache_control = 'no-store'
+
+    app_module.verify_google_token('token-a')
+    app_module.verify_google_token('token-b')
+
+    assert certs.fetches == 2
+
+def test_certificate_fetch_keeps_the_transport_default_timeout(monkeypatch):
+    calls = []
+
+    def transport(url, **kwargs):
+        calls.append(kwargs)
+        raise ConnectionError('offline')
+
+    monkeypatch.setattr(app_module.google_request, 'transport', transport)
+    with pytest.raises(ConnectionError):
+        app_module.google_request('https://example.com/certs')
+    with pytest.raises(ConnectionError):
+        app_module.google_request('https://example.com/certs', timeout=5)
+
+    assert 'timeout' not in calls[0]
+    assert calls[1]['timeout'] == 5
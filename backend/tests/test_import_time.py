@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Autoscaled workers pay for every import on cold start. The budget is several times the measured
+# cost (about 0.8s) so slow CI machines pass; the SDKs below are what the budget really guards
+IMPORT_BUDGET_SECONDS = 1.5
+LAZY_MODULES = ('google.generativeai', 'google.oauth2', 'google.auth', 'PIL')
+
+def import_app():
+    # Fresh interpreter, so nothing is cached; returns (cumulative seconds for app, imported module names)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=BACKEND, env=os.environ, capture_output=True, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line.split('|')
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative) / 1_000_000
+    return modules['app'], set(modules)
+
+def test_app_import_stays_within_budget():
+    runs = [import_app() for _ in range(3)]
+    fastest = min(seconds for seconds, _ in runs)
+    assert fastest < IMPORT_BUDGET_SECONDS, f'import app took {fastest:.2f}s'
+
+    _, modules = runs[0]
+    eager = sorted(name for name in modules if name.startswith(LAZY_MODULES))
+    assert not eager, f'imported at startup instead of on first use: {eager}'
@@ -0,0 +1,14 @@
+import app as app_module
+
+def login(client, password, client_ip):
+    # Every request comes from the same proxy address; only the forwarded client IP differs
+    return client.post('/api/auth/login', json={'email': 'alice@example.com', 'password': password},
+                       headers={'X-Forwarded-For': client_ip}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+def test_login_attempts_are_limited_per_forwarded_client(client, register):
+    register('alice')
+    for _ in range(app_module.LOGIN_ATTEMPTS_PER_MINUTE):
+        assert login(client, 'wrong', '203.0.113.7').status_code == 401
+
+    assert login(client, 'correct horse', '203.0.113.7').status_code == 429
+    assert login(client, 'correct horse', '198.51.100.4').status_code == 200
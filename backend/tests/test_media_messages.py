@@ -0,0 +1,96 @@
+import io
+import json
+import time
+
+import pytest
+
+import app as app_module
+
+def upload(client, auth, token, body=b'quarterly numbers', name='report.txt', mimetype='text/plain'):
+    response = client.post('/api/media', data={'file': (io.BytesIO(body), name, mimetype)}, headers=auth(token))
+    assert response.status_code in (200, 201), response.json
+    return response.json['media']
+
+def test_media_message_without_caption_is_sent(client, auth, chat, connect, wait_for):
+    media = upload(client, auth, chat['alice'])
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+
+    assert alice.emit('send_message', {
+        'chatId': chat['id'], 'content': '', 'type': media['kind'], 'clientId': 'temp-1',
+        'metadata': {'mediaId': media['id'], 'filename': 'report.txt'}
+    }, callback=True)
+
+    [message] = wait_for(alice, 'message')
+    assert message['content'] == ''
+    assert message['metadata']['media']['id'] == media['id']
+
+def test_media_message_with_unknown_upload_is_rejected(chat, connect, wait_for):
+    alice = connect(chat['alice'])
+
+    assert alice.emit('send_message', {
+        'chatId': chat['id'], 'content': '', 'type': 'image', 'clientId': 'temp-2', 'metadata': {'mediaId': 'f' * 64}
+    }, callback=True) is False
+
+    [rejection] = wait_for(alice, 'message_error')
+    assert rejection['error'] == 'Message content is required'
+
+@pytest.fixture
+def small_body_limit(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024)
+
+def test_oversized_upload_is_refused_before_spooling(client, auth, chat, small_body_limit):
+    response = client.post('/api/media', data={'file': (io.BytesIO(b'x' * 4096), 'big.bin', 'application/octet-stream')},
+                           headers=auth(chat['alice']))
+
+    assert response.status_code == 413
+    assert 'Uploads are limited' in response.json['error']
+
+def test_message_import_is_not_capped_by_upload_limit(client, auth, chat, small_body_limit):
+    body = ''.join(json.dumps({'content': f'line {index} ' + 'x' * 40}) + '\n' for index in range(100))
+
+    response = client.post(f"/api/chats/{chat['id']}/messages/import", data=body, headers=auth(chat['alice']))
+
+    assert response.status_code == 201
+    assert response.json['imported'] == 100
+
+def test_media_is_served_only_through_signed_urls(client, auth, chat):
+    media = upload(client, auth, chat['alice'])
+    path, query = media['url'].split('?')
+
+    assert client.get(path).status_code == 403
+    assert client.get(media['url'].replace('sig=', 'sig=0')).status_code == 403
+    assert client.get(f"{path}?expires=1&sig=" + query.split('sig=')[1]).status_code == 403
+
+    response = client.get(media['url'])
+    assert response.status_code == 200
+    assert response.data == b'quarterly numbers'
+    assert 'private' in response.headers['Cache-Control']
+    assert 'public' not in response.headers['Cache-Control']
+    assert 0 < response.cache_control.max_age <= 2 * app_module.MEDIA_URL_TTL
+
+def test_message_payloads_carry_fresh_signed_urls(client, auth, chat, monkeypatch):
+    media = upload(client, auth, chat['alice'], body=b'\x89PNG not really', name='a.png', mimetype='image/png')
+    client.post('/api/chats/messages', json={
+        'chatId': chat['id'], 'content': '', 'type': 'image', 'metadata': {'mediaId': media['id']}
+    }, headers=auth(chat['alice']))
+
+    # A later read, in a later URL window, still gets working links
+    later = time.time() + 3 * app_module.MEDIA_URL_TTL
+    monkeypatch.setattr(app_module.time, 'time', lambda: later)
+    [message] = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(chat['bob'])).json['messages']
+
+    stored = message['metadata']['media']
+    assert stored['url'] != media['url']
+    assert client.get(stored['url']).status_code == 200
+    assert client.get(stored['thumbnailUrl']).status_code == 200
+    assert client.get(media['url']).status_code == 403
+
+def test_media_range_request_returns_partial_content(client, auth, chat):
+    media = upload(client, auth, chat['alice'])
+
+    response = client.get(media['url'], headers={'Range': 'bytes=0-8'})
+
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 0-8/17'
+    assert response.data == b'quarterly'
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+
+START = datetime(2024, 1, 1, 12, 0)
+
+@pytest.fixture
+def history(app, chat):
+    # Five messages a minute apart: 'm0' at START ... 'm4' at START + 4 minutes
+    with app.app_context():
+        payloads = app_module.persist_messages([
+            {'chatId': chat['id'], 'userId': chat['aliceId'], 'content': f'm{index}', 'timestamp': START + timedelta(minutes=index)}
+            for index in range(5)
+        ])
+        app_module.db.session.commit()
+    return [payload['id'] for payload in payloads]
+
+def page(client, auth, chat, **params):
+    return client.get(f"/api/chats/{chat['id']}/messages", query_string=params, headers=auth(chat['alice']))
+
+def contents(response):
+    assert response.status_code == 200, response.json
+    return [message['content'] for message in response.json['messages']]
+
+def test_newest_page_is_returned_oldest_first(client, auth, chat, history):
+    response = page(client, auth, chat, limit=2)
+
+    assert contents(response) == ['m3', 'm4']
+    assert response.json['hasMore'] is True
+    assert response.json['cursors'] == {'before': history[3], 'after': history[4]}
+
+def test_before_cursor_pages_back_to_the_start(client, auth, chat, history):
+    response = page(client, auth, chat, before=history[3], limit=2)
+    assert contents(response) == ['m1', 'm2']
+    assert response.json['hasMore'] is True
+
+    response = page(client, auth, chat, before=response.json['cursors']['before'], limit=2)
+    assert contents(response) == ['m0']
+    assert response.json['hasMore'] is False
+
+def test_after_cursor_pages_forward(client, auth, chat, history):
+    response = page(client, auth, chat, after=history[1], limit=2)
+    assert contents(response) == ['m2', 'm3']
+    assert response.json['hasMore'] is True
+
+    response = page(client, auth, chat, after=history[3], limit=2)
+    assert contents(response) == ['m4']
+    assert response.json['hasMore'] is False
+
+def test_timestamp_cursors(client, auth, chat, history):
+    middle = (START + timedelta(minutes=2)).isoformat() + 'Z'
+
+    assert contents(page(client, auth, chat, before=middle)) == ['m0', 'm1']
+    assert contents(page(client, auth, chat, after=middle)) == ['m3', 'm4']
+
+@pytest.mark.parametrize('limit, expected', [('0', ['m4']), ('1000', ['m2', 'm3', 'm4'])])
+def test_limit_is_clamped(client, auth, chat, history, monkeypatch, limit, expected):
+    monkeypatch.setattr(app_module, 'MESSAGE_PAGE_MAX', 3)
+
+    assert contents(page(client, auth, chat, limit=limit)) == expected
+
+@pytest.mark.parametrize('params, error', [
+    ({'before': 'yesterday'}, 'Invalid cursor'),
+    ({'before': '999999'}, 'Invalid cursor'),
+    ({'limit': 'ten'}, 'Invalid limit'),
+    ({'before': '1', 'after': '2'}, 'Use either before or after, not both'),
+])
+def test_bad_parameters_are_rejected(client, auth, chat, history, params, error):
+    response = page(client, auth, chat, **params)
+
+    assert response.status_code == 400
+    assert response.json['error'] == error
+
+def test_cursor_from_another_chat_is_rejected(client, register, auth, chat, history):
+    dave, _ = register('dave')
+    other = client.post('/api/chats', json={'participants': ['alice']}, headers=auth(dave)).json['chat']
+
+    response = client.get(f"/api/chats/{other['id']}/messages", query_string={'before': history[2]}, headers=auth(dave))
+
+    assert response.status_code == 400
@@ -0,0 +1,25 @@
+import json
+
+def import_lines(client, auth, token, chat_id, *lines):
+    body = ''.join(json.dumps(line) + '\n' for line in lines)
+    return client.post(f'/api/chats/{chat_id}/messages/import', data=body, headers=auth(token))
+
+def test_member_cannot_import_as_another_member(client, auth, chat):
+    response = import_lines(client, auth, chat['bob'], chat['id'], {'content': 'forged', 'senderId': chat['aliceId']})
+
+    assert response.status_code == 400
+    assert response.json['imported'] == 0
+    assert 'senderId' in response.json['error']
+
+def test_member_imports_own_messages(client, auth, chat):
+    response = import_lines(client, auth, chat['bob'], chat['id'], {'content': 'mine'}, {'content': 'also mine', 'senderId': chat['bobId']})
+
+    assert response.status_code == 201
+    assert response.json['imported'] == 2
+
+def test_admin_imports_on_behalf_of_members(client, auth, chat):
+    response = import_lines(client, auth, chat['alice'], chat['id'], {'content': 'from bob', 'senderId': chat['bobId']})
+    assert response.status_code == 201
+
+    messages = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(chat['alice'])).json['messages']
+    assert [(message['content'], message['sender']['id']) for message in messages] == [('from bob', chat['bobId'])]
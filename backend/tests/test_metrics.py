@@ -0,0 +1,88 @@
+import re
+from collections import defaultdict
+
+import app as app_module
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+
+def scrape(client, headers=None):
+    response = client.get('/metrics', headers=headers or {})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert response.mimetype_params['version'] == '0.0.4'
+    return parse(response.data.decode())
+
+def parse(body):
+    # {(name, labels text): value}; every line is a comment or a well-formed sample
+    samples = {}
+    for line in body.splitlines():
+        if line.startswith('#'):
+            assert re.match(r'^# (HELP|TYPE) \S+ \S', line), line
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        samples[(match[1], match[2] or '')] = float(match[3])
+    return samples
+
+def test_histograms_render_cumulative_buckets():
+    metrics = app_module.Metrics()
+    metrics.describe('job_seconds', 'histogram', 'Job latency')
+    for value in (0.005, 0.05, 0.06, 5, 100):
+        metrics.observe('job_seconds', value, buckets=(0.01, 0.1, 1, 10), queue='mail')
+
+    lines = metrics.render().splitlines()
+
+    assert lines == [
+        '# HELP job_seconds Job latency',
+        '# TYPE job_seconds histogram',
+        'job_seconds_bucket{queue="mail",le="0.01"} 1',
+        'job_seconds_bucket{queue="mail",le="0.1"} 3',
+        'job_seconds_bucket{queue="mail",le="1"} 3',
+        'job_seconds_bucket{queue="mail",le="10"} 4',
+        'job_seconds_bucket{queue="mail",le="+Inf"} 5',
+        'job_seconds_sum{queue="mail"} 105.115000',
+        'job_seconds_count{queue="mail"} 5',
+    ]
+
+def test_endpoint_serves_prometheus_text(client, auth, register):
+    token, _ = register('alice')
+    client.get('/api/auth/me', headers=auth(token))
+
+    body = client.get('/metrics').data.decode()
+    samples = parse(body)
+
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert body.count('# TYPE http_request_duration_seconds ') == 1
+    assert samples[('http_request_duration_seconds_count', '{method="GET",route="/api/auth/me",status="200"}')] >= 1
+
+    # Within each series buckets never decrease and +Inf equals _count
+    series = defaultdict(list)
+    for (name, labels), value in samples.items():
+        if name.endswith('_bucket'):
+            base = re.sub(r',?le="[^"]+"', '', labels).replace('{}', '')
+            bound = re.search(r'le="([^"]+)"', labels)[1]
+            series[(name[:-len('_bucket')], base)].append((float(bound), value))
+    assert series
+    for (name, labels), buckets in series.items():
+        counts = [value for _, value in sorted(buckets)]
+        assert counts == sorted(counts), name
+        assert counts[-1] == samples[(f'{name}_count', labels)]
+
+def test_socket_events_are_counted(client, chat, connect, wait_for):
+    key = ('socketio_events_total', '{event="join_chat"}')
+    before = scrape(client).get(key, 0)
+    alice = connect(chat['alice'])
+
+    alice.emit('join_chat', {'chatId': chat['id']})
+    alice.emit('join_chat', {'chatId': chat['id']})
+
+    samples = scrape(client)
+    assert samples[key] == before + 2
+    assert samples[('socketio_event_duration_seconds_count', '{event="join_chat"}')] >= 2
+
+def test_metrics_token_is_enforced(client, monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 'scrape-secret')
+
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert scrape(client, {'Authorization': 'Bearer scrape-secret'})
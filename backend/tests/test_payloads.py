@@ -0,0 +1,83 @@
+import gzip
+import json
+from datetime import timedelta
+
+import brotli
+
+import app as app_module
+
+def fill_chat(client, auth, chat, count=20):
+    for index in range(count):
+        response = client.post('/api/chats/messages', json={'chatId': chat['id'], 'content': f'message number {index}'}, headers=auth(chat['alice']))
+        assert response.status_code == 201
+
+def test_compact_chat_list_sends_each_user_once(client, auth, chat):
+    fill_chat(client, auth, chat, count=1)
+
+    payload = client.get('/api/chats?compact=1', headers=auth(chat['alice'])).json
+
+    [entry] = payload['chats']
+    assert sorted(entry['participants']) == sorted([chat['aliceId'], chat['bobId']])
+    assert entry['lastMessage']['senderId'] == chat['aliceId']
+    assert 'sender' not in entry['lastMessage']
+    assert set(payload['users']) == {str(chat['aliceId']), str(chat['bobId'])}
+    assert payload['users'][str(chat['bobId'])]['username'] == 'bob'
+
+def test_compact_messages_refer_to_senders_and_reactors_by_id(client, auth, chat):
+    fill_chat(client, auth, chat, count=2)
+    messages = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(chat['alice'])).json['messages']
+    client.post(f"/api/chats/messages/{messages[0]['id']}/reactions", json={'emoji': '👍'}, headers=auth(chat['bob']))
+
+    payload = client.get(f"/api/chats/{chat['id']}/messages?compact=1", headers=auth(chat['alice'])).json
+
+    assert [message['senderId'] for message in payload['messages']] == [chat['aliceId'], chat['aliceId']]
+    assert payload['messages'][0]['reactions'][0]['users'] == [chat['bobId']]
+    assert set(payload['users']) == {str(chat['aliceId']), str(chat['bobId'])}
+
+    # The default payload still embeds the users
+    full = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(chat['alice'])).json
+    assert full['messages'][0]['sender']['id'] == chat['aliceId']
+    assert 'users' not in full
+
+def get(client, auth, token, url, encoding):
+    return client.get(url, headers=dict(auth(token), **{'Accept-Encoding': encoding}))
+
+def test_large_bodies_are_compressed_by_preference(client, auth, chat):
+    fill_chat(client, auth, chat)
+    url = f"/api/chats/{chat['id']}/messages"
+    identity = get(client, auth, chat['alice'], url, 'identity')
+
+    preferred = get(client, auth, chat['alice'], url, 'gzip, br')
+    assert preferred.headers['Content-Encoding'] == 'br'
+    assert json.loads(brotli.decompress(preferred.data)) == identity.json
+
+    fallback = get(client, auth, chat['alice'], url, 'gzip')
+    assert fallback.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(fallback.data)) == identity.json
+
+    for response in (identity, preferred, fallback):
+        assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'Content-Encoding' not in identity.headers
+
+def test_small_and_streamed_bodies_are_not_compressed(client, auth, chat):
+    fill_chat(client, auth, chat)
+
+    small = get(client, auth, chat['alice'], '/api/auth/me', 'gzip, br')
+    assert len(small.data) < app_module.COMPRESS_MIN_SIZE
+    assert 'Content-Encoding' not in small.headers
+
+    export = get(client, auth, chat['alice'], f"/api/chats/{chat['id']}/messages/export", 'gzip, br')
+    assert export.is_streamed
+    assert 'Content-Encoding' not in export.headers
+    assert len(export.data.decode().splitlines()) == 20
+
+def test_sync_etag_matches_across_encodings(client, auth, chat, monkeypatch):
+    monkeypatch.setattr(app_module, 'SYNC_OVERLAP', timedelta(0))
+    fill_chat(client, auth, chat)
+
+    compressed = get(client, auth, chat['alice'], '/api/sync', 'gzip')
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['ETag'].startswith('W/')
+
+    response = client.get('/api/sync', headers=dict(auth(chat['alice']), **{'If-None-Match': compressed.headers['ETag']}))
+    assert response.status_code == 304
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+import app as app_module
+
+def is_online(user_id):
+    app_module.user_cache.invalidate(user_id)
+    return app_module.user_cache.get(user_id)['isOnline']
+
+def test_typing_digests_carry_deltas_with_display_names(chat, connect, wait_for):
+    alice = connect(chat['alice'])
+    bob = connect(chat['bob'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+    bob.emit('join_chat', {'chatId': chat['id']})
+
+    bob.emit('typing', {'chatId': chat['id'], 'isTyping': True})
+    [digest] = wait_for(alice, 'typing')
+    assert digest == {'chatId': chat['id'], 'started': [{'id': chat['bobId'], 'displayName': 'Bob'}], 'stopped': []}
+
+    bob.emit('typing', {'chatId': chat['id'], 'isTyping': False})
+    [digest] = wait_for(alice, 'typing')
+    assert digest == {'chatId': chat['id'], 'started': [], 'stopped': [chat['bobId']]}
+
+def test_presence_only_reaches_users_sharing_a_chat(app, chat, connect, wait_for):
+    alice = connect(chat['alice'])
+    carol = connect(chat['carol'])
+    with app.app_context():
+        app_module.flush_presence()
+    alice.get_received()
+    carol.get_received()
+
+    connect(chat['bob'])
+    with app.app_context():
+        app_module.flush_presence()
+
+    assert wait_for(alice, 'presence') == [{'online': [chat['bobId']], 'offline': []}]
+    assert wait_for(carol, 'presence', timeout=0.2) == []
+
+def test_user_stays_online_while_another_worker_holds_a_session(app, chat):
+    user_id = chat['aliceId']
+    with app.app_context():
+        app_module.db.session.add(app_module.PresenceSession(
+            worker_id='other-worker', user_id=user_id, expires_at=datetime.utcnow() + timedelta(minutes=1)
+        ))
+        app_module.db.session.commit()
+
+        app_module.record_presence(user_id, True)
+        app_module.flush_presence()
+        assert is_online(user_id)
+
+        # Closing the socket on this worker leaves the one on the other worker
+        app_module.record_presence(user_id, False)
+        app_module.flush_presence()
+        assert is_online(user_id)
+
+def test_sessions_of_a_dead_worker_expire(app, chat):
+    user_id = chat['aliceId']
+    with app.app_context():
+        app_module.db.session.add(app_module.PresenceSession(
+            worker_id='dead-worker', user_id=user_id, expires_at=datetime.utcnow() + timedelta(minutes=1)
+        ))
+        app_module.db.session.commit()
+        app_module.record_presence(user_id, True)
+        app_module.record_presence(user_id, False)
+        app_module.flush_presence()
+        assert is_online(user_id)
+
+        app_module.PresenceSession.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+        app_module.db.session.commit()
+        app_module.flush_presence()
+        assert not is_online(user_id)
+        assert app_module.PresenceSession.query.count() == 0
@@ -0,0 +1,70 @@
+import re
+
+import pytest
+from sqlalchemy import event
+
+import app as app_module
+
+# Tables so small or so rarely read that SQLite scanning them is expected
+SCAN_ALLOWED = {'schema_migration'}
+
+def plan_scans(connection, statement, parameters):
+    # Full table scans in SQLite's plan, e.g. 'SCAN message' but not 'SCAN message USING INDEX ...'
+    if isinstance(parameters, list):
+        parameters = parameters[0] if parameters else ()
+    plan = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    scans = []
+    for row in plan:
+        match = re.match(r'SCAN (\w+)(?: AS \w+)?$', row.detail)
+        if match and match.group(1) not in SCAN_ALLOWED:
+            scans.append(row.detail)
+    return scans
+
+@pytest.fixture
+def hot_routes(client, register, auth):
+    # Exercise the routes every client hits constantly and record the SQL they run
+    alice, _ = register('alice')
+    register('bob')
+    chat = client.post('/api/chats', json={'participants': ['bob']}, headers=auth(alice)).json['chat']
+    message = client.post('/api/chats/messages', json={'chatId': chat['id'], 'content': 'hi'}, headers=auth(alice)).json['message']
+    client.post('/api/notes', json={'title': 'note', 'content': 'text'}, headers=auth(alice))
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            statements.append((statement, parameters))
+
+    with client.application.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for method, url, body in [
+            ('get', '/api/chats', None),
+            ('get', f"/api/chats/{chat['id']}/messages", None),
+            ('get', f"/api/chats/{chat['id']}/messages?before={message['id']}", None),
+            ('post', '/api/chats/messages', {'chatId': chat['id'], 'content': 'again'}),
+            ('post', f"/api/chats/messages/{message['id']}/reactions", {'emoji': '👍'}),
+            ('post', f"/api/chats/{chat['id']}/read", None),
+            ('get', '/api/notes', None),
+            ('get', '/api/sync', None),
+            ('get', f"/api/sync?since={message['timestamp']}", None),
+            ('get', '/api/auth/me', None),
+        ]:
+            response = getattr(client, method)(url, json=body, headers=auth(alice))
+            assert response.status_code < 400, (url, response.json)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return engine, statements
+
+def test_hot_route_queries_use_indexes(hot_routes):
+    engine, statements = hot_routes
+    assert statements
+
+    with engine.connect() as connection:
+        scans = {
+            statement: scans
+            for statement, parameters in statements
+            for scans in [plan_scans(connection, statement, parameters)] if scans
+        }
+    assert not scans, '\n\n'.join(f'{scans}\n{statement}' for statement, scans in scans.items())
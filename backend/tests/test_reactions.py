@@ -0,0 +1,77 @@
+import pytest
+
+import app as app_module
+
+@pytest.fixture
+def message(client, auth, chat):
+    response = client.post('/api/chats/messages', json={'chatId': chat['id'], 'content': 'react to me'}, headers=auth(chat['alice']))
+    return response.json['message']
+
+def react(client, auth, token, message, emoji='👍', method='post'):
+    return getattr(client, method)(f"/api/chats/messages/{message['id']}/reactions", json={'emoji': emoji}, headers=auth(token))
+
+def reactions(client, auth, token, chat):
+    [message] = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(token)).json['messages']
+    return {reaction['emoji']: reaction for reaction in message['reactions']}
+
+def counter_rows(app):
+    with app.app_context():
+        return app_module.MessageReactionCount.query.count()
+
+def test_repeated_add_and_remove_are_idempotent(app, client, auth, chat, message):
+    assert react(client, auth, chat['bob'], message).json['reaction']['count'] == 1
+    assert react(client, auth, chat['bob'], message).json['reaction']['count'] == 1
+    assert reactions(client, auth, chat['alice'], chat)['👍']['count'] == 1
+
+    assert react(client, auth, chat['bob'], message, method='delete').json['reaction']['count'] == 0
+    assert react(client, auth, chat['bob'], message, method='delete').json['reaction']['count'] == 0
+    assert reactions(client, auth, chat['alice'], chat) == {}
+    # The counter row goes away with the last reaction
+    assert counter_rows(app) == 0
+
+def test_summary_marks_the_viewers_reactions_and_samples_reactors(client, auth, chat, message):
+    react(client, auth, chat['alice'], message)
+    react(client, auth, chat['bob'], message)
+    react(client, auth, chat['bob'], message, emoji='❤️')
+
+    summary = reactions(client, auth, chat['alice'], chat)
+    assert (summary['👍']['count'], summary['👍']['reacted']) == (2, True)
+    assert [user['id'] for user in summary['👍']['users']] == [chat['bobId'], chat['aliceId']]
+    assert (summary['❤️']['count'], summary['❤️']['reacted']) == (1, False)
+
+    compact = client.get(f"/api/chats/{chat['id']}/messages?compact=1", headers=auth(chat['bob'])).json['messages'][0]
+    assert compact['reactions'][0]['users'] == [chat['bobId'], chat['aliceId']]
+
+def test_members_receive_reaction_deltas(client, auth, chat, message, connect, wait_for):
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+
+    react(client, auth, chat['bob'], message)
+
+    [delta] = wait_for(alice, 'reaction')
+    assert delta == {
+        'messageId': message['id'], 'chatId': chat['id'], 'emoji': '👍', 'count': 1, 'userId': chat['bobId'], 'reacted': True
+    }
+
+def test_unchanged_reaction_is_not_broadcast(client, auth, chat, message, connect, wait_for):
+    react(client, auth, chat['bob'], message)
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+
+    react(client, auth, chat['bob'], message)
+
+    assert wait_for(alice, 'reaction', timeout=0.2) == []
+
+def test_non_members_cannot_react(client, auth, chat, message):
+    response = react(client, auth, chat['carol'], message)
+
+    assert response.status_code == 403
+    assert reactions(client, auth, chat['alice'], chat) == {}
+
+def test_first_reactions_for_an_emoji_share_one_counter(app, message):
+    # Two requests that both see no counter row yet must not insert two
+    with app.app_context():
+        app_module.upsert_reaction_count(message['id'], '🎉', 1)
+        app_module.upsert_reaction_count(message['id'], '🎉', 1)
+        app_module.db.session.commit()
+        assert app_module.db.session.get(app_module.MessageReactionCount, (message['id'], '🎉')).count == 2
@@ -0,0 +1,156 @@
+from datetime import timedelta
+
+import pytest
+
+import app as app_module
+
+def send(client, auth, token, chat_id, content):
+    response = client.post('/api/chats/messages', json={'chatId': chat_id, 'content': content}, headers=auth(token))
+    assert response.status_code == 201, response.json
+    return response.json['message']['id']
+
+def statuses(client, auth, chat):
+    messages = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(chat['alice'])).json['messages']
+    return [message['status'] for message in messages]
+
+def marks(app, chat):
+    with app.app_context():
+        participant = app_module.ChatParticipant.query.filter_by(chat_id=chat['id'], user_id=chat['bobId']).one()
+        return participant.last_delivered_message_id, participant.last_read_message_id
+
+def test_acks_advance_message_status_after_a_flush(app, client, auth, chat, connect, wait_for):
+    first = send(client, auth, chat['alice'], chat['id'], 'one')
+    second = send(client, auth, chat['alice'], chat['id'], 'two')
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+    bob = connect(chat['bob'])
+
+    assert bob.emit('ack', {'receipts': [{'chatId': chat['id'], 'delivered': second, 'read': first}]}, callback=True)
+    assert statuses(client, auth, chat) == ['sent', 'sent']
+
+    with app.app_context():
+        app_module.flush_receipts()
+
+    assert statuses(client, auth, chat) == ['read', 'delivered']
+    [frame] = wait_for(alice, 'receipts')
+    assert frame == {'chatId': chat['id'], 'receipts': [
+        {'userId': chat['aliceId'], 'delivered': 0, 'read': 0},
+        {'userId': chat['bobId'], 'delivered': second, 'read': first}
+    ]}
+
+def test_late_lower_ack_does_not_move_the_frame_backwards(app, client, auth, chat, connect, wait_for):
+    first = send(client, auth, chat['alice'], chat['id'], 'one')
+    second = send(client, auth, chat['alice'], chat['id'], 'two')
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+    app_module.record_receipt(chat['id'], chat['bobId'], second, second)
+    with app.app_context():
+        app_module.flush_receipts()
+    wait_for(alice, 'receipts')
+
+    app_module.record_receipt(chat['id'], chat['bobId'], first, 0)
+    with app.app_context():
+        app_module.flush_receipts()
+
+    # Nothing moved, so nothing is broadcast
+    assert wait_for(alice, 'receipts', timeout=0.2) == []
+    assert marks(app, chat) == (second, second)
+    assert statuses(client, auth, chat) == ['read', 'read']
+
+def test_group_frame_carries_members_who_have_not_acked(app, client, register, auth, connect, wait_for):
+    alice, alice_user = register('alice')
+    bob, bob_user = register('bob')
+    _, carol_user = register('carol')
+    chat = client.post('/api/chats', json={'participants': ['bob', 'carol']}, headers=auth(alice)).json['chat']
+    message_id = send(client, auth, alice, chat['id'], 'hello both')
+    watcher = connect(alice)
+    watcher.emit('join_chat', {'chatId': chat['id']})
+
+    assert connect(bob).emit('ack', {'receipts': [{'chatId': chat['id'], 'read': message_id}]}, callback=True)
+    with app.app_context():
+        app_module.flush_receipts()
+
+    [frame] = wait_for(watcher, 'receipts')
+    assert sorted((receipt['userId'], receipt['read']) for receipt in frame['receipts']) == sorted([
+        (alice_user['id'], 0), (bob_user['id'], message_id), (carol_user['id'], 0)
+    ])
+    # Carol has not received the message yet, so it is still only sent
+    messages = client.get(f"/api/chats/{chat['id']}/messages", headers=auth(alice)).json['messages']
+    assert [message['status'] for message in messages] == ['sent']
+
+def test_acks_past_the_newest_message_are_clamped(app, client, auth, chat, connect):
+    newest = send(client, auth, chat['alice'], chat['id'], 'latest')
+    bob = connect(chat['bob'])
+
+    assert bob.emit('ack', {'receipts': [{'chatId': chat['id'], 'read': newest + 100}]}, callback=True)
+    with app.app_context():
+        app_module.flush_receipts()
+
+    assert marks(app, chat) == (newest, newest)
+    assert statuses(client, auth, chat) == ['read']
+
+def fail_commit():
+    raise RuntimeError('database is locked')
+
+def test_failed_flush_keeps_the_acks(app, client, auth, chat, monkeypatch):
+    first = send(client, auth, chat['alice'], chat['id'], 'one')
+    second = send(client, auth, chat['alice'], chat['id'], 'two')
+    app_module.record_receipt(chat['id'], chat['bobId'], first, first)
+
+    with app.app_context():
+        with monkeypatch.context() as patch:
+            patch.setattr(app_module.db.session, 'commit', fail_commit)
+            with pytest.raises(RuntimeError):
+                app_module.flush_receipts()
+        app_module.db.session.rollback()
+        assert marks(app, chat) == (0, 0)
+
+        # A newer ack recorded before the retry wins over the restored one
+        app_module.record_receipt(chat['id'], chat['bobId'], second, 0)
+        app_module.flush_receipts()
+
+    assert marks(app, chat) == (second, first)
+
+def test_imported_history_can_be_read(app, client, auth, chat):
+    latest = send(client, auth, chat['alice'], chat['id'], 'today')
+    # Imported messages are older by timestamp but get higher ids than the chat's newest message
+    imported = client.post(f"/api/chats/{chat['id']}/messages/import", headers=auth(chat['alice']),
+                           data='{"content": "from the archive", "timestamp": "2020-01-01T00:00:00"}\n')
+    assert imported.status_code == 201, imported.json
+    archived = max(message['id'] for message in client.get(
+        f"/api/chats/{chat['id']}/messages", headers=auth(chat['alice'])
+    ).json['messages'])
+    assert archived > latest
+
+    app_module.record_receipt(chat['id'], chat['bobId'], archived, archived)
+    with app.app_context():
+        app_module.flush_receipts()
+
+    assert marks(app, chat) == (archived, archived)
+    assert statuses(client, auth, chat) == ['read', 'read']
+
+def test_marking_a_chat_read_covers_imported_history(app, client, auth, chat):
+    send(client, auth, chat['alice'], chat['id'], 'today')
+    client.post(f"/api/chats/{chat['id']}/messages/import", headers=auth(chat['alice']),
+                data='{"content": "from the archive", "timestamp": "2020-01-01T00:00:00"}\n')
+
+    assert client.post(f"/api/chats/{chat['id']}/read", headers=auth(chat['bob'])).status_code == 200
+    with app.app_context():
+        app_module.flush_receipts()
+
+    assert statuses(client, auth, chat) == ['read', 'read']
+
+def test_receipts_reach_every_members_next_sync(app, client, auth, chat, monkeypatch):
+    monkeypatch.setattr(app_module, 'SYNC_OVERLAP', timedelta(0))
+    message_id = send(client, auth, chat['alice'], chat['id'], 'hello')
+    before = client.get('/api/sync', headers=auth(chat['alice']))
+
+    app_module.record_receipt(chat['id'], chat['bobId'], message_id, message_id)
+    with app.app_context():
+        app_module.flush_receipts()
+
+    response = client.get('/api/sync', headers=dict(auth(chat['alice']), **{'If-None-Match': before.headers['ETag']}))
+    assert response.status_code == 200
+    [entry] = response.json['chats']
+    assert {'userId': chat['bobId'], 'delivered': message_id, 'read': message_id} in entry['receipts']
+    assert entry['lastMessage']['status'] == 'read'
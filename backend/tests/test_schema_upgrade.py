@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import app as app_module
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORIGINAL_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'original_schema.sql')
+
+# A chat from before the migrations, including the duplicate participant and reaction rows that
+# older versions could write
+ORIGINAL_DATA = """
+INSERT INTO user (id, username, email, display_name, created_at, updated_at, is_online, last_seen) VALUES
+    (1, 'alice', 'alice@example.com', 'Alice', '2024-01-01 10:00:00', '2024-01-01 10:00:00', 0, '2024-01-01 10:00:00'),
+    (2, 'bob', 'bob@example.com', 'Bob', '2024-01-01 10:00:00', '2024-01-01 10:00:00', 0, '2024-01-01 10:00:00');
+INSERT INTO chat (id, name, is_group, created_at, updated_at, last_message_id) VALUES
+    (1, NULL, 0, '2024-01-02 09:00:00', '2024-01-02 09:05:00', 2);
+INSERT INTO chat_participant (id, chat_id, user_id, joined_at, is_admin) VALUES
+    (1, 1, 1, '2024-01-02 09:00:00', 1),
+    (2, 1, 2, '2024-01-02 09:00:00', 0),
+    (3, 1, 2, '2024-01-02 09:00:00', 0);
+INSERT INTO message (id, chat_id, sender_id, content, message_type, message_metadata, timestamp, status, is_ai_generated) VALUES
+    (1, 1, 1, 'hello bob', 'text', '{}', '2024-01-02 09:01:00', 'sent', 0),
+    (2, 1, 2, 'hi alice', 'text', '{}', '2024-01-02 09:05:00', 'sent', 0);
+INSERT INTO message_reaction (id, message_id, user_id, emoji, created_at) VALUES
+    (1, 1, 2, '👍', '2024-01-02 09:02:00'),
+    (2, 1, 2, '👍', '2024-01-02 09:02:01'),
+    (3, 1, 1, '👍', '2024-01-02 09:03:00');
+"""
+
+def migrate(database):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}')
+    return subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'],
+                          cwd=BACKEND, env=env, capture_output=True, text=True)
+
+def test_original_schema_upgrades_to_current(tmp_path):
+    database = tmp_path / 'original.db'
+    with sqlite3.connect(database) as connection:
+        with open(ORIGINAL_SCHEMA) as schema:
+            connection.executescript(schema.read())
+        connection.executescript(ORIGINAL_DATA)
+
+    result = migrate(database)
+    assert result.returncode == 0, result.stderr
+
+    connection = sqlite3.connect(database)
+    try:
+        versions = [version for (version,) in connection.execute('SELECT version FROM schema_migration ORDER BY version')]
+        assert versions == [version for version, _, _ in app_module.MIGRATIONS]
+
+        inbox = connection.execute(
+            'SELECT user_id, last_message_id, last_message_preview, unread_count FROM chat_inbox ORDER BY user_id'
+        ).fetchall()
+        assert inbox == [(1, 2, 'hi alice', 0), (2, 2, 'hi alice', 0)]
+
+        assert connection.execute('SELECT COUNT(*) FROM chat_participant').fetchone() == (2,)
+        assert connection.execute('SELECT last_delivered_message_id, last_read_message_id FROM chat_participant').fetchall() == [(0, 0), (0, 0)]
+        assert connection.execute('SELECT message_id, emoji, count FROM message_reaction_count').fetchall() == [(1, '👍', 2)]
+    finally:
+        connection.close()
+
+    # Already applied steps are skipped
+    result = migrate(database)
+    assert result.returncode == 0, result.stderr
+    assert 'Applied migration' not in result.stdout
@@ -0,0 +1,66 @@
+import app as app_module
+
+def search(client, auth, token, q, scope='all'):
+    response = client.get('/api/search', query_string={'q': q, 'scope': scope}, headers=auth(token))
+    assert response.status_code == 200, response.json
+    return response.json
+
+def send(client, auth, token, chat_id, content):
+    response = client.post('/api/chats/messages', json={'chatId': chat_id, 'content': content}, headers=auth(token))
+    assert response.status_code == 201, response.json
+    return response.json['message']['id']
+
+def add_note(client, auth, token, **note):
+    response = client.post('/api/notes', json=note, headers=auth(token))
+    assert response.status_code == 201, response.json
+    return response.json['note']['id']
+
+def test_messages_are_ranked_and_matched_by_prefix(client, auth, chat):
+    send(client, auth, chat['alice'], chat['id'], 'the launch moved to friday, launch checklist attached, launch party after')
+    send(client, auth, chat['alice'], chat['id'], 'lunch? also the launch')
+    send(client, auth, chat['alice'], chat['id'], 'nothing relevant here')
+
+    assert [hit['content'][:5] for hit in search(client, auth, chat['bob'], 'launch', 'messages')['messages']] == ['the l', 'lunch']
+    assert len(search(client, auth, chat['bob'], 'laun', 'messages')['messages']) == 2
+    [hit] = search(client, auth, chat['bob'], 'check', 'messages')['messages']
+    assert 'checklist' in hit['snippet']
+
+def test_results_are_limited_to_the_callers_chats_and_notes(client, auth, chat):
+    send(client, auth, chat['alice'], chat['id'], 'quarterly budget review')
+    add_note(client, auth, chat['alice'], title='Budget', content='quarterly numbers')
+
+    assert len(search(client, auth, chat['bob'], 'quarterly')['messages']) == 1
+    assert search(client, auth, chat['bob'], 'quarterly')['notes'] == []
+
+    carol = search(client, auth, chat['carol'], 'quarterly')
+    assert carol['messages'] == [] and carol['notes'] == []
+
+def test_note_titles_rank_above_content(client, auth, chat):
+    add_note(client, auth, chat['alice'], title='Groceries', content='remember the roadmap')
+    roadmap = add_note(client, auth, chat['alice'], title='Roadmap', content='milestones')
+
+    assert [hit['id'] for hit in search(client, auth, chat['alice'], 'roadmap', 'notes')['notes']][0] == roadmap
+
+def test_index_follows_note_updates_and_deletes(client, auth, chat):
+    note_id = add_note(client, auth, chat['alice'], title='Draft', content='first version')
+
+    client.put(f'/api/notes/{note_id}', json={'content': 'second revision'}, headers=auth(chat['alice']))
+    assert search(client, auth, chat['alice'], 'first', 'notes')['notes'] == []
+    assert [hit['id'] for hit in search(client, auth, chat['alice'], 'revision', 'notes')['notes']] == [note_id]
+
+    client.delete(f'/api/notes/{note_id}', headers=auth(chat['alice']))
+    assert search(client, auth, chat['alice'], 'revision', 'notes')['notes'] == []
+
+def test_index_follows_message_updates_and_deletes(app, client, auth, chat):
+    message_id = send(client, auth, chat['alice'], chat['id'], 'original wording')
+
+    with app.app_context():
+        app_module.Message.query.filter_by(id=message_id).update({'content': 'edited wording'})
+        app_module.db.session.commit()
+    assert search(client, auth, chat['bob'], 'original', 'messages')['messages'] == []
+    assert [hit['id'] for hit in search(client, auth, chat['bob'], 'edited', 'messages')['messages']] == [message_id]
+
+    with app.app_context():
+        app_module.Message.query.filter_by(id=message_id).delete()
+        app_module.db.session.commit()
+    assert search(client, auth, chat['bob'], 'wording', 'messages')['messages'] == []
@@ -0,0 +1,42 @@
+import queue
+import uuid
+
+import socketio
+
+import app as app_module
+
+def memory_server(channel, received):
+    # A Socket.IO server on the memory backend that records every emit it receives from the channel
+    manager = app_module.MemoryPubSubManager(channel=channel)
+    server = socketio.Server(async_mode='threading', client_manager=manager)
+    handle_emit = manager._handle_emit
+
+    def record(message):
+        received.put(message)
+        handle_emit(message)
+
+    manager._handle_emit = record
+    manager.initialize()
+    return server
+
+def test_room_emit_reaches_every_server_on_the_channel():
+    channel = f'test-{uuid.uuid4().hex}'
+    first, second = queue.Queue(), queue.Queue()
+    sender = memory_server(channel, first)
+    memory_server(channel, second)
+
+    sender.emit('message', {'content': 'hi'}, room='chat_1')
+
+    for received in (first, second):
+        message = received.get(timeout=2)
+        assert (message['event'], message['data'], message['room']) == ('message', {'content': 'hi'}, 'chat_1')
+
+def test_servers_on_other_channels_are_not_reached():
+    first, other = queue.Queue(), queue.Queue()
+    sender = memory_server(f'test-{uuid.uuid4().hex}', first)
+    memory_server(f'test-{uuid.uuid4().hex}', other)
+
+    sender.emit('message', {'content': 'hi'}, room='chat_1')
+
+    assert first.get(timeout=2)['room'] == 'chat_1'
+    assert other.empty()
@@ -0,0 +1,56 @@
+import pytest
+
+import app as app_module
+
+def test_socket_message_is_saved_and_broadcast(chat, connect, wait_for):
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+
+    assert alice.emit('send_message', {'chatId': chat['id'], 'content': 'hi', 'clientId': 'temp-1'}, callback=True)
+
+    [message] = wait_for(alice, 'message')
+    assert message['content'] == 'hi'
+    assert message['clientId'] == 'temp-1'
+    assert isinstance(message['id'], int)
+
+def test_ingest_survives_a_failed_broadcast(chat, connect, wait_for, monkeypatch):
+    alice = connect(chat['alice'])
+    alice.emit('join_chat', {'chatId': chat['id']})
+    broadcast = app_module.broadcast_messages
+    failures = []
+
+    def fail_once(payloads, client_ids=None):
+        if not failures:
+            failures.append(payloads)
+            raise ConnectionError('message queue is down')
+        broadcast(payloads, client_ids)
+
+    monkeypatch.setattr(app_module, 'broadcast_messages', fail_once)
+    assert alice.emit('send_message', {'chatId': chat['id'], 'content': 'lost', 'clientId': 'temp-1'}, callback=True)
+    assert wait_for(alice, 'message', timeout=0.5) == []
+    assert len(failures) == 1
+
+    assert alice.emit('send_message', {'chatId': chat['id'], 'content': 'delivered', 'clientId': 'temp-2'}, callback=True)
+    [message] = wait_for(alice, 'message')
+    assert message['content'] == 'delivered'
+
+@pytest.mark.parametrize('payload, error', [
+    ({'content': ''}, 'Message content is required'),
+    ({'content': 'hi', 'type': 'sticker'}, 'Message content is required'),
+])
+def test_invalid_socket_message_is_reported_to_sender(chat, connect, wait_for, payload, error):
+    alice = connect(chat['alice'])
+
+    assert alice.emit('send_message', dict(payload, chatId=chat['id'], clientId='temp-2'), callback=True) is False
+
+    [rejection] = wait_for(alice, 'message_error')
+    assert rejection == {'chatId': chat['id'], 'clientId': 'temp-2', 'error': error}
+
+def test_non_member_socket_message_is_reported_to_sender(chat, connect, wait_for):
+    carol = connect(chat['carol'])
+
+    assert carol.emit('send_message', {'chatId': chat['id'], 'content': 'hi', 'clientId': 'temp-3'}, callback=True) is False
+
+    [rejection] = wait_for(carol, 'message_error')
+    assert rejection['clientId'] == 'temp-3'
+    assert rejection['error'] == 'Access denied'
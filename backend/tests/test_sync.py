@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+
+def sync(client, auth, token, since=None, etag=None):
+    headers = auth(token)
+    if etag:
+        headers['If-None-Match'] = etag
+    return client.get('/api/sync', query_string={'since': since} if since else {}, headers=headers)
+
+def add_note(client, auth, token, title):
+    response = client.post('/api/notes', json={'title': title, 'content': ''}, headers=auth(token))
+    assert response.status_code == 201, response.json
+    return response.json['note']['id']
+
+@pytest.fixture
+def settled(monkeypatch):
+    # Treat every change as settled so deltas and ETags can be checked without waiting out the overlap
+    monkeypatch.setattr(app_module, 'SYNC_OVERLAP', timedelta(0))
+
+def test_unchanged_poll_is_not_modified(client, auth, chat, settled):
+    add_note(client, auth, chat['alice'], 'Plans')
+    first = sync(client, auth, chat['alice'])
+    assert first.status_code == 200
+
+    repeat = sync(client, auth, chat['alice'], etag=first.headers['ETag'])
+    assert repeat.status_code == 304
+    assert repeat.headers['ETag'] == first.headers['ETag']
+    assert repeat.data == b''
+
+def test_changes_invalidate_the_etag(client, auth, chat, settled):
+    first = sync(client, auth, chat['alice'])
+
+    add_note(client, auth, chat['alice'], 'Plans')
+
+    response = sync(client, auth, chat['alice'], etag=first.headers['ETag'])
+    assert response.status_code == 200
+    assert response.headers['ETag'] != first.headers['ETag']
+
+def test_delta_returns_only_rows_changed_after_since(client, auth, chat, settled):
+    add_note(client, auth, chat['alice'], 'Old')
+    full = sync(client, auth, chat['alice']).json
+    assert [note['title'] for note in full['notes']] == ['Old']
+    assert [entry['id'] for entry in full['chats']] == [chat['id']]
+
+    add_note(client, auth, chat['alice'], 'New')
+    delta = sync(client, auth, chat['alice'], since=full['watermark']).json
+    assert [note['title'] for note in delta['notes']] == ['New']
+    assert delta['chats'] == []
+    assert delta['watermark'] > full['watermark']
+
+    client.post('/api/chats/messages', json={'chatId': chat['id'], 'content': 'ping'}, headers=auth(chat['bob']))
+    delta = sync(client, auth, chat['alice'], since=delta['watermark']).json
+    assert delta['notes'] == []
+    assert [(entry['id'], entry['unreadCount']) for entry in delta['chats']] == [(chat['id'], 1)]
+
+def test_deleted_notes_arrive_as_tombstones(client, auth, chat, settled):
+    note_id = add_note(client, auth, chat['alice'], 'Scratch')
+    watermark = sync(client, auth, chat['alice']).json['watermark']
+
+    client.delete(f'/api/notes/{note_id}', headers=auth(chat['alice']))
+
+    delta = sync(client, auth, chat['alice'], since=watermark).json
+    assert delta['deleted']['notes'] == [note_id]
+    assert delta['notes'] == []
+    # Another user's sync never sees the tombstone
+    assert sync(client, auth, chat['bob'], since=watermark).json['deleted']['notes'] == []
+
+def test_invalid_since_is_rejected(client, auth, chat):
+    response = sync(client, auth, chat['alice'], since='last tuesday')
+
+    assert response.status_code == 400
+
+def test_late_commit_below_the_watermark_is_still_delivered(app, client, auth, chat):
+    add_note(client, auth, chat['alice'], 'First')
+    watermark = sync(client, auth, chat['alice']).json['watermark']
+
+    # A row stamped before the watermark but committed after the client synced
+    late = add_note(client, auth, chat['alice'], 'Late')
+    with app.app_context():
+        app_module.Note.query.filter_by(id=late).update(
+            {'updated_at': datetime.fromisoformat(watermark) - timedelta(seconds=1)}
+        )
+        app_module.db.session.commit()
+
+    delta = sync(client, auth, chat['alice'], since=watermark).json
+    assert 'Late' in [note['title'] for note in delta['notes']]
+
+def test_unsettled_changes_get_no_etag(client, auth, chat):
+    add_note(client, auth, chat['alice'], 'Plans')
+
+    response = sync(client, auth, chat['alice'])
+
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
@@ -0,0 +1,43 @@
+import app as app_module
+
+def bob_as_seen_by_alice(client, auth, chat):
+    [entry] = client.get('/api/chats', headers=auth(chat['alice'])).json['chats']
+    [bob] = [user for user in entry['participants'] if user['id'] == chat['bobId']]
+    return bob
+
+def test_profile_updates_replace_the_cached_user(client, auth, chat):
+    assert bob_as_seen_by_alice(client, auth, chat)['displayName'] == 'Bob'
+    assert chat['bobId'] in app_module.user_cache.entries
+
+    client.put('/api/auth/profile', json={'displayName': 'Robert'}, headers=auth(chat['bob']))
+
+    assert bob_as_seen_by_alice(client, auth, chat)['displayName'] == 'Robert'
+    assert client.get('/api/auth/me', headers=auth(chat['bob'])).json['user']['displayName'] == 'Robert'
+
+def test_login_replaces_the_cached_user(app, client, auth, chat):
+    with app.app_context():
+        app_module.User.query.filter_by(id=chat['bobId']).update({'is_online': False, 'last_seen': None})
+        app_module.db.session.commit()
+    app_module.user_cache.invalidate(chat['bobId'])
+    assert bob_as_seen_by_alice(client, auth, chat)['lastSeen'] is None
+
+    response = client.post('/api/auth/login', json={'email': 'bob@example.com', 'password': 'correct horse'})
+    assert response.status_code == 200
+
+    bob = bob_as_seen_by_alice(client, auth, chat)
+    assert bob['isOnline'] is True
+    assert bob['lastSeen'] == response.json['user']['lastSeen'] is not None
+
+def test_presence_flushes_invalidate_the_cached_user(app, client, auth, chat, connect):
+    assert bob_as_seen_by_alice(client, auth, chat)['isOnline'] is False
+
+    bob = connect(chat['bob'])
+    with app.app_context():
+        app_module.flush_presence()
+    assert chat['bobId'] not in app_module.user_cache.entries
+    assert bob_as_seen_by_alice(client, auth, chat)['isOnline'] is True
+
+    bob.disconnect()
+    with app.app_context():
+        app_module.flush_presence()
+    assert bob_as_seen_by_alice(client, auth, chat)['isOnline'] is False
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import app as app_module
+
+def find(client, auth, token, q):
+    response = client.get('/api/users/search', query_string={'q': q}, headers=auth(token))
+    assert response.status_code == 200, response.json
+    return [user['username'] for user in response.json['users']]
+
+def rename(client, auth, token, **fields):
+    response = client.put('/api/auth/profile', json=fields, headers=auth(token))
+    assert response.status_code == 200, response.json
+
+def test_matches_are_ranked_by_how_they_match(client, auth, register):
+    searcher, _ = register('samson')
+    register('busam')
+    register('samwise')
+    register('sam')
+    big, _ = register('zed')
+    rename(client, auth, big, displayName='Big Samuel')
+
+    # Exact username, username prefix, name-word prefix, then substring; the caller is never listed
+    assert find(client, auth, searcher, 'sam') == ['sam', 'samwise', 'zed', 'busam']
+    assert find(client, auth, searcher, 'SAMW') == ['samwise']
+    assert find(client, auth, searcher, 'samson') == []
+
+def test_shorter_usernames_win_within_a_rank(client, auth, register):
+    searcher, _ = register('carol')
+    for username in ('annabelle', 'annie', 'anna'):
+        register(username)
+
+    assert find(client, auth, searcher, 'ann') == ['anna', 'annie', 'annabelle']
+
+def test_profile_renames_are_searchable_at_once(client, auth, register):
+    searcher, _ = register('carol')
+    renamed, _ = register('busam')
+
+    rename(client, auth, renamed, username='quinn', displayName='Quinn Harper')
+
+    assert find(client, auth, searcher, 'busam') == []
+    assert find(client, auth, searcher, 'quinn') == ['quinn']
+    assert find(client, auth, searcher, 'harp') == ['quinn']
+
+def test_renames_on_other_workers_are_picked_up(app, client, auth, register):
+    searcher, _ = register('carol')
+    _, user = register('busam')
+    assert find(client, auth, searcher, 'busam') == ['busam']
+
+    # Another worker renamed the user; this worker's index only learns of it from the database
+    with app.app_context():
+        app_module.User.query.filter_by(id=user['id']).update({
+            'username': 'quinn', 'display_name': 'Quinn', 'updated_at': datetime.utcnow()
+        })
+        app_module.db.session.commit()
+    app_module.user_search_index.checked_at = 0.0
+
+    assert find(client, auth, searcher, 'busam') == []
+    assert find(client, auth, searcher, 'quinn') == ['quinn']
@@ -0,0 +1,26 @@
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+# Cooperative servers must patch the standard library before anything else is imported
+ASYNC_MODE = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+
+if ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+elif ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+    try:
+        from psycogreen.eventlet import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        pass
+
+from app import create_app
+
+app = create_app()
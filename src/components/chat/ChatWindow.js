@@ -9,8 +9,9 @@ import TypingIndicator from './TypingIndicator';
 
 const ChatWindow = ({ chat, onBack }) => {
   const [showEmojiPicker, setShowEmojiPicker] = useState(false);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
-  const { messages, sendMessage, loadMessages, typingUsers, startTyping, stopTyping } = useChat();
+  const { messages, messagePages, sendMessage, uploadMedia, loadMessages, loadOlderMessages, typingUsers, startTyping, stopTyping, markRead } = useChat();
   const { user } = useAuth();
   const { getChatWallpaperStyle } = useTheme();
 
@@ -21,14 +22,33 @@ const ChatWindow = ({ chat, onBack }) => {
     loadMessages(chat.id);
   }, [chat.id, loadMessages]);
 
+  // Only a new latest message scrolls down; prepending older history keeps the position
+  const lastMessageId = chatMessages[chatMessages.length - 1]?.id;
   useEffect(() => {
     scrollToBottom();
-  }, [chatMessages.length]);
+  }, [lastMessageId]);
+
+  // Everything on screen counts as read. Receipt marks are message ids, and imported history can
+  // carry ids above the newest message, so ack the highest id rather than the last one shown
+  const highestMessageId = chatMessages.reduce(
+    (highest, msg) => (typeof msg.id === 'number' && msg.id > highest ? msg.id : highest), 0
+  );
+  useEffect(() => {
+    if (highestMessageId) {
+      markRead(chat.id, highestMessageId);
+    }
+  }, [chat.id, highestMessageId, markRead]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  const handleLoadOlder = async () => {
+    setLoadingOlder(true);
+    await loadOlderMessages(chat.id);
+    setLoadingOlder(false);
+  };
+
   const handleSendMessage = async (content, type = 'text', metadata = {}) => {
     const result = await sendMessage(chat.id, content, type, metadata);
     if (result.success) {
@@ -102,6 +122,18 @@ const ChatWindow = ({ chat, onBack }) => {
 
       {/* Messages */}
       <div className="flex-1 overflow-y-auto scrollbar-hide p-4 space-y-2">
+        {messagePages[chat.id]?.hasMore && (
+          <div className="flex justify-center">
+            <button
+              onClick={handleLoadOlder}
+              disabled={loadingOlder}
+              className="text-sm text-primary-600 hover:text-primary-700 dark:text-primary-400 disabled:opacity-50"
+            >
+              {loadingOlder ? 'Loading...' : 'Load older messages'}
+            </button>
+          </div>
+        )}
+
         <AnimatePresence>
           {chatMessages.map((message, index) => (
             <motion.div
@@ -132,6 +164,7 @@ const ChatWindow = ({ chat, onBack }) => {
       {/* Message Input */}
       <MessageInput
         onSendMessage={handleSendMessage}
+        onUploadFile={uploadMedia}
         onTyping={handleTyping}
         showEmojiPicker={showEmojiPicker}
         onToggleEmojiPicker={() => setShowEmojiPicker(!showEmojiPicker)}
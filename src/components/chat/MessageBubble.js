@@ -8,16 +8,25 @@ const MessageBubble = ({ message, isOwn, showAvatar }) => {
     return date.toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
   };
 
+  // Uploads carry signed, expiring URLs that the server refreshes on every read
+  const apiUrl = process.env.REACT_APP_API_URL || 'http://localhost:5000';
+  const media = message.metadata?.media;
+  const mediaUrl = media ? apiUrl + media.url : message.metadata?.url;
+  const thumbnailUrl = media ? media.thumbnailUrl && apiUrl + media.thumbnailUrl : message.metadata?.thumbnailUrl;
+
   const renderMessageContent = () => {
     switch (message.type) {
       case 'image':
         return (
           <div className="max-w-xs">
-            <img
-              src={message.metadata.url}
-              alt="Shared content"
-              className="rounded-lg max-w-full h-auto"
-            />
+            <a href={mediaUrl} target="_blank" rel="noopener noreferrer">
+              <img
+                src={thumbnailUrl || mediaUrl}
+                alt="Shared content"
+                loading="lazy"
+                className="rounded-lg max-w-full h-auto"
+              />
+            </a>
             {message.content && (
               <p className="mt-2 text-sm">{message.content}</p>
             )}
@@ -28,7 +37,7 @@ const MessageBubble = ({ message, isOwn, showAvatar }) => {
         return (
           <div className="max-w-xs">
             <video
-              src={message.metadata.url}
+              src={mediaUrl}
               controls
               className="rounded-lg max-w-full h-auto"
             />
@@ -41,7 +50,7 @@ const MessageBubble = ({ message, isOwn, showAvatar }) => {
       case 'audio':
         return (
           <div className="flex items-center space-x-2">
-            <audio src={message.metadata.url} controls className="max-w-xs" />
+            <audio src={mediaUrl} controls className="max-w-xs" />
             {message.content && (
               <p className="text-sm">{message.content}</p>
             )}
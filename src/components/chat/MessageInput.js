@@ -2,7 +2,7 @@ import React, { useState, useRef, useEffect } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { useDropzone } from 'react-dropzone';
 
-const MessageInput = ({ onSendMessage, onTyping, showEmojiPicker, onToggleEmojiPicker }) => {
+const MessageInput = ({ onSendMessage, onUploadFile, onTyping, showEmojiPicker, onToggleEmojiPicker }) => {
   const [message, setMessage] = useState('');
   const [isTyping, setIsTyping] = useState(false);
   const [showAttachmentMenu, setShowAttachmentMenu] = useState(false);
@@ -63,21 +63,21 @@ const MessageInput = ({ onSendMessage, onTyping, showEmojiPicker, onToggleEmojiP
   };
 
   const handleFileUpload = (files) => {
-    files.forEach(file => {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        const type = file.type.startsWith('image/') ? 'image' :
-                    file.type.startsWith('video/') ? 'video' :
-                    file.type.startsWith('audio/') ? 'audio' : 'file';
-        
-        onSendMessage('', type, {
-          url: e.target.result,
-          filename: file.name,
-          size: formatFileSize(file.size),
-          type: file.type
-        });
-      };
-      reader.readAsDataURL(file);
+    // Upload first so the message only carries a reference to the stored file; the server attaches its URLs
+    files.forEach(async file => {
+      const result = await onUploadFile(file);
+      if (!result.success) {
+        console.error('Upload failed:', result.error);
+        return;
+      }
+      
+      const { media } = result;
+      onSendMessage('', media.kind, {
+        mediaId: media.id,
+        filename: file.name,
+        size: formatFileSize(file.size),
+        type: file.type
+      });
     });
     setShowAttachmentMenu(false);
   };
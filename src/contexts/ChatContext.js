@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect, useCallback } from 'react';
+import React, { createContext, useContext, useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import io from 'socket.io-client';
 import { useAuth } from './AuthContext';
@@ -17,10 +17,23 @@ export const ChatProvider = ({ children }) => {
   const [chats, setChats] = useState([]);
   const [activeChat, setActiveChat] = useState(null);
   const [messages, setMessages] = useState({});
+  const [messagePages, setMessagePages] = useState({});
   const [socket, setSocket] = useState(null);
   const [typingUsers, setTypingUsers] = useState({});
   const [onlineUsers, setOnlineUsers] = useState(new Set());
   const { isAuthenticated, user } = useAuth();
+  // Highest delivered/read message id per chat, sent to the server in batches
+  const pendingAcks = useRef({});
+
+  const queueAck = useCallback((chatId, field, messageId) => {
+    if (typeof messageId !== 'number') return;
+    const ack = pendingAcks.current[chatId] || { chatId };
+    ack[field] = Math.max(ack[field] || 0, messageId);
+    if (field === 'read') {
+      ack.delivered = Math.max(ack.delivered || 0, messageId);
+    }
+    pendingAcks.current[chatId] = ack;
+  }, []);
 
 
   // Configure axios to include JWT token
@@ -58,39 +71,105 @@ export const ChatProvider = ({ children }) => {
     });
     setSocket(newSocket);
 
+    const ackTimer = setInterval(() => {
+      const receipts = Object.values(pendingAcks.current);
+      if (receipts.length && newSocket.connected) {
+        pendingAcks.current = {};
+        newSocket.emit('ack', { receipts });
+      }
+    }, 1000);
+
     newSocket.on('message', (message) => {
+      if (String(message.senderId ?? message.sender?.id) !== String(user.id)) {
+        queueAck(message.chatId, 'delivered', message.id);
+      }
+      setMessages(prev => {
+        const existing = prev[message.chatId] || [];
+        // Replace our own optimistic copy (or a copy already saved over REST), otherwise append
+        const isKnown = msg => msg.id === message.id || (message.clientId && msg.id === message.clientId);
+        return {
+          ...prev,
+          [message.chatId]: existing.some(isKnown)
+            ? existing.map(msg => isKnown(msg) ? message : msg)
+            : [...existing, message]
+        };
+      });
+    });
+
+    newSocket.on('message_error', ({ chatId, clientId }) => {
       setMessages(prev => ({
         ...prev,
-        [message.chatId]: [
-          ...(prev[message.chatId] || []),
-          message
-        ]
+        [chatId]: (prev[chatId] || []).filter(msg => msg.id !== clientId)
+      }));
+    });
+
+    // Reaction deltas carry the new per-emoji total
+    newSocket.on('reaction', ({ chatId, messageId, emoji, count, userId, reacted }) => {
+      setMessages(prev => ({
+        ...prev,
+        [chatId]: (prev[chatId] || []).map(msg => {
+          if (msg.id !== messageId) return msg;
+          const isMine = String(userId) === String(user.id);
+          const reactions = (msg.reactions || []).filter(r => r.emoji !== emoji);
+          const current = (msg.reactions || []).find(r => r.emoji === emoji);
+          if (count > 0) {
+            reactions.push({
+              emoji,
+              count,
+              reacted: isMine ? reacted : Boolean(current?.reacted),
+              users: current?.users || []
+            });
+          }
+          return { ...msg, reactions: reactions.sort((a, b) => b.count - a.count) };
+        })
       }));
     });
 
-    newSocket.on('typing', (data) => {
-      setTypingUsers(prev => ({
+    // Receipt digests carry every member's marks; our messages take the lowest mark among the others
+    newSocket.on('receipts', ({ chatId, receipts }) => {
+      const others = receipts.filter(r => String(r.userId) !== String(user.id));
+      if (!others.length) return;
+      const delivered = Math.min(...others.map(r => r.delivered));
+      const read = Math.min(...others.map(r => r.read));
+      setMessages(prev => ({
         ...prev,
-        [data.chatId]: data.users
+        [chatId]: (prev[chatId] || []).map(msg => {
+          if (typeof msg.id !== 'number' || String(msg.senderId ?? msg.sender?.id) !== String(user.id)) return msg;
+          const status = msg.id <= read ? 'read' : msg.id <= delivered ? 'delivered' : 'sent';
+          return status === msg.status ? msg : { ...msg, status };
+        })
       }));
     });
 
-    newSocket.on('userOnline', (userId) => {
-      setOnlineUsers(prev => new Set([...prev, userId]));
+    newSocket.on('typing', ({ chatId, started, stopped }) => {
+      // Each server worker sends only the changes for its own sockets, so merge them into the list
+      setTypingUsers(prev => {
+        const stoppedIds = new Set(stopped.map(String));
+        const typers = (prev[chatId] || []).filter(typer => !stoppedIds.has(String(typer.id)));
+        started.forEach(typer => {
+          if (String(typer.id) !== String(user.id) && !typers.some(existing => String(existing.id) === String(typer.id))) {
+            typers.push(typer);
+          }
+        });
+        return { ...prev, [chatId]: typers };
+      });
     });
 
-    newSocket.on('userOffline', (userId) => {
+    // Presence changes arrive as periodic digests
+    newSocket.on('presence', ({ online, offline }) => {
       setOnlineUsers(prev => {
         const newSet = new Set(prev);
-        newSet.delete(userId);
+        online.forEach(userId => newSet.add(userId));
+        offline.forEach(userId => newSet.delete(userId));
         return newSet;
       });
     });
 
     return () => {
+      clearInterval(ackTimer);
       newSocket.close();
     };
-  }, [isAuthenticated, user]);
+  }, [isAuthenticated, user, queueAck]);
 
   const createChat = async (participantUsernames) => {
     try {
@@ -111,12 +190,14 @@ export const ChatProvider = ({ children }) => {
   };
 
   const sendMessage = async (chatId, content, type = 'text', metadata = {}) => {
+    const clientId = 'temp-' + Date.now();
     try {
       const message = {
         chatId,
         content,
         type,
         metadata,
+        clientId,
         timestamp: new Date().toISOString()
       };
 
@@ -125,10 +206,16 @@ export const ChatProvider = ({ children }) => {
         ...prev,
         [chatId]: [
           ...(prev[chatId] || []),
-          { ...message, id: 'temp-' + Date.now(), status: 'sending' }
+          { ...message, id: clientId, status: 'sending' }
         ]
       }));
 
+      // The server persists socket messages and broadcasts the saved copy to the room
+      if (socket && socket.connected) {
+        socket.emit('send_message', message);
+        return { success: true };
+      }
+
       const response = await axios.post(`${process.env.REACT_APP_API_URL || 'http://localhost:5000'}/api/chats/messages`, message, {
         headers: getAuthHeaders()
       });
@@ -138,21 +225,16 @@ export const ChatProvider = ({ children }) => {
       setMessages(prev => ({
         ...prev,
         [chatId]: prev[chatId].map(msg => 
-          msg.id.startsWith('temp-') ? sentMessage : msg
+          msg.id === clientId ? sentMessage : msg
         )
       }));
 
-      // Emit to socket
-      if (socket) {
-        socket.emit('sendMessage', sentMessage);
-      }
-
       return { success: true, message: sentMessage };
     } catch (error) {
       // Remove optimistic update on error
       setMessages(prev => ({
         ...prev,
-        [chatId]: prev[chatId].filter(msg => !msg.id.startsWith('temp-'))
+        [chatId]: prev[chatId].filter(msg => msg.id !== clientId)
       }));
 
       return { 
@@ -186,6 +268,10 @@ export const ChatProvider = ({ children }) => {
         ...prev,
         [chatId]: response.data.messages
       }));
+      setMessagePages(prev => ({
+        ...prev,
+        [chatId]: { hasMore: response.data.hasMore, before: response.data.cursors.before }
+      }));
       return { success: true };
     } catch (error) {
       return { 
@@ -195,6 +281,38 @@ export const ChatProvider = ({ children }) => {
     }
   }, [getAuthHeaders]);
 
+  // History is paged newest first; each call prepends the page before the oldest loaded message
+  const loadOlderMessages = useCallback(async (chatId) => {
+    const page = messagePages[chatId];
+    if (!page?.hasMore || !page.before) {
+      return { success: true };
+    }
+    try {
+      const response = await axios.get(`${process.env.REACT_APP_API_URL || 'http://localhost:5000'}/api/chats/${chatId}/messages`, {
+        params: { before: page.before },
+        headers: getAuthHeaders()
+      });
+      setMessages(prev => {
+        const existing = prev[chatId] || [];
+        const known = new Set(existing.map(msg => msg.id));
+        return {
+          ...prev,
+          [chatId]: [...response.data.messages.filter(msg => !known.has(msg.id)), ...existing]
+        };
+      });
+      setMessagePages(prev => ({
+        ...prev,
+        [chatId]: { hasMore: response.data.hasMore, before: response.data.cursors.before }
+      }));
+      return { success: true };
+    } catch (error) {
+      return { 
+        success: false, 
+        error: error.response?.data?.message || 'Failed to load messages' 
+      };
+    }
+  }, [messagePages, getAuthHeaders]);
+
   const startTyping = (chatId) => {
     if (socket) {
       socket.emit('typing', { chatId, isTyping: true });
@@ -207,6 +325,10 @@ export const ChatProvider = ({ children }) => {
     }
   };
 
+  const markRead = useCallback((chatId, messageId) => {
+    queueAck(chatId, 'read', messageId);
+  }, [queueAck]);
+
   const searchUsers = useCallback(async (query) => {
     try {
       if (!isAuthenticated || !user) {
@@ -244,10 +366,42 @@ export const ChatProvider = ({ children }) => {
     }
   };
 
+  const uploadMedia = async (file) => {
+    try {
+      const formData = new FormData();
+      formData.append('file', file);
+      const response = await axios.post(`${process.env.REACT_APP_API_URL || 'http://localhost:5000'}/api/media`, formData, {
+        headers: getAuthHeaders()
+      });
+      return { success: true, media: response.data.media };
+    } catch (error) {
+      return { 
+        success: false, 
+        error: error.response?.data?.error || 'Failed to upload file' 
+      };
+    }
+  };
+
+  const removeReaction = async (messageId, emoji) => {
+    try {
+      const response = await axios.delete(`${process.env.REACT_APP_API_URL || 'http://localhost:5000'}/api/chats/messages/${messageId}/reactions`, {
+        data: { emoji },
+        headers: getAuthHeaders()
+      });
+      return { success: true, reaction: response.data.reaction };
+    } catch (error) {
+      return { 
+        success: false, 
+        error: error.response?.data?.message || 'Failed to remove reaction' 
+      };
+    }
+  };
+
   const value = {
     chats,
     activeChat,
     messages,
+    messagePages,
     typingUsers,
     onlineUsers,
     setActiveChat,
@@ -255,10 +409,14 @@ export const ChatProvider = ({ children }) => {
     sendMessage,
     loadChats,
     loadMessages,
+    loadOlderMessages,
     startTyping,
     stopTyping,
+    markRead,
     searchUsers,
-    addReaction
+    addReaction,
+    removeReaction,
+    uploadMedia
   };
 
   return (